@@ -0,0 +1,99 @@
+import argparse
+import gc
+import hashlib
+import multiprocessing
+import random
+import time
+
+from rdflib import Graph, Literal, Namespace, URIRef
+
+from pyfusekiutil.rdf_utility import *
+
+"""Compares the single pass GraphRules with the rdf_utility helper functions called one after another.
+
+Usage: python -m benchmarks.rdf_rules [-n NUMBER_OF_TRIPLES]   (from the repository root)
+
+Both are run on the same synthetic graph with the transformations used by update_fast. Each run happens in a fresh
+process, so that neither pays for the memory left behind by the other. The results have to be identical.
+"""
+
+SCHEMA = Namespace('http://schema.org/')
+EX = Namespace('http://example.org/')
+TYPES = [SCHEMA.Event, SCHEMA.CreativeWork, SCHEMA.Intangible, SCHEMA.Person, SCHEMA.Place, SCHEMA.Organization,
+         OWL.Class]
+
+
+def synthetic_graph(triples: int, seed=42):
+    """A deterministic graph with about the given number of triples. Each concept has six to seven triples."""
+    random.seed(seed)
+    graph = Graph()
+    concept = 0
+    while len(graph) < triples:
+        s = EX['c' + str(concept)]
+        graph.add((s, RDF.type, random.choice(TYPES)))
+        graph.add((s, RDFS.label, Literal('Label ' + str(concept))))
+        graph.add((s, SKOS.altLabel, Literal('Alternative ' + str(concept), lang='de')))
+        graph.add((s, DC.identifier, Literal(str(concept))))
+        graph.add((s, SCHEMA.sameAs, URIRef('http://id.example.org/' + str(concept))))
+        if concept > 0:
+            graph.add((s, RDFS.subClassOf, EX['c' + str(random.randrange(concept))]))
+        graph.add((s, DCTERMS.modified, Literal('2018-01-01')))
+        concept += 1
+    return graph
+
+
+def with_helpers(graph):
+    for old in TYPES:
+        add_type(graph, old, SKOS.Concept)
+    add_skos_predicate_variant(graph, RDFS.label, SKOS.prefLabel)
+    add_skos_predicate_variant(graph, DC.identifier, SKOS.notation)
+    add_language_tags(graph, 'en')
+    add_skos_predicate_variant(graph, RDFS.subClassOf, SKOS.broader)
+
+
+def with_rules(graph):
+    rules = GraphRules()
+    for old in TYPES:
+        rules.type(old, SKOS.Concept)
+    rules.predicate_variant(RDFS.label, SKOS.prefLabel)
+    rules.predicate_variant(DC.identifier, SKOS.notation)
+    rules.language_tags('en')
+    rules.predicate_variant(RDFS.subClassOf, SKOS.broader)
+    rules.apply(graph)
+
+
+def measure(name, triples):
+    """Run the transformations on a new synthetic graph. Returns the time taken and a digest of the result."""
+    graph = synthetic_graph(triples)
+    gc.collect()
+    start = time.perf_counter()
+    TRANSFORMATIONS[name](graph)
+    elapsed = time.perf_counter() - start
+    digest = hashlib.sha256('\n'.join(sorted(' '.join(t.n3() for t in triple) for triple in graph)).encode('utf-8'))
+    return elapsed, len(graph), digest.hexdigest()
+
+
+TRANSFORMATIONS = {
+    'helpers': with_helpers,
+    'rules': with_rules
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the rdf_utility transformations.')
+    parser.add_argument('-n', type=int, default=1000000, dest='triples', help='Size of the synthetic graph.')
+    args = parser.parse_args()
+
+    results = dict()
+    for name in TRANSFORMATIONS:
+        with multiprocessing.Pool(1) as pool:
+            results[name] = pool.apply(measure, (name, args.triples))
+        print('{:8} {:.2f} s, {} triples in the result'.format(name + ':', results[name][0], results[name][1]))
+
+    if results['helpers'][2] != results['rules'][2]:
+        raise SystemExit('The results differ!')
+    print('Results are identical. Speedup: {:.1f}x'.format(results['helpers'][0] / results['rules'][0]))
+
+
+if __name__ == '__main__':
+    main()
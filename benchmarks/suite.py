@@ -0,0 +1,140 @@
+import argparse
+import gc
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+import skosify
+from rdflib import Graph
+from rdflib.namespace import SKOS, RDFS, OWL
+
+from benchmarks.synthetic import EX, SCHEME, FORMATS, synthetic_vocabulary, write_vocabulary
+from pyfusekiutil.fuseki_stub import FusekiStub
+from pyfusekiutil.core_fuseki_update import SKOSIFY_OPTIONS
+from pyfusekiutil.fuseki_utility import FusekiClient, NT_MIME_TYPE, put_graph, bulk_load
+from pyfusekiutil.rdf_utility import *
+
+"""Measures every stage of a vocabulary update on a synthetic vocabulary. Runs completely offline.
+
+Usage: python -m benchmarks.suite [-c CONCEPTS] [--depth DEPTH] [--cycles CYCLES] [--languages en,de,fr]
+                                  [--label-density DENSITY] [--dirty FRACTION] [-r REPEAT] [--json FILE]
+
+The vocabulary (see synthetic.py) is written in each format. The suite then measures parsing each format, each
+rdf_utility transformation, GraphRules, skosify, serializing to each format and the uploads. The uploads are sent to
+a local stand-in for Fuseki (see fuseki_stub.py in the package). Each measurement runs in a fresh process on a freshly
+parsed graph. Only the measured step is timed. Prints the time and the triples per second of the graph going in.
+"""
+
+GRAPH_NAME = 'http://example.org/synthetic'
+
+
+def rules(graph):
+    rules = GraphRules()
+    rules.type(OWL.Class, SKOS.Concept)
+    rules.predicate_variant(RDFS.label, SKOS.prefLabel)
+    rules.predicate_variant(RDFS.subClassOf, SKOS.broader)
+    rules.language_tags('en')
+    rules.inverse(SKOS.broader, SKOS.narrower)
+    rules.apply(graph)
+
+
+def upload(client: FusekiClient, source):
+    put_graph(GRAPH_NAME, source, NT_MIME_TYPE, client)
+
+
+# The measured steps on a parsed graph. Each gets the graph, the files of the vocabulary and the url of the Fuseki
+# stand-in. Parsing and serializing are measured for each format.
+STEPS = {
+    'add_type': lambda graph, paths, url: add_type(graph, OWL.Class, SKOS.Concept),
+    'add_skos_predicate_variant': lambda graph, paths, url: add_skos_predicate_variant(graph, RDFS.label,
+                                                                                       SKOS.prefLabel),
+    'add_language_tags': lambda graph, paths, url: add_language_tags(graph, 'en'),
+    'replace_triple_object': lambda graph, paths, url: replace_triple_object(graph, OWL.Class, SKOS.Concept),
+    'expand_inverse_of_relations': lambda graph, paths, url: expand_inverse_of_relations(graph, SKOS.broader,
+                                                                                         SKOS.narrower),
+    'set_in_scheme': lambda graph, paths, url: set_in_scheme(graph, SCHEME),
+    'make_top_concept': lambda graph, paths, url: make_top_concept(graph, SKOS.Concept, SCHEME),
+    'GraphRules': lambda graph, paths, url: rules(graph),
+    'skosify': lambda graph, paths, url: skosify.skosify(graph, label='Synthetic', namespace=EX, **SKOSIFY_OPTIONS),
+    'upload file': lambda graph, paths, url: upload(FusekiClient(url), paths['nt']),
+    'upload graph': lambda graph, paths, url: upload(FusekiClient(url), graph),
+    'upload gzip': lambda graph, paths, url: upload(FusekiClient(url, compress=True), paths['nt']),
+    'upload staging': lambda graph, paths, url: upload(FusekiClient(url, staging=True), paths['nt']),
+    'bulk_load': lambda graph, paths, url: bulk_load(GRAPH_NAME, paths['nt'],
+                                                     FusekiClient(url, chunk_size=max(len(graph) // 10, 1))),
+}
+
+
+def measure(name, paths, temp, url):
+    """Run a step in this process. Returns the time taken and the number of triples of the graph going in."""
+    logging.disable(logging.WARNING)
+    if name.startswith('parse '):
+        extension = name.split(' ')[1]
+        gc.collect()
+        start = time.perf_counter()
+        graph = Graph().parse(paths[extension], format=FORMATS[extension])
+        return time.perf_counter() - start, len(graph)
+
+    graph = Graph().parse(paths['nt'], format='nt')
+    triples = len(graph)
+    gc.collect()
+    start = time.perf_counter()
+    if name.startswith('serialize '):
+        extension = name.split(' ')[1]
+        graph.serialize(destination=os.path.join(temp, 'serialized.' + extension), format=FORMATS[extension],
+                        encoding='utf-8')
+    else:
+        STEPS[name](graph, paths, url)
+    return time.perf_counter() - start, triples
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmark of the stages of a vocabulary update.')
+    parser.add_argument('-c', type=int, default=10000, dest='concepts', help='Number of concepts.')
+    parser.add_argument('--depth', type=int, default=4, help='Levels of the broader hierarchy.')
+    parser.add_argument('--cycles', type=int, default=10, help='Number of cycles in the broader hierarchy.')
+    parser.add_argument('--languages', default='en,de,fr', help='Comma separated languages of the labels.')
+    parser.add_argument('--label-density', type=float, default=1.5,
+                        help='Average number of labels per concept and language.')
+    parser.add_argument('--dirty', type=float, default=0.1, help='Fraction of the concepts described with OWL.')
+    parser.add_argument('-r', '--repeat', type=int, default=1, help='Run each step this often and keep the fastest.')
+    parser.add_argument('-k', dest='only', default=None, help='Only run the steps whose name contains this.')
+    parser.add_argument('--json', default=None, help='Also write the results to this file.')
+    args = parser.parse_args()
+
+    temp = tempfile.mkdtemp(prefix='pyfuseki-benchmark-')
+    try:
+        graph = synthetic_vocabulary(args.concepts, args.depth, args.cycles, args.languages.split(','),
+                                     args.label_density, args.dirty)
+        paths = write_vocabulary(graph, os.path.join(temp, 'synthetic'))
+        print('Synthetic vocabulary: {} concepts, {} triples.'.format(args.concepts, len(graph)))
+        del graph
+
+        names = ['parse ' + extension for extension in FORMATS] + list(STEPS) + \
+                ['serialize ' + extension for extension in FORMATS]
+        names = [name for name in names if args.only is None or args.only in name]
+        results = list()
+        with FusekiStub() as stub:
+            for name in names:
+                runs = list()
+                for _ in range(args.repeat):
+                    with multiprocessing.Pool(1) as pool:
+                        runs.append(pool.apply(measure, (name, paths, temp, stub.url)))
+                seconds, triples = min(runs)
+                results.append({'step': name, 'seconds': seconds, 'triples': triples,
+                                'triples_per_second': triples / max(seconds, 1e-9)})
+                print('{:28} {:8.3f} s {:12,.0f} triples/s'.format(name + ':', seconds, triples / max(seconds, 1e-9)))
+    finally:
+        shutil.rmtree(temp)
+
+    if args.json is not None:
+        with open(args.json, 'w') as file:
+            json.dump({'arguments': vars(args), 'results': results}, file, indent='    ')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+import argparse
+import os
+import random
+
+from rdflib import Graph, Literal, Namespace
+from rdflib.namespace import SKOS, RDF, RDFS, OWL, DC
+
+"""A deterministic generator of synthetic SKOS vocabularies.
+
+Usage: python -m benchmarks.synthetic [-c CONCEPTS] [--depth DEPTH] [--cycles CYCLES] [--languages en,de,fr]
+                                      [--label-density DENSITY] [--dirty FRACTION] [-o PREFIX]
+
+Writes the vocabulary as PREFIX.ttl, PREFIX.rdf, PREFIX.nt and PREFIX.jsonld. The same arguments always give the same
+vocabulary. Some of the concepts are described the way many of the vocabularies in the sheet are: as owl:Class with
+untagged rdfs:label and rdfs:subClassOf. These give the rdf_utility transformations and skosify something to do.
+"""
+
+EX = Namespace('http://example.org/synthetic/')
+SCHEME = EX['scheme']
+
+# File extensions and rdflib formats of the serializations.
+FORMATS = {
+    'ttl': 'turtle',
+    'rdf': 'xml',
+    'nt': 'nt',
+    'jsonld': 'json-ld'
+}
+
+# Syllables of the labels in each language. Other languages use the english ones.
+SYLLABLES = {
+    'en': ['an', 'ber', 'ca', 'do', 'el', 'fi', 'gra', 'hy', 'is', 'lo', 'mer', 'no', 'pho', 'ro', 'sta', 'ty'],
+    'de': ['ab', 'bär', 'ch', 'die', 'ein', 'für', 'grü', 'haus', 'ig', 'kun', 'lö', 'ma', 'sch', 'ung', 'wä', 'zei'],
+    'fr': ['a', 'bé', 'ce', 'dé', 'è', 'fo', 'gê', 'hu', 'ï', 'la', 'mé', 'no', 'ou', 'pré', 'ré', 'ço'],
+}
+
+
+def label(rng: random.Random, language: str, concept: int):
+    """A label of two to four random words. The number of the concept keeps it unique."""
+    syllables = SYLLABLES.get(language, SYLLABLES['en'])
+    words = [''.join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) for _ in range(rng.randint(2, 4))]
+    return ' '.join(words).capitalize() + ' ' + str(concept)
+
+
+def synthetic_vocabulary(concepts=10000, depth=4, cycles=0, languages=('en',), label_density=1.0, dirty=0.1,
+                         seed=42):
+    """
+    Create a deterministic SKOS vocabulary.
+
+    :param concepts:        Number of concepts.
+    :param depth:           Number of levels of the broader hierarchy. The concepts are spread evenly over the levels.
+                            The concepts of the first level are the top concepts of the scheme.
+    :param cycles:          Number of broader relations from a concept to one of its descendants.
+    :param languages:       The languages of the labels.
+    :param label_density:   Average number of labels per concept and language. The first label is the prefLabel,
+                            all others are altLabels. Below 1 some concepts have no label in a language.
+    :param dirty:           Fraction of the concepts described with OWL and RDFS instead of SKOS.
+    :param seed:            Seed of the random numbers.
+    :return:                The vocabulary as rdflib Graph.
+    """
+    rng = random.Random(seed)
+    graph = Graph()
+    graph.bind('skos', SKOS)
+    graph.bind('ex', EX)
+    graph.add((SCHEME, RDF.type, SKOS.ConceptScheme))
+    graph.add((SCHEME, DC.title, Literal('Synthetic vocabulary', lang=languages[0])))
+
+    depth = max(1, min(depth, concepts))
+    levels = [list() for _ in range(depth)]
+    parents = dict()
+    for number in range(concepts):
+        level = number * depth // concepts
+        concept = EX['c' + str(number)]
+        levels[level].append(number)
+        is_dirty = rng.random() < dirty
+
+        if is_dirty:
+            graph.add((concept, RDF.type, OWL.Class))
+        else:
+            graph.add((concept, RDF.type, SKOS.Concept))
+            graph.add((concept, SKOS.inScheme, SCHEME))
+        graph.add((concept, SKOS.notation, Literal(str(number))))
+
+        for language in languages:
+            labels = int(label_density) + (1 if rng.random() < label_density % 1 else 0)
+            for index in range(labels):
+                if index > 0:
+                    graph.add((concept, SKOS.altLabel, Literal(label(rng, language, number), lang=language)))
+                elif is_dirty:
+                    graph.add((concept, RDFS.label, Literal(label(rng, language, number))))
+                else:
+                    graph.add((concept, SKOS.prefLabel, Literal(label(rng, language, number), lang=language)))
+
+        if level == 0:
+            if not is_dirty:
+                graph.add((concept, SKOS.topConceptOf, SCHEME))
+                graph.add((SCHEME, SKOS.hasTopConcept, concept))
+        else:
+            parent = rng.choice(levels[level - 1])
+            parents[number] = parent
+            graph.add((concept, RDFS.subClassOf if is_dirty else SKOS.broader, EX['c' + str(parent)]))
+
+        if number > 0 and rng.random() < 0.1:
+            graph.add((concept, SKOS.related, EX['c' + str(rng.randrange(number))]))
+
+    # a cycle: an ancestor of a concept from the last level becomes narrower than it.
+    if depth > 1:
+        for _ in range(cycles):
+            number = rng.choice(levels[-1])
+            ancestor = parents[number]
+            for _ in range(rng.randrange(depth - 1)):
+                ancestor = parents[ancestor]
+            graph.add((EX['c' + str(ancestor)], SKOS.broader, EX['c' + str(number)]))
+    return graph
+
+
+def write_vocabulary(graph: Graph, prefix: str, extensions=tuple(FORMATS)):
+    """Serialize the vocabulary in each format. Returns the paths of the files by extension."""
+    paths = dict()
+    for extension in extensions:
+        paths[extension] = prefix + '.' + extension
+        graph.serialize(destination=paths[extension], format=FORMATS[extension], encoding='utf-8')
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic SKOS vocabulary.')
+    parser.add_argument('-c', type=int, default=10000, dest='concepts', help='Number of concepts.')
+    parser.add_argument('--depth', type=int, default=4, help='Levels of the broader hierarchy.')
+    parser.add_argument('--cycles', type=int, default=0, help='Number of cycles in the broader hierarchy.')
+    parser.add_argument('--languages', default='en', help='Comma separated languages of the labels.')
+    parser.add_argument('--label-density', type=float, default=1.0,
+                        help='Average number of labels per concept and language.')
+    parser.add_argument('--dirty', type=float, default=0.1, help='Fraction of the concepts described with OWL.')
+    parser.add_argument('--seed', type=int, default=42, help='Seed of the random numbers.')
+    parser.add_argument('-o', default='synthetic', dest='prefix', help='Path of the files without extension.')
+    args = parser.parse_args()
+
+    graph = synthetic_vocabulary(args.concepts, args.depth, args.cycles, args.languages.split(','),
+                                 args.label_density, args.dirty, args.seed)
+    for extension, path in write_vocabulary(graph, args.prefix).items():
+        print('{:7} {} triples, {:.1f} MB in {}'.format(extension + ':', len(graph), os.path.getsize(path) / 1e6,
+                                                        path))
+
+
+if __name__ == '__main__':
+    main()
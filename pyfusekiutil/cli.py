@@ -4,7 +4,9 @@ from configparser import ConfigParser
 import argparse
 
 from pyfusekiutil.core_fuseki_update import update_fuseki
-from pyfusekiutil.fuseki_utility import get_graph, delete_graph
+from pyfusekiutil.metrics import Metrics
+from pyfusekiutil.replay import Recording
+from pyfusekiutil.fuseki_utility import get_graph, delete_graph, replace_graph, FusekiClient, set_default_client
 from pyfusekiutil.fuseki_utility import create_diff
 from pyfusekiutil.skosify_utility import skosfiy
 from pyfusekiutil.updates import *
@@ -31,6 +33,9 @@ def main():
                         help='Run the main update script to update the triple store from the google spreadsheet.')
     parser.add_argument('-n', action='store', type=int, dest='number_of_lines', default=-1,
                         help='Number of lines the update should run through in the google sheets.')
+    parser.add_argument('-p', action='store_true', dest='pipelined',
+                        help='Run the main update script with concurrent download, skosify and upload stages. '
+                             'The number of workers for each stage is configured in the [pipeline] section.')
     parser.add_argument('-s', action='store', dest='name', default=None,
                         help='The name of a specific thesaurus to be loaded/updated. Accepts one of the following '
                              'values: {}.'.format(specific_functions.keys()))
@@ -44,6 +49,11 @@ def main():
                         help='Create or replace a specific graph on the Fuseki store. '
                              'Requires a [--uri URI] to be specified and the [-f FILE_PATH] full path to the file '
                              'containing the RDF data (in turtle (.ttl) format).')
+    parser.add_argument('-bulk', dest='bulk_request', action='store_true',
+                        help='Replace a specific graph on the Fuseki store with a large file, which is sent in chunks. '
+                             'Requires a [--uri URI] to be specified and the [-f FILE_PATH] full path to the file '
+                             'containing the RDF data (in n-triples (.nt) format). Can be run again to resume an '
+                             'interrupted load.')
     parser.add_argument('-get', dest='get_request', action='store_true',
                         help='Get a specific graph from the Fuseki store and store it in a local file '
                              '(in turtle (.ttl) format).')
@@ -60,6 +70,23 @@ def main():
     parser.add_argument('-l', dest='label', action='store', help='Add a label for skosify.')
     parser.add_argument('--namespace', action='store', default=None, help='The namespace for skosify.')
     parser.add_argument('--default-language', action='store', default=None, help='The default language for skosify.')
+    parser.add_argument('--profile', action='store', default=None,
+                        help='Profile the stages of a vocabulary with cProfile and tracemalloc. Takes the title of the '
+                             'vocabulary in the sheet or the name of a loader given with -s. The profiles are written '
+                             'to profiles/ in the output folder.')
+    parser.add_argument('--resume', action='store_true', dest='resume',
+                        help='Continue the last run of -a if it did not finish. Rows it finished are not loaded again '
+                             'and rows continue from the files it left behind (see [journal]).')
+    parser.add_argument('--changed-only', action='store_true', dest='changed_only',
+                        help='Only load rows of -a which are new, edited, failed the last time or were uploaded '
+                             'longer ago than max_age in [journal].')
+    parser.add_argument('--record', action='store_const', const='record', dest='replay_mode', default=None,
+                        help='Store every downloaded source and the sheet in the recording folder (see [replay]), so '
+                             'that the run can be replayed without network.')
+    parser.add_argument('--replay', action='store_const', const='replay', dest='replay_mode',
+                        help='Replay a recorded run: read the sheet and the sources from the recording folder and '
+                             'upload to a local stand-in for Fuseki. The results for the sheet are written to '
+                             'replay/sheet.json in the recording folder.')
     parser.add_argument('-d', dest='debug', action='store_true', help='Ignore default logging configuration and simply '
                                                                       'log to stdout.')
 
@@ -67,6 +94,22 @@ def main():
 
     config = ConfigParser(interpolation=None)
     config.read(args.config)
+    if args.profile is not None:
+        if not config.has_section('metrics'):
+            config.add_section('metrics')
+        config['metrics']['profile'] = args.profile
+    if args.resume:
+        if not config.has_section('journal'):
+            config.add_section('journal')
+        config['journal']['resume'] = 'yes'
+    if args.changed_only:
+        if not config.has_section('journal'):
+            config.add_section('journal')
+        config['journal']['changed_only'] = 'yes'
+    if args.replay_mode is not None:
+        if not config.has_section('replay'):
+            config.add_section('replay')
+        config['replay']['mode'] = args.replay_mode
 
     if args.debug:
         import sys
@@ -95,11 +138,16 @@ def main():
 
         logging.basicConfig(**logging_options)
 
+    recording = Recording.from_config(config)
+    # the stand-in for Fuseki has to run before any client is created.
+    stub = recording.isolate(config) if recording.replaying else None
+    set_default_client(FusekiClient.from_config(config))
+
     data_path = config['data']['base']
     logging.debug('Base path: ' + data_path)
     try:
         if args.run_update:
-            update_fuseki(config, args.number_of_lines)
+            update_fuseki(config, args.number_of_lines, args.pipelined)
 
         if args.get_request:
             get_graph(args.uri, data_path + config['data']['vocabulary'] + args.file)
@@ -107,6 +155,9 @@ def main():
         if args.put_request:
             put_graph(args.uri, args.file)
 
+        if args.bulk_request:
+            replace_graph(args.uri, args.file, bulk=True)
+
         if args.delete_request:
             delete_graph(args.uri)
 
@@ -121,13 +172,21 @@ def main():
 
         if args.name is not None:
             if args.name in specific_functions.keys():
-                specific_functions[args.name](config)
+                metrics = Metrics.from_config(config)
+                try:
+                    with metrics.stage(args.name, 'total'):
+                        specific_functions[args.name](config)
+                finally:
+                    metrics.write_textfile()
 
         if args.skosify:
             skosfiy(args.url, config, args.label, args.file, namespace=args.namespace,
                     default_language=args.default_language)
     except Exception:
         logging.exception('An error occured:')
+    finally:
+        if stub is not None:
+            stub.stop()
 
 
 
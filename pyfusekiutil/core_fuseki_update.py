@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 import requests
 from rdflib import Graph, URIRef
 from rdflib.namespace import RDF, SKOS
@@ -6,22 +7,30 @@ from rdflib.exceptions import ParserError
 from rdflib.plugins.parsers.notation3 import BadSyntax
 import skosify
 import os
-import gzip
-import json
+import re
 import logging
-from io import BytesIO
-import zipfile
+import ftplib
 
-import time
 import pygsheets
-import googleapiclient.errors
+
+from pyfusekiutil.download_utility import DownloadCache, decompress
+from pyfusekiutil.fuseki_utility import FusekiClient, FusekiError, default_client, put_graph
+from pyfusekiutil.sync_utility import GraphSync
+from pyfusekiutil.manifest import UploadManifest
+from pyfusekiutil.graph_cache import GraphCache
+from pyfusekiutil.disk_store import GraphStorage
+from pyfusekiutil.metrics import Metrics
+from pyfusekiutil.replay import Recording
+from pyfusekiutil.journal import RunJournal, row_fingerprint
+from pyfusekiutil.sheet import BufferedSheet
+from pyfusekiutil.workspace import Workspaces, InsufficientSpaceError
 
 # The MIME Types for the possible rdf file formats. Needed to upload a file on apache jena.
-TURTLE_MIME_TYPE = 'application/x-turtle'
+TURTLE_MIME_TYPE = 'text/turtle; charset=utf-8'
 N3_MIME_TYPE = 'text/n3; charset=utf-8'
 NT_MIME_TYPE = 'application/n-triples'
-RDF_MIME_TYPE = 'application/rdf-xml'
-JSON_LD_MIME_TYPE = 'application/json'
+RDF_MIME_TYPE = 'application/rdf+xml'
+JSON_LD_MIME_TYPE = 'application/ld+json'
 
 # Column value of sheet
 TITLE = 0
@@ -37,10 +46,24 @@ ERROR_TYPE = 9
 ERROR = 10
 SKOSMOS_ENTRY = 11
 
+# The options used to skosify each vocabulary.
+# Documentation is somewhat sparse but can be found here: https://github.com/NatLibFi/Skosify
+SKOSIFY_OPTIONS = {
+    'mark_top_concepts': True,
+    'eliminate_redundancy': True,
+    'break_cycles': True,
+    'keep_related': False,
+    'cleanup_classes': True,
+    'cleanup_properties': True,
+    'cleanup_unreachable': True
+}
+
 class InvalidMIMETypeError(Exception): pass
 class DownloadError(Exception): pass
 class FusekiUploadError(Exception): pass
 class NoNamespaceDetectedError(Exception): pass
+class VocabularyParseError(Exception): pass
+class SourceUnchangedError(Exception): pass
 
 
 class SheetUpdate(object):
@@ -52,6 +75,8 @@ class SheetUpdate(object):
         self.error_type = ''
         self.error_message = ''
         self.skosmos_entry = ''
+        # set when the vocabulary was skipped because its source has not changed since the last upload.
+        self.unchanged = False
 
 
 class SkosifiedGraph(object):
@@ -60,7 +85,8 @@ class SkosifiedGraph(object):
     """
 
     def __init__(self, file_name: str, format: str, name: str, namespace: str, temp_path: str, default_language,
-                 update: SheetUpdate, logger=logging.getLogger('bartoc-skosify')):
+                 update: SheetUpdate, write_file=True, graph_cache: GraphCache = None, storage: GraphStorage = None,
+                 metrics: Metrics = None, logger=logging.getLogger('bartoc-skosify')):
         """
 
         :param file_name:           Name of the file where the vocabulary was saved after download.
@@ -70,6 +96,12 @@ class SkosifiedGraph(object):
         :param temp_path:           Path to the storage for temporary files. Configured in default.cfg
         :param default_language:    (NIY) When defined skosify will add this language to all labels within the vocabulary.
         :param update:              The current sheet update object.
+        :param write_file:          Write the processed graph to the temporary folder. Not needed if the graph is
+                                    uploaded directly from memory.
+        :param graph_cache:         The cache of parsed graphs. If None the file is always parsed.
+        :param storage:             Decides whether the file is loaded into memory or into a graph on disk. If None
+                                    it is always loaded into memory.
+        :param metrics:             Records the parse, namespace, skosify and serialize stages.
         :param logger:              The logger used.
         """
         self.logger = logger
@@ -80,6 +112,10 @@ class SkosifiedGraph(object):
         self.name = name
         self.default_language = default_language
         self.update = update
+        self.write_file = write_file
+        self.graph_cache = graph_cache if graph_cache is not None else GraphCache(None)
+        self.storage = storage if storage is not None else GraphStorage()
+        self.metrics = metrics if metrics is not None else Metrics()
 
         self.rdf = Graph()
 
@@ -90,28 +126,36 @@ class SkosifiedGraph(object):
         Will first parse it and attempt to detect the namespace if not defined.
         Then will load it with skosfiy with various options enabled.
 
-        :raises Various errors when the file can't be parsed or serialized.
+        :raises VocabularyParseError when the file can't be parsed.
+        :raises Various errors when the file can't be serialized.
         """
-        try:
-            self.rdf.parse(self.file_name, format='json-ld' if self.format == 'json' else guess_format(self.format))
-        except (ParserError, BadSyntax) as error:
-            self.update.error_type = 'PARSER ERROR'
-            self.update.error_message = str(error)
-            self.logger.exception('Could not parse vocabulary %s:', self.name)
-            return
-            # if parser was not successful there is no point in continuing.
+        self.rdf = self.storage.graph(self.file_name, self.temp_path)
+        source = self.rdf
+        with self.metrics.stage(self.name, 'parse') as record:
+            record['bytes'] = os.path.getsize(self.file_name)
+            try:
+                self.graph_cache.parse(self.rdf, self.file_name,
+                                       'json-ld' if self.format == 'json' else guess_format(self.format))
+            except (ParserError, BadSyntax) as error:
+                self.update.error_type = 'PARSER ERROR'
+                self.update.error_message = str(error)
+                # if parser was not successful there is no point in continuing.
+                raise VocabularyParseError('Could not parse vocabulary ' + self.name + '.') from error
+            record['triples_out'] = len(self.rdf)
 
         # if no namespace has been defined try to find one.
         if self.namespace == '':
-            self.detect_namespace()
+            with self.metrics.stage(self.name, 'namespace'):
+                self.detect_namespace()
         try:
-            self.rdf.serialize(destination='test.ttl', format='ttl')
-            # Does some magic to the vocabulary.
-            # Documentation is somewhat sparse but can be found here: https://github.com/NatLibFi/Skosify
-            self.rdf = skosify.skosify(self.rdf, label=self.name, namespace=self.namespace,
-                                       default_language=self.default_language, mark_top_concepts=True,
-                                       eliminate_redundancy=True, break_cycles=True, keep_related=False,
-                                       cleanup_classes=True, cleanup_properties=True, cleanup_unreachable=True)
+            with self.metrics.stage(self.name, 'skosify') as record:
+                record['triples_in'] = len(self.rdf)
+                # Does some magic to the vocabulary.
+                # skosify copies the graph into a new in-memory graph. The parsed graph is no longer needed.
+                self.rdf = skosify.skosify(self.rdf, label=self.name, namespace=self.namespace,
+                                           default_language=self.default_language, **SKOSIFY_OPTIONS)
+                record['triples_out'] = len(self.rdf)
+            GraphStorage.release(source)
         except SystemExit:
             # Whenever skosify encounters a fatal/critical error it calls sys.exit(1). This is caught here.
             self.logger.critical('Was unable to skosify %s', self.name)
@@ -121,9 +165,18 @@ class SkosifiedGraph(object):
             pass
         finally:
             # Writes the graph to disk. independent of whether skosify was successful or not.
-            self.rdf.serialize(destination=self.temp_path + 'upload.ttl', format='ttl', encoding='utf-8')
-            self.file_name = 'upload.ttl'
-            self.format = 'ttl'
+            # N-Triples are written line by line and are much faster to serialize and to load than turtle.
+            self.file_name = 'upload.nt'
+            self.format = 'nt'
+            if self.write_file:
+                with self.metrics.stage(self.name, 'serialize') as record:
+                    self.rdf.serialize(destination=self.temp_path + self.file_name, format='nt', encoding='utf-8')
+                    record['triples_out'] = len(self.rdf)
+                    record['bytes'] = os.path.getsize(self.temp_path + self.file_name)
+
+    def close(self):
+        """Release the graph. Removes its database if it is on disk."""
+        GraphStorage.release(self.rdf)
 
     def detect_namespace(self):
         """
@@ -155,7 +208,10 @@ class FusekiUpdate(object):
 
     def __init__(self, title: str, url: str, file_type: str, short_name: str,
                  sparql_graph: str, namespace: str, default_language: str, temp_path: str,
-                 update: SheetUpdate, logger=logging.getLogger('fuseki-update')):
+                 update: SheetUpdate, cache: DownloadCache = None, manifest: UploadManifest = None,
+                 client: FusekiClient = None, sync: GraphSync = None, in_memory=True, archive_path: str = None,
+                 graph_cache: GraphCache = None, storage: GraphStorage = None, metrics: Metrics = None,
+                 journal: RunJournal = None, row: int = None, logger=logging.getLogger('fuseki-update')):
         """
         :param title:               Name/Title of the vocabulary. Input from sheet.
         :param url:                 Url to where the vocabulary can be downloaded. Input from sheet.
@@ -163,8 +219,26 @@ class FusekiUpdate(object):
         :param short_name:          Short name of the vocabulary. Input from sheet.
         :param sparql_graph:        Required to name the sparql graph in fuseki.
         :param namespace:           Namespace to fill in void:uriSpace in Skosmos entry file.
-        :param temp_path:           File path to temporary folders. Input from default.cfg.
+        :param temp_path:           The scratch folder of the job (see workspace.py). Set when the job starts.
         :param update:              The SheetUpdate object for this vocabulary.
+        :param cache:               The download cache. If None every file is downloaded.
+        :param manifest:            The manifest of uploaded graphs. If None nothing is recorded.
+        :param client:              The client of the Fuseki dataset. Uses the default client if None.
+        :param sync:                If given, graphs are updated incrementally instead of being replaced.
+        :param in_memory:           Upload the skosified graph straight from memory. Otherwise it is written to the
+                                    temporary folder by the skosify stage and uploaded from there. This is needed if
+                                    the stages run in different processes.
+        :param archive_path:        If given, a copy of each skosified vocabulary is kept in this folder.
+        :param graph_cache:         The cache of parsed graphs. If None every file is parsed.
+        :param storage:             Decides which vocabularies are loaded into a graph on disk. If None all of them
+                                    are loaded into memory.
+        :param metrics:             Records the time, memory, bytes and triples of each stage. If None nothing is
+                                    recorded.
+        :param journal:             Records the stages the vocabulary has completed. If the run is resumed, the
+                                    stages completed by the interrupted run are not repeated. If None nothing is
+                                    recorded.
+        :param row:                 The number of the row of the vocabulary in the sheet. Identifies it in the
+                                    journal.
         :param logger:              The logger...
         """
         self.logger = logger
@@ -185,8 +259,24 @@ class FusekiUpdate(object):
         if self.namespace == '':
             self.sheet_updates.namespace = self.namespace
 
+        self.cache = cache if cache is not None else DownloadCache(None)
+        self.manifest = manifest if manifest is not None else UploadManifest(None)
+        self.fingerprint = ''
+        self.client = client if client is not None else default_client()
+        self.sync = sync
+        self.in_memory = in_memory
+        self.archive_path = archive_path
+        self.graph_cache = graph_cache
+        self.storage = storage
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.journal = journal if journal is not None else RunJournal(None)
+        self.row = row
+        # the files left behind by the interrupted run, if the vocabulary continues where it stopped.
+        self.restored = None
         self.graph = None
         self.mime_type = ''
+        # the size of the source in bytes as reported by the server in the preflight. None if unknown.
+        self.size = None
 
     def process(self):
         """Goes through the various steps to process the vocabuarly.
@@ -197,10 +287,97 @@ class FusekiUpdate(object):
         4. Upload the file to Fuseki.
         5. Clean up temporary files.
         """
-        self.mime_type = self.check_mime_type(self.file_end)
-        self.download_file(self.url)
+        self.download()
+        self.skosify()
+        self.record_skosified()
+        self.upload()
+
+    def skosify_and_upload(self):
+        """Skosify and upload stage combined, so that the graph can be handed to the upload in memory."""
+        self.skosify()
+        self.upload()
+
+    def preflight(self):
+        """
+        Check the row before any work is done: the file type, the protocol and whether the source can be reached.
+
+        Sets the size of the source. No data is downloaded.
+
+        :raises InvalidMIMETypeError    If the file type is not supported.
+        :raises DownloadError           If the source cannot be downloaded.
+        """
+        with self.metrics.stage(self.title, 'preflight') as record:
+            self.check_mime_type(self.file_end)
+            self.check_protocol(self.url)
+            try:
+                self.size = self.cache.probe(self.url)
+            except requests.exceptions.HTTPError as error:
+                self.sheet_updates.error_type = 'DOWNLOAD ERROR (' + str(error.response.status_code) + ')'
+                self.sheet_updates.error_message = 'The server answered with ' + str(error.response.status_code) + \
+                                                   ' ' + error.response.reason + ' for ' + self.url + '.'
+                raise DownloadError('Source ' + self.url + ' of ' + self.title + ' is not available.')
+            except ftplib.error_perm as error:
+                self.sheet_updates.error_type = 'DOWNLOAD ERROR'
+                self.sheet_updates.error_message = 'The server answered with ' + str(error) + ' for ' + self.url + '.'
+                raise DownloadError('Source ' + self.url + ' of ' + self.title + ' is not available.')
+            except (requests.exceptions.RequestException, ftplib.Error, OSError, EOFError) as error:
+                self.sheet_updates.error_type = 'CONNECTION ERROR'
+                self.sheet_updates.error_message = 'Could not connect to ' + self.url
+                raise DownloadError('Could not reach ' + self.url + ' because of a connection error.') from error
+            record['bytes'] = self.size
+
+    def download(self):
+        """
+        Download stage: Check the mime type and download the file from the given url.
+
+        :raises SourceUnchangedError    If the file and all settings are the same as for the last successful upload
+                                        and unchanged vocabularies should be skipped.
+        """
+        with self.metrics.stage(self.title, 'download') as record:
+            self.mime_type = self.check_mime_type(self.file_end)
+            self.restored = self.journal.restored(self.row, self)
+            if self.restored is not None:
+                self.logger.info('Continue %s with the files left by the interrupted run after the %s stage.',
+                                 self.title, self.restored['reached'])
+                self.local_file_name = self.restored['source']
+                self.fingerprint = self.restored['fingerprint']
+                record['bytes'] = os.path.getsize(self.local_file_name)
+                return
+            self.download_file(self.url)
+            record['bytes'] = os.path.getsize(self.local_file_name)
+
+            # an unchanged source is only skipped if it would be loaded the same way into the same graph.
+            self.fingerprint = UploadManifest.fingerprint(self.local_file_name, {
+                'title': self.title,
+                'graph': self.sparql_graph,
+                'format': self.file_end,
+                'namespace': self.namespace,
+                'default_language': self.default_language,
+                'skosify': SKOSIFY_OPTIONS
+            })
+            if self.manifest.skip_unchanged and self.manifest.is_unchanged(self.sparql_graph, self.fingerprint):
+                raise SourceUnchangedError('Skipped ' + self.title + ', because the content of ' + self.url +
+                                           ' has not changed since the last successful upload to ' +
+                                           self.sparql_graph + '.')
+        self.journal.downloaded(self.row, self.local_file_name, self.fingerprint)
+
+    def skosify(self):
+        """
+        Skosify stage: Parse and skosify the downloaded file.
+
+        The result is kept in memory for the upload. It is only written to disk if the upload reads it from the
+        temporary folder or an archive is configured.
+        """
+        if self.restored is not None and self.restored['skosified'] is not None:
+            self.logger.info('Upload the file skosified by the interrupted run for %s.', self.title)
+            self.local_file_name = os.path.relpath(self.restored['skosified'], self.temp_path)
+            self.mime_type = NT_MIME_TYPE
+            self.sheet_updates.namespace = self.restored['namespace']
+            return
+
         self.graph = SkosifiedGraph(self.local_file_name, self.file_end, self.title, self.namespace, self.temp_path,
-                                    self.default_language, self.sheet_updates)
+                                    self.default_language, self.sheet_updates, write_file=not self.in_memory,
+                                    graph_cache=self.graph_cache, storage=self.storage, metrics=self.metrics)
         try:
             self.graph.process()
         except NoNamespaceDetectedError as error:
@@ -217,8 +394,49 @@ class FusekiUpdate(object):
         self.mime_type = self.check_mime_type(self.graph.format)
         self.local_file_name = self.graph.file_name
 
-        self.upload_file()
+        if self.archive_path is not None:
+            self.archive()
+
+    def record_skosified(self):
+        """
+        Record in the journal that the vocabulary has been skosified.
+
+        Only the main process writes to the journal. The pipeline calls this once the skosify stage has returned from
+        its worker process.
+        """
+        # a graph kept in memory is lost with the run. Only a skosified file can be picked up again.
+        in_memory = self.in_memory and self.graph is not None
+        self.journal.skosified(self.row, self.sheet_updates.namespace,
+                               None if in_memory else self.temp_path + self.local_file_name)
+
+    def release_graph(self):
+        """Drop the skosified graph once it has been uploaded or written to disk."""
+        if self.graph is not None:
+            self.graph.close()
+            self.graph = None
+
+    def archive(self):
+        """Keep a copy of the skosified vocabulary in the archive folder. Named after the short name."""
+        name = re.sub(r'[^\w.-]', '_', (self.short_name or self.title).lower())
+        os.makedirs(self.archive_path, exist_ok=True)
+        with self.metrics.stage(self.title, 'archive') as record:
+            self.graph.rdf.serialize(destination=self.archive_path + name + '.ttl', format='ttl', encoding='utf-8')
+            record['triples_out'] = len(self.graph.rdf)
+            record['bytes'] = os.path.getsize(self.archive_path + name + '.ttl')
+        self.logger.info('Archived %s in %s.', self.title, self.archive_path + name + '.ttl')
+
+    def upload(self):
+        """Upload stage: Upload the skosified file to Fuseki and create the skosmos entry."""
+        with self.metrics.stage(self.title, 'upload') as record:
+            if self.in_memory and self.graph is not None:
+                record['triples_in'] = len(self.graph.rdf)
+            else:
+                record['bytes'] = os.path.getsize(self.temp_path + self.local_file_name)
+            self.upload_file()
+            record['triples_out'] = int(self.sheet_updates.triple_count)
         self.sheet_updates.skosmos_entry = self.create_skosmos_entry()
+        self.cache.mark_complete(self.url)
+        self.manifest.record(self.sparql_graph, self.fingerprint, self.sheet_updates.triple_count)
 
     def check_mime_type(self, file_type):
         """
@@ -241,97 +459,85 @@ class FusekiUpdate(object):
                                                file_type + '.'
             raise InvalidMIMETypeError('Invalid MIME Type found: ' + file_type + '.')
 
+    def check_protocol(self, url: str):
+        """
+        Check that the file can be downloaded with a supported protocol.
+
+        :raises DownloadError   If the url is neither HTTP[S] nor FTP.
+        """
+        if not url.startswith('http') and not url.startswith('ftp'):
+            self.sheet_updates.error_type = 'DOWNLOAD ERROR'
+            self.sheet_updates.error_message = 'Invalid protocol: only HTTP[S] & FTP are supported!'
+            raise DownloadError('Invalid protocol: only HTTP[S] & FTP are supported!')
+
     def download_file(self, url: str):
         """
         Download the file from the given url.
 
         Will first attempt to download and read the file. Will only accept downloads with status code 200.
+        Files which have not changed since the last download are served from the download cache. Whether the
+        vocabulary is skipped is decided by the manifest in download, which also takes the settings of the row into
+        account.
+        FTP sessions are reused between rows and interrupted FTP downloads are resumed (see FtpTransport).
         If the file is archived it is unpacked. Can handle .zip & .gz. All other archives will lead to errors.
-        Will load all content as binary and then decode to UTF-8.
-
-        Write file to disk.
+        The file is streamed to disk and decompressed in chunks, so it is never loaded into memory as a whole.
 
         :param url:     The url.
 
-        :raises DownloadError   If the download could not be completed.
+        :raises DownloadError           If the download could not be completed.
         """
-        if url.startswith('http'):
-            try:
-                download_file_response = requests.get(url)
-            except (requests.exceptions.RequestException, ConnectionError, TimeoutError) as error:
-                self.sheet_updates.error_type = 'CONNECTION ERROR'
-                self.sheet_updates.error_message = 'Could not connect to ' + url
-                self.logger.exception(error)
-                raise DownloadError('Could not download from ' + url + ' because of a connection error.')
-
-            if not download_file_response.ok:
-                self.sheet_updates.error_type = 'DOWNLOAD ERROR (' + str(download_file_response.status_code) + ')'
-                self.sheet_updates.error_message = download_file_response.text
-                raise DownloadError('Was unable to download the file from ' + url)
-            content = download_file_response.content
-            buffer = BytesIO(download_file_response.content)
-
-        elif url.startswith('ftp'):
-            import urllib.parse
-            import ftplib
-            parts = urllib.parse.urlparse(url)
-            file_name = parts.path.split('/')[-1]
-            path = parts.path.replace(file_name, '')
-            ftp = ftplib.FTP(parts.netloc)
-            ftp.login()
-            ftp.cwd(path)
-            ftp.retrbinary('RETR ' + file_name, open(self.temp_path + file_name, 'wb').write)
-            ftp.quit()
-            with open(self.temp_path + file_name, 'rb') as file:
-                content = file.read()
-                buffer = BytesIO(content)
-        else:
-            self.sheet_updates.error_type = 'DOWNLOAD ERROR'
-            self.sheet_updates.error_message = 'Invalid protocol: only HTTP[S] & FTP are supported!'
-            raise DownloadError('Invalid protocol: only HTTP[S] & FTP are supported!')
-
-        # save downloaded file locally to ensure that it is unzipped
-        # and does not need to be downloaded again for getting an URI
-        file_name = self.temp_path + 'temporary.' + self.file_end.lower()
-        if url.endswith('.zip'):
-            z = zipfile.ZipFile(buffer)
-            text = z.read(z.infolist()[0]).decode('utf-8')
-        elif url.endswith('.gz'):
-            text = gzip.decompress(content).decode('utf-8')
-        else:
-            text = content.decode('utf-8')
-
-        with open(file_name, 'w', encoding='utf-8') as file:
-            file.write(text)
-
-        self.local_file_name = file_name
+        self.check_protocol(url)
+        try:
+            source, _ = self.cache.fetch(url, self.temp_path + 'download')
+        except requests.exceptions.HTTPError as error:
+            self.sheet_updates.error_type = 'DOWNLOAD ERROR (' + str(error.response.status_code) + ')'
+            self.sheet_updates.error_message = error.response.text
+            raise DownloadError('Was unable to download the file from ' + url)
+        except (requests.exceptions.RequestException, ftplib.Error, OSError, EOFError) as error:
+            self.sheet_updates.error_type = 'CONNECTION ERROR'
+            self.sheet_updates.error_message = 'Could not connect to ' + url
+            self.logger.exception(error)
+            raise DownloadError('Could not download from ' + url + ' because of a connection error.')
+
+        # unzip the downloaded file locally. Files which are not archived are used as they are.
+        self.local_file_name = decompress(source, self.temp_path + 'temporary.' + self.file_end.lower(), url)
 
     def upload_file(self):
         """
         Upload the file to the fuseki triple store with PUT. This will overwrite an existing graph with the same name.
 
-        TODO: Change upload to use SPARQL -> for incremental updates to avoid having to download all the files.
+        The graph is serialized while it is sent, or streamed from disk if the skosify stage ran in another process.
+        No copy of the whole graph is held in memory or written to disk for the upload. If enabled in the client the
+        body is compressed with gzip and the graph is replaced through a staging graph.
+        If incremental updates are enabled, only the changes to the graph are sent with SPARQL Update.
 
         :raises FusekiUploadError  if response status code is lower than 200 or higher than 300.
         """
-        with open(self.temp_path + self.local_file_name, 'r', encoding='utf-8') as file:
-            data = {'name': (self.short_name.lower(), file.read(), self.mime_type)}
-            if self.sparql_graph == '':
-                self.sheet_updates.error_type = 'NO GRAPH NAME'
-                self.sheet_updates.error_message = 'A graph name is required for a upload to take place. Once set' \
-                                                   ' the graph name should not be changed.'
-                raise FusekiUploadError
-            basic_url = 'http://localhost:3030/skosmos/data?graph=' + self.sparql_graph
-
-            # replace graph on server. overwrites existing data.
-            response = requests.request('PUT', basic_url, files=data)
+        if self.sparql_graph == '':
+            self.sheet_updates.error_type = 'NO GRAPH NAME'
+            self.sheet_updates.error_message = 'A graph name is required for a upload to take place. Once set' \
+                                               ' the graph name should not be changed.'
+            raise FusekiUploadError
+
+        if self.in_memory and self.graph is not None:
+            source = self.graph.rdf
+        else:
+            source = self.temp_path + self.local_file_name
 
-            if not response.ok:
-                self.sheet_updates.error_type = 'UPLOAD ERROR ' + str(response.status_code)
-                self.sheet_updates.error_message = 'Could not upload item to fuseki: ' + str(response.text)
-                raise FusekiUploadError('Could not upload vocabulary ' + self.title + '.')
+        try:
+            if self.sync is not None:
+                triple_count = self.sync.sync(self.sparql_graph, source, self.mime_type)
+            else:
+                # replace graph on server. overwrites existing data.
+                triple_count = put_graph(self.sparql_graph, source, self.mime_type, self.client)
+        except FusekiError as error:
+            self.sheet_updates.error_type = 'UPLOAD ERROR'
+            if error.status_code is not None:
+                self.sheet_updates.error_type += ' ' + str(error.status_code)
+            self.sheet_updates.error_message = 'Could not upload item to fuseki: ' + str(error)
+            raise FusekiUploadError('Could not upload vocabulary ' + self.title + '.')
 
-            self.sheet_updates.triple_count = str(json.loads(response.text)['tripleCount'])
+        self.sheet_updates.triple_count = str(triple_count)
 
     def create_skosmos_entry(self):
         """Create a basic skosmos config entry. Has to be adjust this by hand and then copy it into the file."""
@@ -350,79 +556,245 @@ class FusekiUpdate(object):
         return result
 
 
-def update_fuseki(config, lines: int):
+def record_error(update: SheetUpdate, error: Exception):
+    """
+    Log an error which ended the processing of a vocabulary.
+
+    Known errors have already filled in the sheet update. All other errors are noted as unknown errors.
+
+    :param update:  The sheet update of the vocabulary.
+    :param error:   The exception raised.
+    """
+    if isinstance(error, SourceUnchangedError):
+        update.unchanged = True
+        logging.info(str(error))
+    elif isinstance(error, InsufficientSpaceError):
+        update.error_type = 'NO SPACE'
+        update.error_message = str(error)
+        logging.error(str(error))
+    elif isinstance(error, (InvalidMIMETypeError, DownloadError, FusekiUploadError, NoNamespaceDetectedError,
+                            VocabularyParseError)):
+        logging.error(str(error), exc_info=error)
+    # catch all unhandled exceptions. This should be updated as new exceptions occur.
+    else:
+        update.error_type = 'UNKNOWN ERROR (' + str(type(error)) + ')'
+        update.error_message = str(error)
+        logging.error('Unhandled exception occurred: ', exc_info=error)
+
+
+def write_update(sheet: BufferedSheet, i, update: SheetUpdate):
+    """Buffer the values gathered for a vocabulary for row i of the sheet. Some of these may be empty."""
+    if update.unchanged:
+        # keep the results of the last upload.
+        sheet.set_values(i, ERROR_TYPE, ['', 'Skipped: source unchanged since the last successful upload.'])
+        return
+    sheet.set_values(i, NAMESPACE, [update.namespace,
+                                    update.triple_count,
+                                    update.error_type,
+                                    update.error_message,
+                                    update.skosmos_entry])
+
+
+def sheet_fingerprint(row, update: SheetUpdate = None):
+    """
+    The fingerprint of the input columns (TITLE to NAMESPACE) of a row.
+
+    :param row:     The values of the row.
+    :param update:  If given, the fingerprint is of the values the row has once the update is written to the sheet,
+                    which replaces the namespace.
+    """
+    values = list(row[TITLE:NAMESPACE + 1])
+    values += [''] * (NAMESPACE + 1 - len(values))
+    if update is not None and not update.unchanged:
+        values[NAMESPACE] = update.namespace
+    return row_fingerprint(values)
+
+
+def create_job(row, cache: DownloadCache, manifest: UploadManifest, client: FusekiClient,
+               sync: GraphSync = None, in_memory=True, archive_path: str = None, graph_cache: GraphCache = None,
+               storage: GraphStorage = None, metrics: Metrics = None, journal: RunJournal = None, i: int = None):
+    """
+    Create the FusekiUpdate for a sheet row which is ready to be loaded. i is the number of the row.
+
+    The job gets its temporary folder from the Workspaces when it starts.
+    """
+    return FusekiUpdate(title=row[TITLE],
+                        url=row[URL],
+                        file_type=row[FILE_TYPE],
+                        short_name=row[SHORT_NAME],
+                        sparql_graph=row[SPARQL_GRAPH_NAME],
+                        namespace=row[NAMESPACE],
+                        default_language=row[DEFAULT_LANGUAGE],
+                        temp_path=None,
+                        update=SheetUpdate(),
+                        cache=cache,
+                        manifest=manifest,
+                        client=client,
+                        sync=sync,
+                        in_memory=in_memory,
+                        archive_path=archive_path,
+                        graph_cache=graph_cache,
+                        storage=storage,
+                        metrics=metrics,
+                        journal=journal,
+                        row=i)
+
+
+def run_preflight(fuseki: FusekiUpdate):
+    """Run the preflight of a job. Errors are recorded in its sheet update. Returns whether it passed."""
+    try:
+        fuseki.preflight()
+    except Exception as error:
+        record_error(fuseki.sheet_updates, error)
+        return False
+    return True
+
+
+def preflight(jobs: list, workers=8, logger=logging.getLogger('fuseki-preflight')):
+    """
+    Check the sources of all jobs concurrently and order the jobs by the size of their source.
+
+    The largest sources are processed first, so that no large vocabulary is left over at the end of a run while the
+    other workers are idle. Sources of unknown size come after those of known size. Otherwise the order of the sheet
+    is kept.
+
+    :param jobs:    A list of tuples (row, FusekiUpdate).
+    :param workers: Number of sources checked at the same time.
+    :param logger:  The logger used.
+    :return:        The jobs which passed the preflight, largest source first, and the jobs which failed.
+    """
+    with ThreadPoolExecutor(max(workers, 1)) as executor:
+        results = list(executor.map(run_preflight, [fuseki for _, fuseki in jobs]))
+    passed = [job for job, result in zip(jobs, results) if result]
+    failed = [job for job, result in zip(jobs, results) if not result]
+    passed.sort(key=lambda job: (job[1].size is None, -(job[1].size or 0)))
+    logger.info('Preflight of %s vocabularies: %s failed, %.1f MB to download (%s of unknown size).', len(jobs),
+                len(failed), sum(fuseki.size or 0 for _, fuseki in passed) / 1e6,
+                sum(1 for _, fuseki in passed if fuseki.size is None))
+    return passed, failed
+
+
+def update_fuseki(config, lines: int, pipelined: bool = False):
+    """
+    Load all vocabularies marked as ready in the google sheet into Fuseki and write the results back to the sheet.
+
+    :param config:      The configuration from default.cfg.
+    :param lines:       Number of lines of the sheet to go through. -1 for all of them.
+    :param pipelined:   Process the vocabularies concurrently in stages (see pipeline.py) instead of one at a time.
+    """
     try:
         credentials = config['data']['base'] + config['data']['credentials']
-        temp_path = config['data']['base'] + config['data']['temporary']
-
-        c = pygsheets.authorize(outh_file=credentials + 'client_secrets.json',
-                                outh_creds_store=credentials,
-                                outh_nonlocal=True)
-        sheet = c.open(config['sheet']['sheet_name']).sheet1
+        workspaces = Workspaces.from_config(config)
+        cache = DownloadCache.from_config(config)
+        manifest = UploadManifest.from_config(config)
+        client = FusekiClient.from_config(config)
+        sync = GraphSync.from_config(config, client)
+        graph_cache = GraphCache.from_config(config)
+        storage = GraphStorage.from_config(config)
+        metrics = Metrics.from_config(config)
+        journal = RunJournal.from_config(config)
+        journal.start()
+        if not journal.resumed:
+            workspaces.clean()
+        archive_path = None
+        if config.get('data', 'archive', fallback='') != '':
+            archive_path = config['data']['base'] + config['data']['archive']
+        # the pipeline runs skosify in other processes. The graph is only handed over in memory if the upload runs in
+        # the same process.
+        in_memory = not pipelined or config.get('pipeline', 'handoff', fallback='file') == 'memory'
+        changed_only = config.getboolean('journal', 'changed_only', fallback=False)
+        max_age = config.getfloat('journal', 'max_age', fallback=7)
+
+        recording = Recording.from_config(config)
+        if recording.replaying:
+            worksheet = recording.worksheet()
+        else:
+            c = pygsheets.authorize(outh_file=credentials + 'client_secrets.json',
+                                    outh_creds_store=credentials,
+                                    outh_nonlocal=True)
+            worksheet = c.open(config['sheet']['sheet_name']).sheet1
+        sheet = BufferedSheet.from_config(worksheet, config)
+        sheet.load()
+        recording.record_sheet(sheet.rows)
 
         # run through the entire script if lines is -1. Otherwise only run the number of lines given.
         if lines == -1:
-            num_col = len(sheet.get_col(1))
+            num_col = sheet.row_count()
         else:
-            num_col = 1 + lines
-        for i in range(2, num_col):
-            try:
-                row = sheet.get_row(i)
-            except googleapiclient.errors.HttpError:
-                time.sleep(100)
+            num_col = min(1 + lines, sheet.row_count())
+
+        try:
+            jobs = list()
+            rows = dict()
+            for i in range(2, num_col):
                 row = sheet.get_row(i)
-            if len(row) >= int(config['sheet']['last_column']):
-                # Ignore vocabularies which are not ready.
-                if row[READY] == 'y':
-                    update = SheetUpdate()
-
-                    fuseki = FusekiUpdate(title=row[TITLE],
-                                          url=row[URL],
-                                          file_type=row[FILE_TYPE],
-                                          short_name=row[SHORT_NAME],
-                                          sparql_graph=row[SPARQL_GRAPH_NAME],
-                                          namespace=row[NAMESPACE],
-                                          default_language=row[DEFAULT_LANGUAGE],
-                                          temp_path=temp_path,
-                                          update=update)
+                if len(row) >= int(config['sheet']['last_column']):
+                    # Ignore vocabularies which are not ready.
+                    if row[READY] == 'y':
+                        # rows uploaded recently and not edited since are skipped without contacting their source.
+                        if changed_only and journal.settled(sheet_fingerprint(row), max_age):
+                            continue
+                        rows[i] = row
+                        jobs.append((i, create_job(row, cache, manifest, client, sync, in_memory, archive_path,
+                                                   graph_cache, storage, metrics, journal, i)))
+                else:
+                    sheet.set_values(i, SKOSMOS_ENTRY, ['#'])
+
+            if changed_only:
+                logging.info('Changed rows only: %s rows are loaded, the other ready rows are settled.', len(jobs))
+
+            # rows which were finished by the interrupted run are not loaded again. Rows which left files behind
+            # continue first, so that their folders are removed early.
+            restored = list()
+            remaining = list()
+            for i, fuseki in jobs:
+                finished = journal.add(i, fuseki)
+                if finished is not None:
+                    fuseki.sheet_updates.__dict__.update(finished)
+                    write_update(sheet, i, fuseki.sheet_updates)
+                elif journal.restored(i, fuseki) is not None:
+                    restored.append((i, fuseki))
+                else:
+                    remaining.append((i, fuseki))
+            if journal.resumed:
+                logging.info('Resumed run: %s rows finished, %s rows continue, %s rows start again.',
+                             len(jobs) - len(restored) - len(remaining), len(restored), len(remaining))
+
+            if config.getboolean('preflight', 'enabled', fallback=True):
+                remaining, failed = preflight(remaining, config.getint('preflight', 'workers', fallback=8))
+                # report the sources which cannot be loaded right away instead of at the end of the run.
+                for i, fuseki in failed:
+                    write_update(sheet, i, fuseki.sheet_updates)
+                    journal.finished(i, fuseki.sheet_updates, sheet_fingerprint(rows[i], fuseki.sheet_updates))
+                sheet.flush()
+            jobs = restored + remaining
+
+            if pipelined:
+                from pyfusekiutil.pipeline import VocabularyPipeline
+                for i, update in VocabularyPipeline.from_config(config).run(jobs):
+                    write_update(sheet, i, update)
+                    journal.finished(i, update, sheet_fingerprint(rows[i], update))
+            else:
+                for i, fuseki in jobs:
+                    # the folder of the job is removed with all its files, even if something went wrong.
                     try:
-                        fuseki.process()
-                    except (InvalidMIMETypeError, DownloadError, FusekiUploadError, NoNamespaceDetectedError) as error:
-                        logging.exception(str(error))
-                        pass
-                    # catch all unhandled exceptions. This should be updated as new exceptions occur.
+                        with workspaces.job(i, fuseki.size, journal.resumed) as workspace:
+                            fuseki.temp_path = workspace.path
+                            try:
+                                fuseki.process()
+                            finally:
+                                fuseki.release_graph()
                     except Exception as error:
-                        update.error_type = 'UNKNOWN ERROR (' + str(type(error)) + ')'
-                        update.error_message = str(error)
-                        logging.exception('Unhandled exception occurred: ')
-                        pass
+                        record_error(fuseki.sheet_updates, error)
 
-                    # reload the sheet data to ensure that no data is lost.
-                    try:
-                        row = sheet.get_row(i)
-                    except googleapiclient.errors.HttpError:
-                        time.sleep(100)
-                        row = sheet.get_row(i)
-
-                    # update the sheet with the values gathered. some of these may be empty.
-                    row[NAMESPACE] = update.namespace
-                    row[TRIPLE_COUNT] = update.triple_count
-                    row[ERROR_TYPE] = update.error_type
-                    row[ERROR] = update.error_message
-                    row[SKOSMOS_ENTRY] = update.skosmos_entry
-
-                    try:
-                        sheet.update_row(i, row)
-                    except googleapiclient.errors.HttpError:
-                        time.sleep(100)
-                        sheet.update_row(i, row)
-
-                    # clean temporary folders to ensure that no corrupted files are left behind if something went wrong.
-                    for root, dirs, files in os.walk(temp_path):
-                        for file in files:
-                            os.remove(root + file)
-            else:
-                sheet.update_cell('L' + str(i), '#')
+                    write_update(sheet, i, fuseki.sheet_updates)
+                    journal.finished(i, fuseki.sheet_updates, sheet_fingerprint(rows[i], fuseki.sheet_updates))
+            journal.finish()
+        finally:
+            # write the results gathered so far, even if the run ended early.
+            sheet.flush()
+            cache.close()
+            metrics.write_textfile()
     except Exception:
         logging.critical('Something unexpected happened and the application has ended early:', exc_info=True)
     else:
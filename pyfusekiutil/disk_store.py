@@ -0,0 +1,263 @@
+from rdflib import Graph, URIRef, BNode, Literal
+from rdflib.plugins.stores.memory import Memory
+from rdflib.store import Store
+
+import logging
+import os
+import sqlite3
+import uuid
+
+"""Graphs which keep their triples on disk.
+
+Vocabularies larger than the memory of a worker are loaded into a graph backed by an SQLite database instead of the
+default in-memory store. Every term is stored once in a term table. The triples are rows of three term ids, indexed
+in the orders spo, pos and osp so that every triple pattern is answered from an index.
+"""
+
+# Kinds of terms in the term table.
+URI = 0
+BLANK = 1
+LITERAL = 2
+
+# The indexes of the triple table. Each pattern is answered from the index which starts with its bound terms.
+INDEXES = (('s', 'p', 'o'), ('p', 'o', 's'), ('o', 's', 'p'))
+
+
+class SQLiteStore(Store):
+    """
+    A store of a single graph in an SQLite database.
+
+    The term ids of recently used terms are cached in memory. Patterns are read page by page in the order of their
+    index. Each page is read completely before it is returned, so the graph can be changed while the triples of a
+    pattern are iterated. Like with the in-memory store, changes made during iteration may or may not be seen.
+    Namespace bindings are kept in memory.
+    """
+
+    context_aware = False
+    formula_aware = False
+    transaction_aware = False
+    graph_aware = False
+
+    def __init__(self, configuration=None, identifier=None, cache_size=1000000, page_size=10000):
+        """
+        :param configuration:   Path to the database file. Opened right away if given.
+        :param identifier:      The identifier of the store.
+        :param cache_size:      Maximum number of terms whose ids are cached in memory.
+        :param page_size:       Number of triples read from the database at once.
+        """
+        self.cache_size = cache_size
+        self.page_size = page_size
+        self.connection = None
+        self.count = 0
+        self.ids = dict()
+        self.terms = dict()
+        self.bindings = Memory()
+        super().__init__(configuration, identifier)
+
+    def open(self, configuration, create=True):
+        """Open the database at the path given as configuration."""
+        # the graph may be serialized in another thread while it is uploaded.
+        self.connection = sqlite3.connect(configuration, check_same_thread=False)
+        # the database only lives as long as the graph. Nothing has to survive a crash.
+        self.connection.execute('PRAGMA journal_mode = OFF')
+        self.connection.execute('PRAGMA synchronous = OFF')
+        self.connection.execute('PRAGMA cache_size = -65536')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS terms (id INTEGER PRIMARY KEY, kind INTEGER, '
+                                'value TEXT, lang TEXT, datatype TEXT, UNIQUE (kind, value, lang, datatype))')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS triples (s INTEGER, p INTEGER, o INTEGER, '
+                                'PRIMARY KEY (s, p, o)) WITHOUT ROWID')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS pos ON triples (p, o, s)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS osp ON triples (o, s, p)')
+        self.count = self.connection.execute('SELECT COUNT(*) FROM triples').fetchone()[0]
+
+    def close(self, commit_pending_transaction=False):
+        if self.connection is not None:
+            if commit_pending_transaction:
+                self.connection.commit()
+            self.connection.close()
+            self.connection = None
+        self.ids.clear()
+        self.terms.clear()
+
+    def destroy(self, configuration):
+        self.close()
+        if os.path.exists(configuration):
+            os.remove(configuration)
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def add(self, triple, context=None, quoted=False):
+        Store.add(self, triple, context, quoted)
+        cursor = self.connection.execute('INSERT OR IGNORE INTO triples VALUES (?, ?, ?)',
+                                         [self._term_id(term) for term in triple])
+        self.count += cursor.rowcount
+
+    def addN(self, quads):
+        rows = list()
+        for s, p, o, c in quads:
+            rows.append((self._term_id(s), self._term_id(p), self._term_id(o)))
+            if len(rows) == self.page_size:
+                self._insert(rows)
+                rows = list()
+        self._insert(rows)
+
+    def _insert(self, rows):
+        cursor = self.connection.executemany('INSERT OR IGNORE INTO triples VALUES (?, ?, ?)', rows)
+        self.count += max(cursor.rowcount, 0)
+
+    def remove(self, triple_pattern, context=None):
+        conditions, values = self._conditions(triple_pattern)
+        if conditions is None:
+            return
+        cursor = self.connection.execute('DELETE FROM triples' + (' WHERE ' + ' AND '.join(conditions)
+                                                                   if conditions else ''), values)
+        self.count -= max(cursor.rowcount, 0)
+
+    def triples(self, triple_pattern, context=None):
+        conditions, values = self._conditions(triple_pattern)
+        if conditions is None:
+            return
+        bound = set(condition[0] for condition in conditions)
+        index = next(index for index in INDEXES if set(index[:len(bound)]) == bound)
+        free = index[len(bound):]
+        select = 'SELECT s, p, o FROM triples'
+        order = ''
+        if free:
+            order = ' ORDER BY ' + ', '.join(free) + ' LIMIT ' + str(self.page_size)
+        last = None
+        while True:
+            page_conditions = list(conditions)
+            page_values = list(values)
+            if last is not None:
+                page_conditions.append('(' + ', '.join(free) + ') > (' + ', '.join('?' * len(free)) + ')')
+                page_values.extend(last)
+            where = ' WHERE ' + ' AND '.join(page_conditions) if page_conditions else ''
+            rows = self.connection.execute(select + where + order, page_values).fetchall()
+            for row in rows:
+                yield tuple(self._term(term_id) for term_id in row), iter([None])
+            if not free or len(rows) < self.page_size:
+                return
+            columns = dict(zip(('s', 'p', 'o'), rows[-1]))
+            last = [columns[column] for column in free]
+
+    def __len__(self, context=None):
+        return self.count
+
+    def contexts(self, triple=None):
+        return iter([])
+
+    def bind(self, prefix, namespace, override=True):
+        self.bindings.bind(prefix, namespace, override)
+
+    def namespace(self, prefix):
+        return self.bindings.namespace(prefix)
+
+    def prefix(self, namespace):
+        return self.bindings.prefix(namespace)
+
+    def namespaces(self):
+        return self.bindings.namespaces()
+
+    def _conditions(self, triple_pattern):
+        """The conditions on the bound terms of a pattern. None if a term is not in the store."""
+        conditions = list()
+        values = list()
+        for column, term in zip(('s', 'p', 'o'), triple_pattern):
+            if term is not None:
+                term_id = self._term_id(term, create=False)
+                if term_id is None:
+                    return None, None
+                conditions.append(column + ' = ?')
+                values.append(term_id)
+        return conditions, values
+
+    def _term_id(self, term, create=True):
+        term_id = self.ids.get(term)
+        if term_id is not None:
+            return term_id
+        if isinstance(term, Literal):
+            key = (LITERAL, str(term), term.language or '', str(term.datatype or ''))
+        elif isinstance(term, BNode):
+            key = (BLANK, str(term), '', '')
+        elif isinstance(term, URIRef):
+            key = (URI, str(term), '', '')
+        else:
+            raise TypeError('Cannot store ' + repr(term) + ' in an SQLite graph.')
+        row = self.connection.execute('SELECT id FROM terms WHERE kind = ? AND value = ? AND lang = ? AND '
+                                      'datatype = ?', key).fetchone()
+        if row is not None:
+            term_id = row[0]
+        elif create:
+            term_id = self.connection.execute('INSERT INTO terms (kind, value, lang, datatype) VALUES (?, ?, ?, ?)',
+                                              key).lastrowid
+        else:
+            return None
+        self._cache(term, term_id)
+        return term_id
+
+    def _term(self, term_id):
+        term = self.terms.get(term_id)
+        if term is not None:
+            return term
+        kind, value, lang, datatype = self.connection.execute(
+            'SELECT kind, value, lang, datatype FROM terms WHERE id = ?', (term_id,)).fetchone()
+        if kind == LITERAL:
+            term = Literal(value, lang=lang or None, datatype=URIRef(datatype) if datatype else None)
+        elif kind == BLANK:
+            term = BNode(value)
+        else:
+            term = URIRef(value)
+        self._cache(term, term_id)
+        return term
+
+    def _cache(self, term, term_id):
+        if len(self.ids) >= self.cache_size:
+            self.ids.clear()
+            self.terms.clear()
+        self.ids[term] = term_id
+        self.terms[term_id] = term
+
+
+class GraphStorage(object):
+    """Creates the graph for a source: in memory, or on disk if the source is larger than a threshold."""
+
+    def __init__(self, threshold=0, logger=logging.getLogger('graph-storage')):
+        """
+        :param threshold:   Sources larger than this many bytes are loaded into a graph on disk. 0 disables it.
+        :param logger:      The logger used.
+        """
+        self.threshold = threshold
+        self.logger = logger
+
+    @classmethod
+    def from_config(cls, config):
+        """Create the storage configured with disk_threshold (in MB) in the [store] section."""
+        return cls(config.getint('store', 'disk_threshold', fallback=0) * 1024 * 1024)
+
+    def graph(self, file_name: str, path: str):
+        """
+        Create an empty graph for a source.
+
+        :param file_name:   The source which will be loaded into the graph.
+        :param path:        Folder for the database of a graph on disk.
+        :return:            An in-memory graph or a graph on disk. Must be released with release.
+        """
+        size = os.path.getsize(file_name)
+        if self.threshold <= 0 or size <= self.threshold:
+            return Graph()
+        database = os.path.join(path, 'graph-' + uuid.uuid4().hex + '.sqlite')
+        self.logger.info('%s has %.1f MB. Load it into %s.', file_name, size / 1024 / 1024, database)
+        graph = Graph(store=SQLiteStore())
+        graph.open(database, create=True)
+        return graph
+
+    @staticmethod
+    def release(graph: Graph):
+        """Close a graph and remove its database if it is on disk."""
+        if isinstance(graph.store, SQLiteStore) and graph.store.connection is not None:
+            database = graph.store.connection.execute('PRAGMA database_list').fetchone()[2]
+            graph.store.destroy(database)
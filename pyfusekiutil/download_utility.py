@@ -0,0 +1,605 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import contextlib
+import fcntl
+import ftplib
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import urllib.parse
+import zipfile
+
+from pyfusekiutil.replay import Recording
+
+"""Downloads of vocabulary sources with a persistent cache.
+
+The cache stores the last downloaded file of each url together with the validators returned by the server
+(ETag, Last-Modified and size for HTTP, MDTM and SIZE for FTP). When the validators show that the source has not
+changed, the file is not downloaded again and the cached file is served instead.
+
+Several jobs and processes may fetch the same url at once (for example the FAST facets). Each entry is only written
+while its lock file <hash>.lock is held, and every caller gets its own copy (or hard link) of the cached file in its
+destination. The cache is disabled by default. With max_size in [cache] the least recently used files are removed
+once the cache grows beyond it.
+
+Every file fetched can be stored in a recording, from which a later run can replay it without network (see replay.py).
+"""
+
+# Size of the chunks written to disk while downloading.
+CHUNK_SIZE = 1024 * 1024
+
+
+def decompress(source: str, destination: str, url: str):
+    """
+    Decompress a downloaded file in chunks, without loading it into memory.
+
+    Can handle .zip & .gz. Of a zip archive only the first file is extracted.
+
+    :param source:      Path to the downloaded file.
+    :param destination: Path the decompressed file is written to.
+    :param url:         The url the file was downloaded from. Its ending determines the type of archive.
+    :return:            The path of the decompressed file. This is source itself if it is not an archive.
+    """
+    if url.endswith('.zip'):
+        with zipfile.ZipFile(source) as archive:
+            with archive.open(archive.infolist()[0]) as member, open(destination, 'wb') as file:
+                shutil.copyfileobj(member, file, CHUNK_SIZE)
+    elif url.endswith('.gz'):
+        with gzip.open(source, 'rb') as archive, open(destination, 'wb') as file:
+            shutil.copyfileobj(archive, file, CHUNK_SIZE)
+    else:
+        return source
+    return destination
+
+
+def copy_file(source: str, destination: str):
+    """
+    Hard link source to destination, or copy it if they are on different filesystems. Cached files are only ever
+    replaced and never written in place, so a link keeps its content when the cache changes.
+    """
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+def read_json(path: str):
+    """Read a small JSON file. An empty dict if it does not exist or cannot be read."""
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return dict()
+
+
+def write_json(path: str, value):
+    """Write a small JSON file atomically."""
+    with open(path + '.part', 'w', encoding='utf-8') as file:
+        json.dump(value, file, indent='    ')
+    os.replace(path + '.part', path)
+
+
+def close_ftp(ftp: ftplib.FTP):
+    """Quit an FTP session. Closes the connection if the server does not answer."""
+    try:
+        ftp.quit()
+    except ftplib.all_errors:
+        ftp.close()
+
+
+def split_ftp_url(url: str):
+    """Split an FTP url into host (with port), directory and file name."""
+    parts = urllib.parse.urlparse(url)
+    file_name = parts.path.split('/')[-1]
+    return parts.netloc, parts.path[:-len(file_name)], file_name
+
+
+class FtpTransport(object):
+    """
+    Downloads files over FTP with persistent sessions.
+
+    Sessions are kept open and reused for all the files downloaded from the same host. Each download takes a session
+    for itself, so that downloads in several threads do not share one. Interrupted downloads are resumed with REST
+    from the end of the partial file. Within a download when the connection drops, and in a later run if the file
+    on the server has the same modification time and size as when the partial file was started.
+    """
+
+    def __init__(self, timeout=60, retries=3, logger=logging.getLogger('ftp-transport')):
+        """
+        :param timeout: Timeout in seconds for connecting and for each read from the server.
+        :param retries: Number of times a dropped download is resumed on a new connection.
+        :param logger:  The logger used.
+        """
+        self.timeout = timeout
+        self.retries = retries
+        self.logger = logger
+        # idle sessions by host.
+        self.sessions = dict()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Create the transport configured in the [ftp] section of default.cfg. Uses the [cache] timeout if not set."""
+        return cls(timeout=config.getint('ftp', 'timeout', fallback=config.getint('cache', 'timeout', fallback=60)),
+                   retries=config.getint('ftp', 'retries', fallback=3))
+
+    def __getstate__(self):
+        # sessions are not sent to other processes. Each process opens its own.
+        state = dict(self.__dict__)
+        del state['sessions']
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.sessions = dict()
+        self.lock = threading.Lock()
+
+    def validators(self, url: str):
+        """
+        The modification time (MDTM) and the size (SIZE) of a file.
+
+        :return:    A dict with modified and size. Empty if the server does not support these commands.
+        :raises ftplib.all_errors   If the server could not be reached.
+        """
+        host, directory, file_name = split_ftp_url(url)
+        ftp = self._take_session(host)
+        try:
+            ftp.cwd(directory)
+            try:
+                validators = {
+                    'modified': ftp.sendcmd('MDTM ' + file_name)[4:].strip(),
+                    'size': ftp.size(file_name)
+                }
+            except ftplib.error_perm:
+                # the server does not support these commands.
+                validators = dict()
+        except ftplib.all_errors:
+            # the state of the session is unknown. It is not used again.
+            close_ftp(ftp)
+            raise
+        self._return_session(host, ftp)
+        return validators
+
+    def size(self, url: str):
+        """
+        The size of a file (SIZE).
+
+        :return:    The size in bytes. None if the server does not support the command.
+        :raises ftplib.error_perm   If the file or its directory does not exist.
+        :raises ftplib.all_errors   If the server could not be reached.
+        """
+        host, directory, file_name = split_ftp_url(url)
+        ftp = self._take_session(host)
+        try:
+            ftp.cwd(directory)
+            try:
+                size = ftp.size(file_name)
+            except ftplib.error_perm as error:
+                if str(error).startswith('550'):
+                    raise
+                # the server does not support the command.
+                size = None
+        except ftplib.all_errors:
+            close_ftp(ftp)
+            raise
+        self._return_session(host, ftp)
+        return size
+
+    def download(self, url: str, destination: str, validators: dict):
+        """
+        Download a file. It is written to destination.part first and moved to destination when it is complete.
+
+        :param url:             The url of the file.
+        :param destination:     The path of the downloaded file.
+        :param validators:      The validators of the file (see validators). A partial file of an earlier run is
+                                only resumed if they match. If the size is known, the download is checked against it.
+
+        :raises ftplib.all_errors   If the download failed more than retries times or is incomplete.
+        """
+        host, directory, file_name = split_ftp_url(url)
+        partial = destination + '.part'
+        # the validators of the file the partial download belongs to.
+        partial_validators = partial + '.json'
+        size = validators.get('size')
+
+        offset = 0
+        if len(validators) > 0 and os.path.exists(partial) and read_json(partial_validators) == validators:
+            offset = os.path.getsize(partial)
+            if size is not None and offset > size:
+                offset = 0
+        if offset > 0:
+            self.logger.info('Resume download of %s at %.1f of %.1f MB.', url, offset / 1e6, size / 1e6)
+        else:
+            open(partial, 'wb').close()
+            write_json(partial_validators, validators)
+
+        start = time.monotonic()
+        first_offset = offset
+        attempt = 0
+        while size is None or offset < size:
+            ftp = self._take_session(host)
+            try:
+                ftp.cwd(directory)
+                with open(partial, 'ab') as file:
+                    ftp.retrbinary('RETR ' + file_name, file.write, blocksize=CHUNK_SIZE,
+                                   rest=offset if offset > 0 else None)
+            except ftplib.error_perm as error:
+                close_ftp(ftp)
+                if offset == 0:
+                    raise
+                # the server does not support REST. Start from the beginning.
+                self.logger.warning('Could not resume download of %s (%s). Download the whole file.', url, error)
+                open(partial, 'wb').close()
+                offset = first_offset = 0
+                continue
+            except ftplib.all_errors as error:
+                close_ftp(ftp)
+                offset = os.path.getsize(partial)
+                if attempt >= self.retries:
+                    raise
+                attempt += 1
+                self.logger.warning('Download of %s was interrupted at %.1f MB (%s). Resume %s of %s.', url,
+                                    offset / 1e6, error, attempt, self.retries)
+                continue
+            self._return_session(host, ftp)
+            break
+
+        received = os.path.getsize(partial)
+        if size is not None and received != size:
+            raise ftplib.Error('Download of ' + url + ' is incomplete: received ' + str(received) + ' of ' +
+                               str(size) + ' bytes.')
+        os.replace(partial, destination)
+        os.remove(partial_validators)
+
+        elapsed = max(time.monotonic() - start, 1e-6)
+        self.logger.info('Downloaded %s: %.1f MB in %.1f seconds (%.2f MB/s).', url, (received - first_offset) / 1e6,
+                         elapsed, (received - first_offset) / 1e6 / elapsed)
+
+    def _take_session(self, host):
+        """An open session to host. Reuses an idle session of an earlier download if it is still alive."""
+        while True:
+            with self.lock:
+                idle = self.sessions.get(host, [])
+                ftp = idle.pop() if len(idle) > 0 else None
+            if ftp is None:
+                break
+            try:
+                ftp.voidcmd('NOOP')
+                return ftp
+            except ftplib.all_errors:
+                # the server has closed the idle session.
+                close_ftp(ftp)
+
+        name, _, port = host.partition(':')
+        ftp = ftplib.FTP(timeout=self.timeout)
+        ftp.connect(name, int(port) if port != '' else 21)
+        ftp.login()
+        ftp.voidcmd('TYPE I')
+        self.logger.debug('Opened FTP session to %s.', host)
+        return ftp
+
+    def _return_session(self, host, ftp):
+        with self.lock:
+            self.sessions.setdefault(host, []).append(ftp)
+
+    def close(self):
+        """Close all idle sessions."""
+        with self.lock:
+            sessions = [ftp for idle in self.sessions.values() for ftp in idle]
+            self.sessions.clear()
+        for ftp in sessions:
+            close_ftp(ftp)
+
+
+class DownloadCache(object):
+    """A persistent cache of downloaded files. Each url is stored as <hash>.data with its validators in <hash>.json."""
+
+    def __init__(self, path, skip_unchanged=False, timeout=60, ftp=None, recording: Recording = None, max_size=0,
+                 retries=3, logger=logging.getLogger('download-cache')):
+        """
+        :param path:            Directory of the cache. If None nothing is cached and every file is downloaded.
+        :param skip_unchanged:  Whether vocabularies with an unchanged source should be skipped entirely.
+        :param timeout:         Timeout in seconds for connecting and reading from the server.
+        :param ftp:             The transport used for FTP downloads. A new one with the same timeout if None.
+        :param recording:       Records every fetched file or replays them instead of downloading. If None files
+                                are neither recorded nor replayed.
+        :param max_size:        Size of the cache in MB. The least recently used files are removed when it is
+                                exceeded. 0 for no limit.
+        :param retries:         Number of times a failed connection or an unavailable server (502, 503, 504) is
+                                retried for HTTP requests.
+        :param logger:          The logger used.
+        """
+        self.path = path
+        self.skip_unchanged = skip_unchanged
+        self.timeout = timeout
+        self.ftp = ftp if ftp is not None else FtpTransport(timeout=timeout)
+        self.recording = recording if recording is not None else Recording()
+        self.max_size = max_size
+        self.retries = retries
+        self.logger = logger
+        self.session = self._create_session()
+        if self.path is not None:
+            os.makedirs(self.path, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config):
+        """Create the cache configured in the [cache] section of default.cfg. Stored in the data directory."""
+        if config.getboolean('cache', 'enabled', fallback=False):
+            path = config['data']['base'] + config.get('data', 'cache', fallback='cache/')
+        else:
+            path = None
+        return cls(path,
+                   skip_unchanged=config.getboolean('cache', 'skip_unchanged', fallback=False),
+                   timeout=config.getint('cache', 'timeout', fallback=60),
+                   ftp=FtpTransport.from_config(config),
+                   recording=Recording.from_config(config),
+                   max_size=config.getint('cache', 'max_size', fallback=0),
+                   retries=config.getint('cache', 'retries', fallback=3))
+
+    def _create_session(self):
+        # all HTTP requests for the sources share the connections and retry failed connections.
+        session = requests.Session()
+        retry = Retry(total=self.retries, connect=self.retries, read=self.retries, backoff_factor=0.5,
+                      status_forcelist=(502, 503, 504), allowed_methods=frozenset(['GET', 'HEAD']),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(max_retries=retry)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def __getstate__(self):
+        # sessions are not sent to other processes. Each process creates its own.
+        state = dict(self.__dict__)
+        del state['session']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.session = self._create_session()
+
+    def fetch(self, url: str, destination: str, accept: str = None):
+        """
+        Download a file unless the cached copy is still up to date.
+
+        During a replay the file is taken from the recording and always counts as changed.
+
+        :param url:             The url of the file (http[s]:// or ftp://).
+        :param destination:     Where the file is saved. A cached file is linked or copied there, so that the caller
+                                never works on the file shared with other jobs.
+        :param accept:          The media types requested with the Accept header of HTTP downloads. If None any
+                                type is accepted.
+        :return:                The path of the local file (destination) and whether it has changed since the last
+                                download.
+
+        :raises requests.exceptions.RequestException    If the HTTP download failed or the status is not ok.
+        :raises ftplib.all_errors                       If the FTP download failed.
+        :raises ValueError                              If the protocol is not supported.
+        :raises NotRecordedError                        If the file is replayed, but was not recorded.
+        """
+        if self.recording.replaying:
+            return self.recording.replay(url, destination), True
+
+        if self.path is None:
+            changed = self._fetch(url, dict(), destination, accept) is not None
+            self.recording.record(url, destination)
+            return destination, changed
+
+        with self._locked(url):
+            entry = self._read_entry(url)
+            data_path = self._data_path(url)
+            if not os.path.exists(data_path):
+                entry = dict()
+
+            validators = self._fetch(url, entry, data_path, accept)
+            if validators is None:
+                self.logger.info('%s has not changed since the last download. Use cached file.', url)
+                # the file counts as recently used.
+                os.utime(data_path)
+            else:
+                validators['url'] = url
+                validators['complete'] = False
+                self._write_entry(url, validators)
+            self.recording.record(url, data_path)
+            copy_file(data_path, destination)
+        if validators is not None:
+            self._evict(url)
+        return destination, validators is not None
+
+    def _fetch(self, url, entry, data_path, accept=None):
+        """Download url to data_path unless entry shows that it has not changed. The new validators or None."""
+        if url.startswith('http'):
+            return self._fetch_http(url, entry, data_path, accept)
+        elif url.startswith('ftp'):
+            return self._fetch_ftp(url, entry, data_path)
+        else:
+            raise ValueError('Invalid protocol: only HTTP[S] & FTP are supported!')
+
+    def probe(self, url: str):
+        """
+        Check that a file can be downloaded, without downloading it. Sends HEAD for HTTP and SIZE for FTP.
+
+        Some servers do not answer HEAD requests correctly. If HEAD fails with an error status, only the first byte
+        is requested with GET instead. The body is never read.
+
+        :param url:     The url of the file (http[s]:// or ftp://).
+        :return:        The size of the file in bytes. None if the server does not tell.
+
+        :raises requests.exceptions.RequestException    If the server could not be reached or the status is not ok.
+        :raises ftplib.all_errors                       If the server could not be reached or the file does not exist.
+        :raises ValueError                              If the protocol is not supported.
+        :raises NotRecordedError                        If the file is replayed, but was not recorded.
+        """
+        if self.recording.replaying:
+            return self.recording.size(url)
+        if url.startswith('http'):
+            response = self.session.head(url, allow_redirects=True, timeout=self.timeout)
+            if not response.ok:
+                self.logger.debug('HEAD %s failed with status %s. Request the first byte with GET instead.', url,
+                                  response.status_code)
+                with self.session.get(url, headers={'Range': 'bytes=0-0', 'Accept-Encoding': 'identity'},
+                                      stream=True, timeout=self.timeout) as response:
+                    pass
+            response.raise_for_status()
+            if 'Content-Encoding' in response.headers:
+                return None
+            if response.status_code == 206:
+                # Content-Range: bytes 0-0/<size>. The size may be unknown (*).
+                total = response.headers.get('Content-Range', '').rpartition('/')[2]
+                return int(total) if total.isdigit() else None
+            if 'Content-Length' in response.headers:
+                return int(response.headers['Content-Length'])
+            return None
+        elif url.startswith('ftp'):
+            return self.ftp.size(url)
+        else:
+            raise ValueError('Invalid protocol: only HTTP[S] & FTP are supported!')
+
+    def fetch_sources(self, *sources):
+        """
+        Download all the sources of a vocabulary.
+
+        :param sources: Tuples (url, destination) or (url, destination, accept). Each source is saved in its
+                        destination. accept is sent as the Accept header (see fetch).
+        :return:        The local paths of the sources in the same order. None if the vocabulary should be skipped,
+                        because none of the sources have changed since the last successful upload.
+        """
+        paths = list()
+        changed = False
+        for url, destination, *accept in sources:
+            path, source_changed = self.fetch(url, destination, *accept)
+            paths.append(path)
+            changed = changed or source_changed
+
+        if not changed and self.skip_unchanged and all(self.is_complete(url) for url, *_ in sources):
+            self.logger.info('Skipped vocabulary, because %s did not change since the last successful upload.',
+                             ', '.join(url for url, *_ in sources))
+            return None
+        return paths
+
+    def is_complete(self, url: str):
+        """Whether the vocabulary of the cached file has been successfully uploaded. See mark_complete."""
+        return self.path is not None and self._read_entry(url).get('complete', False)
+
+    def mark_complete(self, url: str):
+        """Remember that the vocabulary of the cached file has been successfully processed and uploaded."""
+        if self.path is not None:
+            with self._locked(url):
+                entry = self._read_entry(url)
+                if len(entry) > 0:
+                    entry['complete'] = True
+                    self._write_entry(url, entry)
+
+    def _fetch_http(self, url, entry, data_path, accept=None):
+        headers = dict()
+        if accept is not None:
+            headers['Accept'] = accept
+        if 'etag' in entry:
+            headers['If-None-Match'] = entry['etag']
+        if 'last_modified' in entry:
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+            if response.status_code == 304:
+                return None
+            response.raise_for_status()
+
+            validators = dict()
+            if 'ETag' in response.headers:
+                validators['etag'] = response.headers['ETag']
+            if 'Last-Modified' in response.headers:
+                validators['last_modified'] = response.headers['Last-Modified']
+            if 'Content-Length' in response.headers and 'Content-Encoding' not in response.headers:
+                validators['size'] = int(response.headers['Content-Length'])
+
+            # some servers ignore conditional requests, but still send the same validators.
+            if 'etag' in validators and validators['etag'] == entry.get('etag'):
+                return None
+            if 'last_modified' in validators and 'size' in validators \
+                    and validators['last_modified'] == entry.get('last_modified') \
+                    and validators['size'] == entry.get('size'):
+                return None
+
+            with open(data_path + '.part', 'wb') as file:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    file.write(chunk)
+        os.replace(data_path + '.part', data_path)
+        return validators
+
+    def _fetch_ftp(self, url, entry, data_path):
+        validators = self.ftp.validators(url)
+        if len(validators) == 2 and validators['modified'] == entry.get('modified') \
+                and validators['size'] == entry.get('size'):
+            return None
+
+        self.ftp.download(url, data_path, validators)
+        return validators
+
+    def close(self):
+        """Close all idle FTP sessions."""
+        self.ftp.close()
+
+    @contextlib.contextmanager
+    def _locked(self, url, blocking=True):
+        """
+        Hold the lock of the entry of url. Locks are held by open files, so that they also work between processes
+        and are released when a process dies.
+
+        :return:    Whether the lock is held. Only False if blocking is False and another job holds it.
+        """
+        with open(os.path.join(self.path, self._key(url) + '.lock'), 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _evict(self, keep: str):
+        """Remove the least recently used files until the cache is no larger than max_size. Keeps the file of keep."""
+        if self.max_size <= 0:
+            return
+        files = list()
+        for name in os.listdir(self.path):
+            if name.endswith('.data'):
+                stat = os.stat(os.path.join(self.path, name))
+                files.append((stat.st_mtime, stat.st_size, name[:-len('.data')]))
+        size = sum(file_size for _, file_size, _ in files)
+        for _, file_size, key in sorted(files):
+            if size <= self.max_size * 1024 * 1024:
+                break
+            entry = read_json(os.path.join(self.path, key + '.json'))
+            url = entry.get('url')
+            if url is None or url == keep:
+                continue
+            # an entry in use by another job is left alone.
+            with self._locked(url, blocking=False) as locked:
+                if locked:
+                    os.remove(self._data_path(url))
+                    os.remove(os.path.join(self.path, key + '.json'))
+                    size -= file_size
+                    self.logger.info('Removed %s from the cache (%.1f MB).', url, file_size / 1e6)
+
+    def _key(self, url):
+        return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+    def _data_path(self, url):
+        return os.path.join(self.path, self._key(url) + '.data')
+
+    def _read_entry(self, url):
+        return read_json(os.path.join(self.path, self._key(url) + '.json'))
+
+    def _write_entry(self, url, entry):
+        write_json(os.path.join(self.path, self._key(url) + '.json'), entry)
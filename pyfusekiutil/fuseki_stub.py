@@ -0,0 +1,158 @@
+import gzip
+import http.server
+import json
+import multiprocessing
+import re
+import urllib.parse
+
+from rdflib import Graph
+
+"""A local stand-in for Fuseki, used to replay recorded runs (see replay.py) and by the benchmarks.
+
+It answers the requests pyfusekiutil sends to a dataset: the graph store protocol on /data, the COUNT and graph list
+queries on /query and the MOVE, DROP, INSERT DATA and DELETE DATA updates on /update. Uploads are read completely and
+their triples are counted, but nothing is stored. N-Triples are counted by lines, all other formats are parsed.
+
+The stub runs in its own process, so that it does not compete with the measured code for the interpreter lock:
+
+    with FusekiStub() as stub:
+        client = FusekiClient(stub.url)
+"""
+
+# rdflib formats of the MIME types accepted by the graph store protocol.
+FORMATS = {
+    'text/turtle': 'turtle',
+    'application/x-turtle': 'turtle',
+    'text/n3': 'n3',
+    'application/rdf+xml': 'xml',
+    'application/ld+json': 'json-ld'
+}
+GRAPH = re.compile(r'GRAPH\s*<([^>]*)>')
+IRI = re.compile(r'<([^>]*)>')
+
+
+def count_triples(body: bytes, content_type: str):
+    mime_type = content_type.split(';')[0].strip()
+    if mime_type not in FORMATS:
+        return sum(1 for line in body.splitlines() if line.strip() != b'' and not line.startswith(b'#'))
+    return len(Graph().parse(data=body, format=FORMATS[mime_type]))
+
+
+class FusekiStubHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = list()
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip(), 16)
+                if size == 0:
+                    # trailers end with an empty line.
+                    while self.rfile.readline().strip() != b'':
+                        pass
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            body = b''.join(chunks)
+        else:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Content-Encoding', '') == 'gzip':
+            body = gzip.decompress(body)
+        return body
+
+    def reply(self, value, status=200):
+        data = json.dumps(value).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def route(self):
+        url = urllib.parse.urlsplit(self.path)
+        return url.path.rstrip('/').split('/')[-1], urllib.parse.parse_qs(url.query)
+
+    def do_PUT(self):
+        endpoint, params = self.route()
+        body = self.body()
+        if endpoint != 'data' or 'graph' not in params:
+            return self.reply({'error': 'Unknown endpoint ' + self.path}, 404)
+        graph = params['graph'][0]
+        count = count_triples(body, self.headers.get('Content-Type', ''))
+        graphs = self.server.graphs
+        graphs[graph] = count if self.command == 'PUT' else graphs.get(graph, 0) + count
+        self.reply({'count': count, 'tripleCount': count, 'quadCount': 0})
+
+    def do_POST(self):
+        endpoint, params = self.route()
+        if endpoint != 'update':
+            return self.do_PUT()
+        update = self.body().decode('utf-8')
+        graphs = self.server.graphs
+        names = GRAPH.findall(update)
+        if update.startswith('MOVE'):
+            names = IRI.findall(update)
+            graphs[names[1]] = graphs.pop(names[0], 0)
+        elif update.startswith('DROP'):
+            graphs.pop(names[0], None)
+        elif update.startswith(('INSERT DATA', 'DELETE DATA')):
+            count = sum(1 for line in update.splitlines() if line.rstrip().endswith('.'))
+            graphs[names[0]] = graphs.get(names[0], 0) + (count if update.startswith('INSERT') else -count)
+        else:
+            return self.reply({'error': 'Unsupported update.'}, 400)
+        self.reply({})
+
+    def do_GET(self):
+        endpoint, params = self.route()
+        if endpoint != 'query':
+            return self.reply({'error': 'Unknown endpoint ' + self.path}, 404)
+        query = params.get('query', [''])[0]
+        names = GRAPH.findall(query)
+        if 'COUNT' in query and names:
+            bindings = [{'count': {'type': 'literal', 'value': str(self.server.graphs.get(names[0], 0))}}]
+        else:
+            bindings = [{'g': {'type': 'uri', 'value': name}} for name in sorted(self.server.graphs)]
+        self.reply({'head': {}, 'results': {'bindings': bindings}})
+
+    def do_DELETE(self):
+        endpoint, params = self.route()
+        self.server.graphs.pop(params.get('graph', [''])[0], None)
+        self.reply({})
+
+
+class FusekiStub(object):
+    """Serves a stand-in for a Fuseki dataset on a free local port until it is stopped."""
+
+    def __init__(self, dataset='skosmos'):
+        """
+        :param dataset: The name of the dataset in the url.
+        """
+        self.dataset = dataset
+        self.server = None
+        self.process = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/{}'.format(self.server.server_address[1], self.dataset)
+
+    def start(self):
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FusekiStubHandler)
+        self.server.graphs = dict()
+        # the socket is bound before the process is started, so the port is known and accepts connections at once.
+        self.process = multiprocessing.get_context('fork').Process(target=self.server.serve_forever, daemon=True)
+        self.process.start()
+        self.server.socket.close()
+        return self
+
+    def stop(self):
+        self.process.terminate()
+        self.process.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
@@ -1,56 +1,568 @@
-from SPARQLWrapper import SPARQLWrapper, JSON
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from rdflib import Graph
 
+import hashlib
 import logging
 import json
 import os
+import threading
+import time
+import zlib
+
+# Size of the chunks read from disk while uploading.
+CHUNK_SIZE = 1024 * 1024
+# Log the progress of an upload every time this many bytes have been sent.
+PROGRESS_INTERVAL = 64 * 1024 * 1024
+NT_MIME_TYPE = 'application/n-triples'
 
 
 class FusekiError(Exception):
     """Fuseki has returned an error message!"""
 
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class UploadReader(object):
+    """Reads a file for an upload and logs the progress and throughput."""
+
+    def __init__(self, file, name: str, logger=logging.getLogger('fuseki-upload')):
+        """
+        :param file:    The file opened in binary mode.
+        :param name:    Name of the upload used in the log messages.
+        :param logger:  The logger used.
+        """
+        self.file = file
+        self.name = name
+        self.logger = logger
+        self.total = os.fstat(file.fileno()).st_size
+        self.sent = 0
+        self.next_report = PROGRESS_INTERVAL
+        self.start = time.monotonic()
+
+    def __len__(self):
+        return self.total
+
+    def read(self, size=-1):
+        chunk = self.file.read(size)
+        self.sent += len(chunk)
+        if self.sent >= self.next_report or (len(chunk) == 0 and self.sent == self.total):
+            self.next_report = self.sent + PROGRESS_INTERVAL
+            self.logger.info('Uploaded %.1f of %.1f MB of %s (%.1f MB/s).', self.sent / 1e6, self.total / 1e6,
+                             self.name, self.throughput() / 1e6)
+        return chunk
+
+    def throughput(self):
+        """Bytes read per second since the upload started."""
+        return self.sent / max(time.monotonic() - self.start, 1e-6)
+
+
+class GraphReader(object):
+    """
+    Serializes a graph as N-Triples for an upload without writing it to disk.
+
+    The graph is serialized in a separate thread into a pipe. The upload reads the other end of the pipe, so that
+    serializing and sending overlap and the serialized graph is never held in memory as a whole.
+    """
+
+    def __init__(self, graph: Graph, name: str):
+        """
+        :param graph:   The graph to serialize.
+        :param name:    Name of the upload used in the log messages.
+        """
+        self.graph = graph
+        self.name = name
+        self.sent = 0
+        self.start = time.monotonic()
+        self.error = None
+
+    def __iter__(self):
+        read_fd, write_fd = os.pipe()
+        thread = threading.Thread(target=self._serialize, args=(write_fd,), daemon=True)
+        thread.start()
+        # if the upload stops early the pipe is closed and the serializer fails with a broken pipe.
+        with open(read_fd, 'rb') as pipe:
+            for chunk in iter(lambda: pipe.read(CHUNK_SIZE), b''):
+                self.sent += len(chunk)
+                yield chunk
+        thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _serialize(self, write_fd):
+        try:
+            with open(write_fd, 'wb') as pipe:
+                self.graph.serialize(destination=pipe, format='nt', encoding='utf-8')
+        except Exception as error:
+            self.error = error
+
+    def throughput(self):
+        """Bytes serialized per second since the upload started."""
+        return self.sent / max(time.monotonic() - self.start, 1e-6)
+
+
+def gzip_chunks(chunks):
+    """Compress an iterable of chunks with gzip. Yields the compressed chunks."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if len(data) > 0:
+            yield data
+    yield compressor.flush()
+
+
+class FusekiClient(object):
+    """
+    Access to a Fuseki dataset.
+
+    All requests share a session with a connection pool, so that connections are kept alive between requests.
+    Failed connections and requests which can safely be repeated are retried.
+    """
+
+    def __init__(self, url='http://localhost:3030/skosmos', user=None, password=None, connect_timeout=10.0,
+                 read_timeout=1800.0, pool_size=10, retries=3, compress=False, chunk_size=500000, staging=False):
+        """
+        :param url:             The base url of the Fuseki dataset.
+        :param user:            User name for basic authentication. No authentication if None.
+        :param password:        Password for basic authentication.
+        :param connect_timeout: Seconds to wait for a connection to Fuseki.
+        :param read_timeout:    Seconds to wait for an answer of Fuseki. Large uploads may take a while to index.
+        :param pool_size:       Maximum number of connections kept alive.
+        :param retries:         Number of retries for failed connections and idempotent requests.
+        :param compress:        Compress uploads with gzip.
+        :param chunk_size:      Number of triples sent with each request of a bulk load.
+        :param staging:         Load graphs into a staging graph first and swap it with the live graph once the load
+                                is verified. Queries never see a partially loaded graph.
+        """
+        self.url = url.rstrip('/')
+        self.user = user
+        self.password = password
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_size = pool_size
+        self.retries = retries
+        self.compress = compress
+        self.chunk_size = chunk_size
+        self.staging = staging
+        self.session = self._create_session()
+
+    @classmethod
+    def from_config(cls, config):
+        """Create a client for the dataset configured in the [fuseki] section of default.cfg."""
+        return cls(url=config.get('fuseki', 'url', fallback='http://localhost:3030/skosmos'),
+                   user=config.get('fuseki', 'user', fallback='') or None,
+                   password=config.get('fuseki', 'password', fallback='') or None,
+                   connect_timeout=config.getfloat('fuseki', 'connect_timeout', fallback=10.0),
+                   read_timeout=config.getfloat('fuseki', 'read_timeout', fallback=1800.0),
+                   pool_size=config.getint('fuseki', 'pool_size', fallback=10),
+                   retries=config.getint('fuseki', 'retries', fallback=3),
+                   compress=config.getboolean('fuseki', 'compress', fallback=False),
+                   chunk_size=config.getint('fuseki', 'chunk_size', fallback=500000),
+                   staging=config.getboolean('fuseki', 'staging', fallback=False))
+
+    def _create_session(self):
+        session = requests.Session()
+        if self.user is not None:
+            session.auth = (self.user, self.password)
+        # uploads are not retried after they have been sent. Only idempotent requests are retried on server errors.
+        retry = Retry(total=self.retries, connect=self.retries, read=0, backoff_factor=0.5,
+                      status_forcelist=(502, 503, 504), allowed_methods=frozenset(['GET', 'HEAD', 'DELETE']),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=retry)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def __getstate__(self):
+        # sessions are not sent to other processes. Each process creates its own.
+        state = dict(self.__dict__)
+        del state['session']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.session = self._create_session()
+
+    def request(self, method: str, endpoint: str, **kwargs):
+        """
+        Send a request to an endpoint of the dataset.
+
+        :param method:      The HTTP method.
+        :param endpoint:    The endpoint of the dataset (data, query, update).
+        :param kwargs:      Passed on to requests.
+        :return:            The response.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.request(method, self.url + '/' + endpoint, **kwargs)
+
+    def upload(self, method: str, graph: str, source, content_type: str):
+        """
+        Upload a file or an in-memory graph to a graph with the graph store protocol.
+
+        A file is streamed from disk as the request body. Nothing is loaded into memory. An rdflib graph is
+        serialized as N-Triples while it is sent, without writing it to disk.
+
+        :param method:          PUT to replace the graph, POST to add to it.
+        :param graph:           The graph name.
+        :param source:          The path of the file to upload or an rdflib Graph.
+        :param content_type:    The MIME type of the file. Ignored for graphs, which are always sent as N-Triples.
+        :return:                The response of Fuseki.
+        """
+        if isinstance(source, Graph):
+            headers = {'Content-Type': NT_MIME_TYPE}
+            reader = GraphReader(source, graph)
+            response = self._send(method, graph, reader, iter(reader), headers)
+            logging.info('Sent graph %s with %s triples (%.1f MB) to Fuseki in %.1f seconds.', graph, len(source),
+                         reader.sent / 1e6, time.monotonic() - reader.start)
+            return response
+
+        headers = {'Content-Type': content_type}
+        with open(source, 'rb') as file:
+            reader = UploadReader(file, source)
+            response = self._send(method, graph, reader, iter(lambda: reader.read(CHUNK_SIZE), b''), headers)
+        logging.info('Sent %s (%.1f MB) to Fuseki in %.1f seconds.', source, reader.sent / 1e6,
+                     time.monotonic() - reader.start)
+        return response
+
+    def _send(self, method, graph, body, chunks, headers):
+        if self.compress:
+            headers['Content-Encoding'] = 'gzip'
+            body = gzip_chunks(chunks)
+        return self.request(method, 'data', params={'graph': graph}, data=body, headers=headers)
+
+    def query(self, query: str):
+        """Run a SPARQL query and return the JSON results."""
+        response = self.request('GET', 'query', params={'query': query},
+                                headers={'Accept': 'application/sparql-results+json'})
+        if not response.ok:
+            logging.error(response.text)
+            raise FusekiError('Query failed with status ' + str(response.status_code) + '.', response.status_code)
+        return response.json()
+
+    def count_triples(self, graph: str):
+        """The number of triples in a graph."""
+        result = self.query('SELECT (COUNT(*) AS ?count) WHERE { GRAPH <' + graph + '> { ?s ?p ?o } }')
+        return int(result['results']['bindings'][0]['count']['value'])
+
+    def update(self, update: str):
+        """
+        Run a SPARQL update.
+
+        :raises FusekiError    If Fuseki did not accept the update.
+        """
+        response = self.request('POST', 'update', data=update.encode('utf-8'),
+                                headers={'Content-Type': 'application/sparql-update; charset=utf-8'})
+        if not response.ok:
+            logging.error(response.text)
+            raise FusekiError('Update failed with status ' + str(response.status_code) + '.', response.status_code)
+        return response
+
+
+_default_client = None
+
+
+def default_client():
+    """The client used when none is given. Connects to the local Fuseki unless set_default_client was called."""
+    global _default_client
+    if _default_client is None:
+        _default_client = FusekiClient()
+    return _default_client
+
 
-def delete_graph(uri):
-    url = 'http://localhost:3030/skosmos/data?graph=' + uri
-    response = requests.request('DELETE', url)
+def set_default_client(client: FusekiClient):
+    global _default_client
+    _default_client = client
+
+
+def delete_graph(uri, client: FusekiClient = None):
+    response = (client or default_client()).request('DELETE', 'data', params={'graph': uri})
     if response.ok:
         logging.info(response.text)
     else:
         logging.error(response.text)
 
 
-def put_graph(uri, data):
-    url = 'http://localhost:3030/skosmos/data?graph=' + uri
-    data = {'name': ('upload.ttl', data, 'application/x-turtle')}
-    response = requests.request('PUT', url, files=data)
+def put_graph(uri, path, content_type='text/turtle', client: FusekiClient = None):
+    """
+    Replace a graph with the content of a file or an in-memory rdflib graph (see FusekiClient.upload).
+
+    :return:    The number of triples loaded.
+    :raises FusekiError     If the file could not be uploaded.
+    """
+    client = client or default_client()
+    if client.staging:
+        return replace_graph(uri, path, content_type, client)
+
+    response = client.upload('PUT', uri, path, content_type)
     if response.ok:
         logging.info(response.text)
     else:
         logging.error(response.text)
-        raise FusekiError('Could not upload file.')
+        raise FusekiError('Could not upload file: ' + response.text, response.status_code)
+    return json.loads(response.text)['tripleCount']
+
+
+def staging_graph_name(uri):
+    """The name of the staging graph of a graph. Always the same, so that left over staging graphs can be found."""
+    return 'urn:pyfusekiutil:staging:' + hashlib.sha1(uri.encode('utf-8')).hexdigest()
+
+
+def replace_graph(uri, path, content_type='text/turtle', client: FusekiClient = None, bulk=False):
+    """
+    Replace a graph without downtime. Queries see the old content until the new content is completely loaded.
+
+    If staging is enabled in the client the file is loaded into a staging graph first. If the staging graph holds
+    the triples loaded it is moved to the graph with SPARQL Update MOVE. This replaces the graph in a single
+    transaction. If anything fails the staging graph is dropped.
+
+    :param uri:             The graph name.
+    :param path:            The file with the new content or an rdflib graph.
+    :param content_type:    The MIME type of the file.
+    :param client:          The client of the Fuseki dataset.
+    :param bulk:            Load the file in chunks with bulk_load. The file has to be in N-Triples.
+    :return:                The number of triples loaded.
+
+    :raises FusekiError     If the file could not be loaded or the loaded graph is incomplete.
+    """
+    client = client or default_client()
+    if not client.staging:
+        return bulk_load(uri, path, client) if bulk else put_graph(uri, path, content_type, client)
+
+    staging = staging_graph_name(uri)
+    logging.info('Load %s into staging graph %s.', uri, staging)
+    try:
+        if bulk:
+            expected = bulk_load(staging, path, client)
+        else:
+            response = client.upload('PUT', staging, path, content_type)
+            if not response.ok:
+                logging.error(response.text)
+                raise FusekiError('Could not upload file: ' + response.text, response.status_code)
+            expected = json.loads(response.text)['tripleCount']
+
+        # Fuseki counts every triple it parses, but the graph stores duplicate triples only once. The staging graph
+        # can therefore hold fewer triples than were loaded, but never none or more.
+        count = client.count_triples(staging)
+        if count > expected or (count == 0 and expected > 0):
+            raise FusekiError('Staging graph of ' + uri + ' has ' + str(count) + ' triples, but ' + str(expected) +
+                              ' triples were loaded.')
+        client.update('MOVE GRAPH <' + staging + '> TO <' + uri + '>')
+    except Exception:
+        logging.error('Could not replace graph %s. Drop staging graph.', uri)
+        try:
+            client.update('DROP SILENT GRAPH <' + staging + '>')
+        except (FusekiError, requests.exceptions.RequestException):
+            logging.exception('Could not drop staging graph %s.', staging)
+        if bulk and os.path.exists(path + '.progress'):
+            # the chunks loaded so far have been dropped. The next load has to start from the beginning.
+            os.remove(path + '.progress')
+        raise
+    logging.info('Replaced %s with %s triples.', uri, count)
+    return count
+
+
+def blank_nodes(line: bytes):
+    """The labels of the blank nodes in the subject and the object of a triple in N-Triples. Empty if there are none."""
+    # subject and predicate never contain white space. A literal object may contain '_:' and is no blank node.
+    terms = line.split(None, 2)
+    labels = list()
+    if len(terms) == 3:
+        if terms[0].startswith(b'_:'):
+            labels.append(terms[0])
+        if terms[2].startswith(b'_:'):
+            # a label never ends with a dot. The dot which ends the triple may follow without white space.
+            labels.append(terms[2].split(None, 1)[0].rstrip(b'.'))
+    return labels
+
+
+class BlankNodeGroups(object):
+    """
+    Groups the triples which are connected by blank nodes and packs the groups into chunks.
+
+    The groups are found with a union-find over the blank node labels. Only the labels are held in memory, never the
+    triples.
+    """
+
+    def __init__(self):
+        # the parent of each label. The root of a group is its own parent.
+        self.parents = dict()
+        self.sizes = dict()
+        self.chunks = dict()
+
+    def find(self, label: bytes):
+        """The root label of the group of label."""
+        root = self.parents.setdefault(label, label)
+        while root != self.parents[root]:
+            root = self.parents[root]
+        # point every label on the way directly to the root.
+        while label != root:
+            self.parents[label], label = root, self.parents[label]
+        return root
 
+    def join(self, *labels):
+        """Put the labels of a triple into the same group."""
+        root = self.find(labels[0])
+        for label in labels[1:]:
+            other = self.find(label)
+            if other != root:
+                self.parents[other] = root
 
-def get_graph(uri, path):
-    url = 'http://localhost:3030/skosmos/data?graph=' + uri
-    response = requests.request('GET', url)
+    def count(self, label: bytes):
+        """Count a triple of the group of label."""
+        root = self.find(label)
+        self.sizes[root] = self.sizes.get(root, 0) + 1
+
+    def pack(self, chunk_size: int):
+        """
+        Pack the counted groups into chunks of at most chunk_size triples. A larger group gets a chunk of its own.
+
+        :return:    The number of triples in each chunk.
+        """
+        chunks = list()
+        for root, size in self.sizes.items():
+            if len(chunks) == 0 or chunks[-1] + size > chunk_size:
+                chunks.append(0)
+            chunks[-1] += size
+            self.chunks[root] = len(chunks) - 1
+        return chunks
+
+    def chunk(self, label: bytes):
+        """The index of the chunk the group of label was packed into."""
+        return self.chunks[self.find(label)]
+
+
+def bulk_load(uri, path, client: FusekiClient = None, retries=3):
+    """
+    Load a large N-Triples file into a graph in chunks. Replaces the current content of the graph.
+
+    The first chunk is sent with PUT, all other chunks are added with POST. Each chunk is retried on its own.
+    Triples with blank nodes are collected and sent after all the other triples, because blank node labels are only
+    valid within a single request. Triples connected by blank nodes are always sent in the same chunk. Only such a
+    group of connected triples can make a chunk larger than the chunk size.
+
+    The number of chunks which were loaded is stored next to the file. If the load is interrupted and started again
+    for the same file and graph, it continues after the last chunk which was loaded.
+
+    :param uri:     The graph name.
+    :param path:    The N-Triples file.
+    :param client:  The client of the Fuseki dataset. Determines the number of triples per chunk.
+    :param retries: How many times a failed chunk is retried.
+    :return:        The number of triples sent.
+
+    :raises FusekiError    If a chunk could not be loaded.
+    """
+    client = client or default_client()
+    progress_path = path + '.progress'
+    chunk_path = path + '.chunk'
+    blank_path = path + '.blank'
+
+    stat = os.stat(path)
+    state = {'graph': uri, 'size': stat.st_size, 'modified': stat.st_mtime, 'chunks': 0}
+    if os.path.exists(progress_path):
+        with open(progress_path, 'r') as file:
+            previous = json.load(file)
+        if all(previous[key] == state[key] for key in ('graph', 'size', 'modified')):
+            state['chunks'] = previous['chunks']
+            logging.info('Resume bulk load of %s into %s after chunk %s.', path, uri, state['chunks'])
+
+    def send_chunk(number, lines, chunk_file):
+        if number < state['chunks']:
+            return
+        method = 'PUT' if number == 0 else 'POST'
+        for attempt in range(retries + 1):
+            start = time.monotonic()
+            try:
+                response = client.upload(method, uri, chunk_file, NT_MIME_TYPE)
+                if response.ok:
+                    break
+                message = response.text
+            except requests.exceptions.RequestException as error:
+                message = str(error)
+            logging.warning('Chunk %s of %s failed (attempt %s of %s): %s', number, path, attempt + 1, retries + 1,
+                            message)
+            if attempt == retries:
+                raise FusekiError('Could not load chunk ' + str(number) + ' of ' + path + ' into ' + uri + '.')
+            time.sleep(2 ** attempt)
+        seconds = max(time.monotonic() - start, 1e-6)
+        logging.info('Loaded chunk %s of %s: %s triples in %.1f seconds (%.0f triples/s, %.1f MB/s).', number, path,
+                     lines, seconds, lines / seconds, os.path.getsize(chunk_file) / seconds / 1e6)
+        state['chunks'] = number + 1
+        with open(progress_path, 'w') as file:
+            json.dump(state, file)
+
+    number = 0
+    lines = 0
+    total = 0
+    groups = BlankNodeGroups()
+    with open(path, 'rb') as source, open(blank_path, 'wb') as blank:
+        chunk = open(chunk_path, 'wb')
+        for line in source:
+            if line.strip() == b'' or line.startswith(b'#'):
+                continue
+            labels = blank_nodes(line)
+            if len(labels) > 0:
+                blank.write(line)
+                groups.join(*labels)
+                continue
+            chunk.write(line)
+            lines += 1
+            if lines == client.chunk_size:
+                chunk.close()
+                send_chunk(number, lines, chunk_path)
+                total += lines
+                number += 1
+                lines = 0
+                chunk = open(chunk_path, 'wb')
+        chunk.close()
+
+    if lines > 0 or number == 0:
+        send_chunk(number, lines, chunk_path)
+        total += lines
+        number += 1
+    # the triples are counted per group and the groups are packed into chunks in the order they appear.
+    with open(blank_path, 'rb') as blank:
+        for line in blank:
+            groups.count(blank_nodes(line)[0])
+    chunks = groups.pack(client.chunk_size)
+    blank_chunk_paths = [blank_path + '.' + str(index) for index in range(len(chunks))]
+    if len(chunks) > 0:
+        blank_chunks = [open(blank_chunk_path, 'wb') for blank_chunk_path in blank_chunk_paths]
+        with open(blank_path, 'rb') as blank:
+            for line in blank:
+                blank_chunks[groups.chunk(blank_nodes(line)[0])].write(line)
+        for blank_chunk in blank_chunks:
+            blank_chunk.close()
+    for lines, blank_chunk_path in zip(chunks, blank_chunk_paths):
+        send_chunk(number, lines, blank_chunk_path)
+        total += lines
+        number += 1
+
+    for temporary in [chunk_path, blank_path, progress_path] + blank_chunk_paths:
+        os.remove(temporary)
+    logging.info('Bulk load of %s into %s complete. Sent %s triples.', path, uri, total)
+    return total
+
+
+def get_graph(uri, path, client: FusekiClient = None):
+    response = (client or default_client()).request('GET', 'data', params={'graph': uri},
+                                                    headers={'Accept': 'text/turtle'}, stream=True)
     if response.ok:
-        with open(path, 'w') as file:
-            file.write(response.text)
+        with open(path, 'wb') as file:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                file.write(chunk)
     else:
         logging.error(response.text)
 
 
-def fuseki_graph_list(path):
-    sparql = SPARQLWrapper('http://localhost:3030/skosmos/query')
-    sparql.setQuery("""SELECT ?g
+def fuseki_graph_list(path, client: FusekiClient = None):
+    logging.info('Query Fuseki endpoint for all graphs found in the skosmos dataset.')
+    response = (client or default_client()).query("""SELECT ?g
                         WHERE {
                             GRAPH ?g { }
                         }""")
 
-    sparql.setReturnFormat(JSON)
-    logging.info('Query Fuseki endpoint for all graphs found in the skosmos dataset.')
-    response = sparql.query().convert()
-
     all_graph_uris = list()
     for graph in response['results']['bindings']:
         all_graph_uris.append(graph['g']['value'])
@@ -70,12 +582,12 @@ def sheet_graph_names_list(path, wks):
     return graph_names
 
 
-def create_diff(path, wks):
+def create_diff(path, wks, client: FusekiClient = None):
     path = path + '/graphs/'
     if not os.path.exists(path):
         os.mkdir(path)
 
-    fuseki = fuseki_graph_list(path)
+    fuseki = fuseki_graph_list(path, client)
     sheet = sheet_graph_names_list(path, wks)
 
     sheet_set = set(sheet)
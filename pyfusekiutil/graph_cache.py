@@ -0,0 +1,157 @@
+from rdflib import Graph, BNode
+import rdflib
+
+from array import array
+import gc
+import hashlib
+import logging
+import os
+import pickle
+import time
+
+from pyfusekiutil import __version__
+
+"""A persistent cache of parsed graphs.
+
+Parsing with rdflib is slow, often slower than the download. The cache stores the triples of a parsed source in a
+compact binary form: a table of all distinct terms and an array of term ids, three for each triple. Loading this
+only needs to create each term once and is much faster than parsing the source again. This matters most when a run
+is repeated after a failed skosify or upload.
+
+Entries are keyed by the hash of the source content and its format and are evicted least recently used first once
+the cache exceeds its size.
+"""
+
+
+class GraphCache(object):
+    """Stores the triples of each parsed source as <key>.graph in the cache directory."""
+
+    def __init__(self, path, max_size=2 * 1024 * 1024 * 1024, logger=logging.getLogger('graph-cache')):
+        """
+        :param path:        Directory of the cache. If None every source is parsed.
+        :param max_size:    Maximum size of all entries in bytes. The least recently used entries are removed beyond.
+        :param logger:      The logger used.
+        """
+        self.path = path
+        self.max_size = max_size
+        self.logger = logger
+        if self.path is not None:
+            os.makedirs(self.path, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config):
+        """Create the cache configured in the [graph_cache] section. It is disabled unless enabled is set."""
+        if not config.getboolean('graph_cache', 'enabled', fallback=False):
+            return cls(None)
+        return cls(config['data']['base'] + config.get('data', 'graph_cache', fallback='graph-cache/'),
+                   max_size=config.getint('graph_cache', 'max_size', fallback=2048) * 1024 * 1024)
+
+    @staticmethod
+    def key(file_name: str, format: str):
+        """The key of a source: a hash of its content, its format and the versions of the parser."""
+        digest = hashlib.sha256()
+        with open(file_name, 'rb') as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b''):
+                digest.update(chunk)
+        digest.update('\n'.join([format, rdflib.__version__, __version__]).encode('utf-8'))
+        return digest.hexdigest()
+
+    def parse(self, graph: Graph, file_name: str, format: str):
+        """
+        Parse a source into graph. Taken from the cache if the same content has been parsed before.
+
+        :param graph:       The graph the triples are added to.
+        :param file_name:   Path to the source.
+        :param format:      The format of the source as understood by rdflib.
+        :return:            The graph.
+
+        :raises Any error of the parser if the source is not in the cache and cannot be parsed.
+        """
+        if self.path is None:
+            return graph.parse(file_name, format=format)
+
+        key = self.key(file_name, format)
+        if self.load(graph, key):
+            self.logger.info('Loaded %s from the graph cache.', file_name)
+            return graph
+
+        start = time.monotonic()
+        # only the triples of the source may be stored.
+        parsed = graph if len(graph) == 0 else Graph()
+        parsed.parse(file_name, format=format)
+        self.logger.debug('Parsed %s in %.1f seconds.', file_name, time.monotonic() - start)
+        self.store(parsed, key)
+        if parsed is not graph:
+            for prefix, namespace in parsed.namespaces():
+                graph.bind(prefix, namespace)
+            graph.addN((s, p, o, graph) for s, p, o in parsed)
+        return graph
+
+    def load(self, graph: Graph, key: str):
+        """
+        Add the triples of an entry to graph.
+
+        Blank nodes are replaced by new ones, as if the source was parsed again.
+
+        :return: Whether the entry existed.
+        """
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, 'rb') as file:
+                namespaces, terms, ids = pickle.load(file)
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            return False
+        # marks the entry as recently used.
+        os.utime(entry_path)
+
+        terms = [BNode() if isinstance(term, BNode) else term for term in terms]
+        for prefix, namespace in namespaces:
+            graph.bind(prefix, namespace)
+        ids = iter(ids)
+        # without a pause the cyclic garbage collector would scan the growing graph over and over again.
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            graph.addN((terms[s], terms[p], terms[o], graph) for s, p, o in zip(ids, ids, ids))
+        finally:
+            if gc_enabled:
+                gc.enable()
+        return True
+
+    def store(self, graph: Graph, key: str):
+        """Store the triples of graph as entry key. Evicts old entries if the cache grows too large."""
+        term_ids = dict()
+        ids = array('L')
+        for triple in graph:
+            for term in triple:
+                term_id = term_ids.get(term)
+                if term_id is None:
+                    term_id = term_ids[term] = len(term_ids)
+                ids.append(term_id)
+        terms = list(term_ids)
+        term_ids = None
+
+        entry_path = self._entry_path(key)
+        with open(entry_path + '.part', 'wb') as file:
+            pickle.dump((list(graph.namespaces()), terms, ids), file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(entry_path + '.part', entry_path)
+        self.logger.debug('Stored %s triples with %s terms as %s.', len(ids) // 3, len(terms), key)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is no larger than max_size."""
+        entries = list()
+        for name in os.listdir(self.path):
+            if name.endswith('.graph'):
+                stat = os.stat(os.path.join(self.path, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        size = sum(entry[1] for entry in entries)
+        for mtime, entry_size, name in sorted(entries):
+            if size <= self.max_size:
+                break
+            os.remove(os.path.join(self.path, name))
+            size -= entry_size
+            self.logger.info('Evicted %s from the graph cache.', name)
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key + '.graph')
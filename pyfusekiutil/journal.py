@@ -0,0 +1,230 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+"""A journal of the state of each row of an update run.
+
+Every row of a run passes through the states pending, downloaded, skosified and uploaded, or ends as failed. The
+journal records each state as soon as it is reached, together with the files produced so far (the downloaded source
+and, if it was written to disk, the skosified graph) and the results for the sheet.
+
+A run which did not finish, because it crashed or the machine went down, can be resumed with --resume. Rows which
+were uploaded or failed in that run are not loaded again. Their results are written to the sheet once more, in case
+they were lost with the run. Rows whose files are still on disk continue after the last stage they completed. All
+other rows start from the beginning.
+
+The journal also keeps the outcome of each row by the fingerprint of its input columns in the sheet. In the changed
+rows only mode ([journal] changed_only or --changed-only) a row which was uploaded within the maximum age and has not
+been edited since is settled and skipped without contacting its source. New, edited, failed and old rows are loaded.
+"""
+
+PENDING = 'pending'
+DOWNLOADED = 'downloaded'
+SKOSIFIED = 'skosified'
+UPLOADED = 'uploaded'
+FAILED = 'failed'
+FINAL_STATES = (UPLOADED, FAILED)
+
+
+def row_fingerprint(values: list):
+    """The fingerprint of the values of a row. Changes whenever one of them is edited."""
+    return hashlib.sha256(json.dumps([str(value) for value in values]).encode('utf-8')).hexdigest()
+
+
+def file_state(path):
+    """The size and modification time of a file. Used to check that a file has not changed since it was recorded."""
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime
+
+
+class RunJournal(object):
+    """Stores the state of each row of each run in an SQLite database. Only written by the main process."""
+
+    def __init__(self, path=None, resume=False, logger=logging.getLogger('run-journal')):
+        """
+        :param path:    The database file. If None nothing is recorded and nothing can be resumed.
+        :param resume:  Continue the last run if it did not finish. Otherwise a new run is started.
+        :param logger:  The logger used.
+        """
+        self.path = path
+        self.resume = resume
+        self.logger = logger
+        self.run = None
+        self.resumed = False
+        self.connection = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Create the journal configured in the [journal] section. Stored in the data directory."""
+        if not config.getboolean('journal', 'enabled', fallback=True):
+            return cls(None)
+        return cls(config['data']['base'] + config.get('data', 'journal', fallback='journal.sqlite'),
+                   resume=config.getboolean('journal', 'resume', fallback=False))
+
+    def __getstate__(self):
+        # only the main process writes to the journal. Several processes writing to the same database wait for each
+        # other's locks. A copy sent to a worker process records nothing and never opens the database.
+        state = dict(self.__dict__)
+        del state['connection']
+        del state['lock']
+        state['path'] = None
+        state['resumed'] = False
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        if self.connection is None:
+            # the stages of a row may run in other threads, which all write to the journal.
+            self.connection = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+            self.connection.execute('PRAGMA journal_mode = WAL')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, started TEXT, '
+                                    'finished TEXT)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS jobs (run INTEGER, row INTEGER, title TEXT, '
+                                    'url TEXT, graph TEXT, state TEXT, reached TEXT, source TEXT, source_size INTEGER, '
+                                    'source_modified REAL, skosified TEXT, skosified_size INTEGER, '
+                                    'skosified_modified REAL, fingerprint TEXT, namespace TEXT, sheet_update TEXT, '
+                                    'updated TEXT, PRIMARY KEY (run, row))')
+            # the last outcome of each version of a row, kept across runs.
+            self.connection.execute('CREATE TABLE IF NOT EXISTS outcomes (fingerprint TEXT PRIMARY KEY, '
+                                    'state TEXT, finished REAL)')
+        return self.connection
+
+    def _execute(self, sql, parameters=()):
+        with self.lock:
+            return self._connect().execute(sql, parameters).fetchall()
+
+    def start(self):
+        """Start a new run or, if resume is set, continue the last run if it did not finish."""
+        if self.path is None:
+            return
+        if self.resume:
+            rows = self._execute('SELECT id, started, finished FROM runs ORDER BY id DESC LIMIT 1')
+            if len(rows) > 0 and rows[0][2] is None:
+                self.run = rows[0][0]
+                self.resumed = True
+                self.logger.info('Resume run %s started at %s.', self.run, rows[0][1])
+                return
+            self.logger.info('The last run has finished. There is nothing to resume. Start a new run.')
+        with self.lock:
+            self.run = self._connect().execute('INSERT INTO runs (started) VALUES (?)',
+                                               (time.strftime('%Y-%m-%dT%H:%M:%S'),)).lastrowid
+        self.logger.info('Started run %s.', self.run)
+
+    def finish(self):
+        """Mark the run as finished. It can no longer be resumed."""
+        if self.path is not None:
+            self._execute('UPDATE runs SET finished = ? WHERE id = ?', (time.strftime('%Y-%m-%dT%H:%M:%S'), self.run))
+
+    def _entry(self, row: int, fuseki):
+        """The entry of a row in this run, if it is about the same vocabulary. Otherwise None."""
+        entries = self._execute('SELECT title, url, graph, state, reached, source, source_size, source_modified, '
+                                'skosified, skosified_size, skosified_modified, fingerprint, namespace, sheet_update '
+                                'FROM jobs WHERE run = ? AND row = ?', (self.run, row))
+        if len(entries) == 0:
+            return None
+        entry = dict(zip(('title', 'url', 'graph', 'state', 'reached', 'source', 'source_size', 'source_modified',
+                          'skosified', 'skosified_size', 'skosified_modified', 'fingerprint', 'namespace',
+                          'sheet_update'), entries[0]))
+        # the sheet may have been changed since the run was started.
+        if (entry['title'], entry['url'], entry['graph']) != (fuseki.title, fuseki.url, fuseki.sparql_graph):
+            return None
+        return entry
+
+    def add(self, row: int, fuseki):
+        """
+        Add a row to the run.
+
+        :param row:     The number of the row in the sheet.
+        :param fuseki:  The FusekiUpdate of the row.
+        :return:        The results for the sheet if the row has already been uploaded or failed in the resumed
+                        run (a dict of the values of its SheetUpdate). None if the row still has to be processed.
+        """
+        if self.path is None:
+            return None
+        if self.resumed:
+            entry = self._entry(row, fuseki)
+            if entry is not None:
+                if entry['state'] in FINAL_STATES:
+                    return json.loads(entry['sheet_update'])
+                return None
+        self._execute('INSERT OR REPLACE INTO jobs (run, row, title, url, graph, state, updated) '
+                      'VALUES (?, ?, ?, ?, ?, ?, ?)', (self.run, row, fuseki.title, fuseki.url, fuseki.sparql_graph,
+                                                      PENDING, time.strftime('%Y-%m-%dT%H:%M:%S')))
+        return None
+
+    def restored(self, row: int, fuseki):
+        """
+        The stage a row of the resumed run got to and the files it left behind.
+
+        :return:    A dict with the state, the downloaded source, its fingerprint and, if it was written to disk, the
+                    skosified file with its namespace. None if the row has to start from the beginning, because it
+                    did not get that far or its files were removed or changed.
+        """
+        if not self.resumed:
+            return None
+        entry = self._entry(row, fuseki)
+        if entry is None or entry['reached'] not in (DOWNLOADED, SKOSIFIED):
+            return None
+        if not os.path.exists(entry['source']) or \
+                file_state(entry['source']) != (entry['source_size'], entry['source_modified']):
+            return None
+        if entry['skosified'] is not None and (not os.path.exists(entry['skosified']) or file_state(
+                entry['skosified']) != (entry['skosified_size'], entry['skosified_modified'])):
+            entry['skosified'] = None
+        return entry
+
+    def downloaded(self, row: int, source: str, fingerprint: str):
+        """Record that the source of a row has been downloaded (and decompressed) to the file source."""
+        if self.path is not None:
+            self._execute('UPDATE jobs SET state = ?, reached = ?, source = ?, source_size = ?, source_modified = ?, '
+                          'skosified = NULL, fingerprint = ?, updated = ? WHERE run = ? AND row = ?',
+                          (DOWNLOADED, DOWNLOADED, os.path.abspath(source)) + file_state(source) +
+                          (fingerprint, time.strftime('%Y-%m-%dT%H:%M:%S'), self.run, row))
+
+    def skosified(self, row: int, namespace: str, skosified: str = None):
+        """Record that a row has been skosified. skosified is the file of the result if it was written to disk."""
+        if self.path is None:
+            return
+        skosified_state = file_state(skosified) if skosified is not None else (None, None)
+        self._execute('UPDATE jobs SET state = ?, reached = ?, skosified = ?, skosified_size = ?, '
+                      'skosified_modified = ?, namespace = ?, updated = ? WHERE run = ? AND row = ?',
+                      (SKOSIFIED, SKOSIFIED, os.path.abspath(skosified) if skosified is not None else None) +
+                      skosified_state + (namespace, time.strftime('%Y-%m-%dT%H:%M:%S'), self.run, row))
+
+    def finished(self, row: int, update, fingerprint: str = None):
+        """
+        Record the end of a row: uploaded if its SheetUpdate has a triple count or it was unchanged, else failed.
+
+        :param row:         The number of the row in the sheet.
+        :param update:      The SheetUpdate of the row.
+        :param fingerprint: The fingerprint of the input columns of the row as they are after the update was written
+                            to the sheet. If given the outcome is kept for the changed rows only mode.
+        """
+        if self.path is None:
+            return
+        state = UPLOADED if update.triple_count != '' or update.unchanged else FAILED
+        self._execute('UPDATE jobs SET state = ?, sheet_update = ?, updated = ? WHERE run = ? AND row = ?',
+                      (state, json.dumps(vars(update)), time.strftime('%Y-%m-%dT%H:%M:%S'), self.run, row))
+        if fingerprint is not None:
+            self._execute('INSERT OR REPLACE INTO outcomes (fingerprint, state, finished) VALUES (?, ?, ?)',
+                          (fingerprint, state, time.time()))
+
+    def settled(self, fingerprint: str, max_age: float):
+        """
+        Whether a row with these input columns was uploaded successfully within the last max_age days.
+
+        Rows which are new, were edited since, failed the last time or were uploaded longer ago are not settled.
+        """
+        if self.path is None:
+            return False
+        outcomes = self._execute('SELECT state, finished FROM outcomes WHERE fingerprint = ?', (fingerprint,))
+        return len(outcomes) > 0 and outcomes[0][0] == UPLOADED and time.time() - outcomes[0][1] < max_age * 86400
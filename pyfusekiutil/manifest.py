@@ -0,0 +1,87 @@
+import hashlib
+import json
+import logging
+import os
+import time
+
+from pyfusekiutil import __version__
+
+"""A manifest of the content uploaded to each graph.
+
+For every graph the manifest stores a fingerprint of the last successful upload. The fingerprint is a hash of the
+decompressed source together with all the settings used to transform it. If a new fingerprint matches the stored
+one, the upload would not change the graph and the vocabulary can be skipped.
+"""
+
+
+class UploadManifest(object):
+    """Stores the fingerprint of each graph as <hash of graph name>.json in the manifest directory."""
+
+    def __init__(self, path, skip_unchanged=False, logger=logging.getLogger('upload-manifest')):
+        """
+        :param path:            Directory of the manifest. If None nothing is recorded.
+        :param skip_unchanged:  Whether vocabularies with an unchanged fingerprint should be skipped.
+        :param logger:          The logger used.
+        """
+        self.path = path
+        self.skip_unchanged = skip_unchanged
+        self.logger = logger
+        if self.path is not None:
+            os.makedirs(self.path, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config):
+        """Create the manifest in the data directory. Skipping is enabled with skip_unchanged in [cache]."""
+        return cls(config['data']['base'] + config.get('data', 'manifest', fallback='manifest/'),
+                   skip_unchanged=config.getboolean('cache', 'skip_unchanged', fallback=False))
+
+    @staticmethod
+    def fingerprint(file_name: str, settings: dict):
+        """
+        Calculate the fingerprint of a source file and the settings used to transform it.
+
+        :param file_name:   Path to the decompressed source file.
+        :param settings:    All the values which influence the transformation. Must be serializable as JSON.
+        :return:            The fingerprint as hex string.
+        """
+        digest = hashlib.sha256()
+        with open(file_name, 'rb') as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b''):
+                digest.update(chunk)
+        # changes to the code may change the result as well.
+        settings = dict(settings, version=__version__)
+        digest.update(json.dumps(settings, sort_keys=True, default=str).encode('utf-8'))
+        return digest.hexdigest()
+
+    def is_unchanged(self, graph: str, fingerprint: str):
+        """Whether the last successful upload to graph had the same fingerprint."""
+        if self.path is None:
+            return False
+        return self.get(graph).get('fingerprint') == fingerprint
+
+    def get(self, graph: str):
+        """The manifest entry of graph. An empty dict if nothing has been uploaded yet."""
+        try:
+            with open(self._entry_path(graph), 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return dict()
+
+    def record(self, graph: str, fingerprint: str, triple_count):
+        """Record a successful upload to graph."""
+        if self.path is None:
+            return
+        entry = {
+            'graph': graph,
+            'fingerprint': fingerprint,
+            'triple_count': triple_count,
+            'uploaded': time.strftime('%Y-%m-%dT%H:%M:%S')
+        }
+        entry_path = self._entry_path(graph)
+        with open(entry_path + '.part', 'w', encoding='utf-8') as file:
+            json.dump(entry, file, indent='    ')
+        os.replace(entry_path + '.part', entry_path)
+        self.logger.debug('Recorded upload of %s with fingerprint %s.', graph, fingerprint)
+
+    def _entry_path(self, graph):
+        return os.path.join(self.path, hashlib.sha256(graph.encode('utf-8')).hexdigest() + '.json')
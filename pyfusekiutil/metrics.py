@@ -0,0 +1,229 @@
+from contextlib import contextmanager
+import cProfile
+import json
+import logging
+import os
+import re
+import resource
+import threading
+import time
+import tracemalloc
+
+"""Measurements of the stages of the vocabulary updates.
+
+Every stage (download, parse, skosify, upload, ...) of every vocabulary is recorded with its wall time, CPU time,
+peak memory, the bytes transferred and the triples going in and out. The records are appended to a JSON lines file,
+one record per line, and summarized in a Prometheus textfile at the end of a run.
+
+A single vocabulary, given by its title in the sheet or the name of its loader, can be profiled with cProfile and
+tracemalloc. The profiles of its stages are written to the profiles folder in the output folder:
+
+    pyfuseki default.cfg -a --profile "UNESCO Thesaurus"
+    python -m pstats data/output/profiles/unesco_thesaurus-skosify.prof
+
+If a loader is profiled with -s, its whole run is profiled as the stage total.
+"""
+
+# Identifies the records of this run. Shared by all processes forked from this one.
+RUN = time.strftime('%Y%m%dT%H%M%S') + '-' + str(os.getpid())
+
+# The values of a record which are exported to Prometheus, with their metric name and help text.
+PROMETHEUS_METRICS = (
+    ('wall', 'pyfuseki_stage_wall_seconds', 'Wall time of the stage.'),
+    ('cpu', 'pyfuseki_stage_cpu_seconds', 'CPU time of the process during the stage.'),
+    ('peak_rss', 'pyfuseki_stage_peak_rss_bytes', 'Peak resident set size of the process during the stage.'),
+    ('bytes', 'pyfuseki_stage_bytes', 'Bytes downloaded or uploaded by the stage.'),
+    ('triples_in', 'pyfuseki_stage_triples_in', 'Triples the stage started with.'),
+    ('triples_out', 'pyfuseki_stage_triples_out', 'Triples the stage produced.'),
+    ('failed', 'pyfuseki_stage_failed', 'Whether the stage failed.'),
+)
+
+
+def peak_rss():
+    """The peak resident set size of this process in bytes."""
+    try:
+        with open('/proc/self/status', 'r') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def reset_peak_rss():
+    """Reset the peak resident set size to the current one. Only possible on Linux."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+    except OSError:
+        pass
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics(object):
+    """Records the stages of the vocabulary updates. Can be sent to worker processes."""
+
+    def __init__(self, path=None, textfile=None, profile=None, profile_path=None,
+                 logger=logging.getLogger('metrics')):
+        """
+        :param path:            The JSON lines file the records are appended to. If None nothing is recorded.
+        :param textfile:        The Prometheus textfile written by write_textfile. If None none is written.
+        :param profile:         Title of the vocabulary or name of the loader whose stages are profiled.
+        :param profile_path:    Folder of the profiles.
+        :param logger:          The logger used.
+        """
+        self.path = path
+        self.textfile = textfile
+        self.profile = profile.strip().lower() if profile else None
+        self.profile_path = profile_path
+        self.logger = logger
+        self.run = RUN
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Create the metrics configured in the [metrics] section. Files are relative to the output folder."""
+        output = config['data']['base'] + config.get('data', 'output', fallback='')
+        path = None
+        if config.getboolean('metrics', 'enabled', fallback=False):
+            path = output + config.get('metrics', 'jsonl', fallback='metrics.jsonl')
+        textfile = config.get('metrics', 'textfile', fallback='')
+        return cls(path, textfile=textfile if textfile != '' else None,
+                   profile=config.get('metrics', 'profile', fallback=None), profile_path=output + 'profiles/')
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, vocabulary: str, stage: str):
+        """
+        Measure a stage of a vocabulary.
+
+        Yields the record of the stage. The bytes transferred and the triples going in and out are set on it by the
+        stage itself. The peak memory is that of the process. If other threads of the process run at the same time,
+        it includes their use as well.
+
+        :param vocabulary:  The title of the vocabulary or the name of the loader.
+        :param stage:       The name of the stage.
+        """
+        record = {
+            'run': self.run,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'pid': os.getpid(),
+            'vocabulary': vocabulary,
+            'stage': stage,
+            'status': 'ok',
+            'bytes': None,
+            'triples_in': None,
+            'triples_out': None
+        }
+        profiler = None
+        # stages within a profiled stage are part of its profile.
+        if self.profile is not None and not tracemalloc.is_tracing() and vocabulary.strip().lower() == self.profile:
+            profiler = self._start_profile()
+        if threading.active_count() == 1:
+            reset_peak_rss()
+        start = time.monotonic()
+        cpu = time.process_time()
+        try:
+            yield record
+        except BaseException as error:
+            record['status'] = 'failed: ' + type(error).__name__
+            raise
+        finally:
+            record['wall'] = round(time.monotonic() - start, 3)
+            record['cpu'] = round(time.process_time() - cpu, 3)
+            record['peak_rss'] = peak_rss()
+            if profiler is not None:
+                self._stop_profile(profiler, vocabulary, stage)
+            self.logger.debug('%s of %s: %s', stage, vocabulary, record)
+            self._write(record)
+
+    def _write(self, record):
+        if self.path is None:
+            return
+        with self.lock, open(self.path, 'a', encoding='utf-8') as file:
+            file.write(json.dumps(record, sort_keys=True) + '\n')
+
+    def _start_profile(self):
+        tracemalloc.start()
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def _stop_profile(self, profiler, vocabulary, stage):
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+        os.makedirs(self.profile_path, exist_ok=True)
+        name = self.profile_path + re.sub(r'[^\w.-]', '_', self.profile + '-' + stage)
+        profiler.dump_stats(name + '.prof')
+        with open(name + '.tracemalloc.txt', 'w', encoding='utf-8') as file:
+            for statistic in snapshot.statistics('lineno')[:50]:
+                file.write(str(statistic) + '\n')
+        self.logger.info('Wrote profile of %s of %s to %s.prof.', stage, vocabulary, name)
+
+    def records(self):
+        """The records of this run, read back from the JSON lines file. Includes those of worker processes."""
+        if self.path is None or not os.path.exists(self.path):
+            return list()
+        records = list()
+        with open(self.path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get('run') == self.run:
+                    records.append(record)
+        return records
+
+    def write_textfile(self):
+        """
+        Write the records of this run as Prometheus textfile, for the textfile collector of the node exporter.
+
+        Stages run more than once for the same vocabulary are summed up, except for the peak memory.
+        """
+        if self.textfile is None:
+            return
+        series = dict()
+        for record in self.records():
+            key = (record['vocabulary'], record['stage'])
+            values = series.setdefault(key, dict())
+            record = dict(record, failed=0 if record['status'] == 'ok' else 1)
+            for field, metric, description in PROMETHEUS_METRICS:
+                if record.get(field) is None:
+                    continue
+                if field == 'peak_rss':
+                    values[field] = max(values.get(field, 0), record[field])
+                else:
+                    values[field] = values.get(field, 0) + record[field]
+
+        lines = list()
+        for field, metric, description in PROMETHEUS_METRICS:
+            lines.append('# HELP ' + metric + ' ' + description)
+            lines.append('# TYPE ' + metric + ' gauge')
+            for (vocabulary, stage), values in sorted(series.items()):
+                if field in values:
+                    lines.append('{}{{vocabulary="{}",stage="{}"}} {}'.format(metric, escape_label(vocabulary),
+                                                                              escape_label(stage), values[field]))
+        lines.append('# HELP pyfuseki_run_timestamp_seconds End of the last run.')
+        lines.append('# TYPE pyfuseki_run_timestamp_seconds gauge')
+        lines.append('pyfuseki_run_timestamp_seconds ' + str(int(time.time())))
+
+        # the collector may read the file at any time. It must never see a partial file.
+        with open(self.textfile + '.part', 'w', encoding='utf-8') as file:
+            file.write('\n'.join(lines) + '\n')
+        os.replace(self.textfile + '.part', self.textfile)
+        self.logger.info('Wrote metrics of %s stages to %s.', len(series), self.textfile)
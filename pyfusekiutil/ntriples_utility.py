@@ -0,0 +1,210 @@
+from rdflib import Graph
+from rdflib.namespace import RDF
+from rdflib.term import Node
+
+import logging
+import os
+import pickle
+import re
+import uuid
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from pyfusekiutil.rdf_utility import GraphRules, TYPE_MAPPING, REPLACE_OBJECT
+
+"""Streaming transformations of N-Triples files.
+
+The files are read line by line and each triple is transformed on its own, so the memory used does not depend on the
+size of the file. The terms are kept as they are written in N-Triples and are never parsed into rdflib terms.
+All functions work on generators of (subject, predicate, object) tuples and can be chained:
+
+    triples = read_triples('FASTTopical.nt')
+    write_triples(rewrite(triples, NTriplesRules.from_rules(rules)), 'FASTTopical.transformed.nt')
+
+Only local rules can be applied like this: rules which look at a single triple. Everything which needs to see the
+whole graph (like the structural passes of skosify) has to load the graph into memory. For this large files are
+parsed in parallel with parse_parallel.
+"""
+
+# subject and predicate never contain white space. The object is the rest of the line without the final dot.
+TRIPLE = re.compile(r'^\s*(\S+)\s+(\S+)\s+(.+?)\s*\.\s*$')
+
+
+def tag_literal(term: str, tag: str):
+    """The literal in N-Triples with its language replaced by tag. None if the term is not a literal."""
+    if term.startswith('"'):
+        # only the language tag or the datatype follow the closing quote.
+        return term[:term.rindex('"') + 1] + '@' + tag
+    return None
+
+
+class NTriplesRules(object):
+    """
+    Transforms triples of N-Triples terms with the rules of a graph. Applied to a file with rewrite.
+
+    The same rules are applied with the same semantics as on a graph, except that duplicate triples created from
+    different lines are not removed. Duplicates do not matter once the triples are loaded into a triple store. The
+    lexical form of a literal is kept when its language is replaced.
+    """
+
+    def __init__(self):
+        # the rules with all their terms in N-Triples.
+        self.rules = GraphRules(tag_literal=tag_literal)
+
+    @classmethod
+    def from_rules(cls, rules: GraphRules):
+        """Create N-Triples rules from the rules of a graph."""
+        result = cls()
+        for kind, first, second in rules.rules:
+            first, second = to_ntriples(first), to_ntriples(second)
+            if kind == TYPE_MAPPING:
+                result.rules._add_rule((kind, first, second), result.rules.by_predicate, RDF.type.n3())
+            elif kind == REPLACE_OBJECT:
+                result.rules._add_rule((kind, first, second), result.rules.by_object, first)
+            else:
+                result.rules._add_rule((kind, first, second), result.rules.by_predicate, first)
+        return result
+
+    def transform(self, triple):
+        """Apply the rules to a single triple. Returns the triples it is transformed into."""
+        return self.rules.transform(triple)
+
+
+def to_ntriples(value):
+    """The N-Triples form of an rdflib term. Other values (like language tags) are returned as they are."""
+    if isinstance(value, Node):
+        return value.n3()
+    return value
+
+
+def read_triples(path: str):
+    """
+    Read an N-Triples file line by line.
+
+    :param path:    The N-Triples file.
+    :return:        Generates the triples as tuples of the terms in N-Triples. Empty lines and comments are skipped.
+    :raises ValueError  If a line is not a triple.
+    """
+    with open(path, 'r', encoding='utf-8') as file:
+        for number, line in enumerate(file, start=1):
+            match = TRIPLE.match(line)
+            if match is None:
+                stripped = line.strip()
+                if stripped == '' or stripped.startswith('#'):
+                    continue
+                raise ValueError('Line ' + str(number) + ' of ' + path + ' is not a triple: ' + stripped)
+            yield match.groups()
+
+
+def rewrite(triples, rules: NTriplesRules):
+    """Apply the rules to each triple. Generates the transformed triples."""
+    for triple in triples:
+        yield from rules.transform(triple)
+
+
+def write_triples(triples, path: str):
+    """
+    Write triples to an N-Triples file.
+
+    :return:    The number of triples written.
+    """
+    count = 0
+    with open(path, 'w', encoding='utf-8') as file:
+        for s, p, o in triples:
+            file.write(s + ' ' + p + ' ' + o + ' .\n')
+            count += 1
+    return count
+
+
+class FileBNodes(dict):
+    """
+    Blank node context of the N-Triples parser which maps each label to the same blank node in every process.
+
+    The parser creates a new blank node for each label it has not seen. Chunks of the same file parsed in different
+    processes would end up with different blank nodes for the same label.
+    """
+
+    def __init__(self, prefix: str):
+        super().__init__()
+        self.prefix = prefix
+
+    def get(self, label, default=None):
+        return self.prefix + label
+
+
+def split_lines(path: str, chunk_size: int):
+    """
+    Split a file into chunks of about chunk_size bytes which end at the end of a line.
+
+    :return:    A list of (start, end) byte offsets.
+    """
+    size = os.path.getsize(path)
+    chunks = list()
+    with open(path, 'rb') as file:
+        start = 0
+        while start < size:
+            file.seek(min(start + chunk_size, size))
+            file.readline()
+            end = min(file.tell(), size)
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+
+def parse_chunk(path: str, start: int, end: int, prefix: str):
+    """
+    Parse a chunk of an N-Triples file. Runs in a worker process of parse_parallel.
+
+    Equal terms are replaced by the same object, which makes the pickled result much smaller.
+
+    :return:    The triples pickled.
+    """
+    with open(path, 'rb') as file:
+        file.seek(start)
+        data = file.read(end - start).decode('utf-8')
+    graph = Graph()
+    graph.parse(data=data, format='nt', bnode_context=FileBNodes(prefix))
+    data = None
+    terms = dict()
+    triples = [(terms.setdefault(s, s), terms.setdefault(p, p), terms.setdefault(o, o)) for s, p, o in graph]
+    return pickle.dumps(triples, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def parse_parallel(graph: Graph, paths, workers=2, chunk_size=64 * 1024 * 1024,
+                   logger=logging.getLogger('ntriples-parser')):
+    """
+    Parse N-Triples files into a graph with a pool of worker processes.
+
+    The files are split into chunks at line ends. Each worker parses a chunk on its own and sends the triples back.
+    They are merged into graph while the other chunks are still parsed. Only a few more chunks than workers are
+    parsed ahead, so the finished chunks do not pile up in memory. Equal terms of all chunks are merged into the same
+    object.
+
+    :param graph:       The graph the triples are added to.
+    :param paths:       The N-Triples files.
+    :param workers:     Number of worker processes.
+    :param chunk_size:  Size of a chunk in bytes.
+    :param logger:      The logger used.
+    :return:            The graph.
+    """
+    chunks = list()
+    for path in paths:
+        # the blank nodes of each file are distinct, as if the files were parsed one after another.
+        prefix = uuid.uuid4().hex
+        chunks.extend((path, start, end, prefix) for start, end in split_lines(path, chunk_size))
+    logger.info('Parsing %s chunks of %s with %s workers.', len(chunks), ', '.join(paths), workers)
+
+    terms = dict()
+    with ProcessPoolExecutor(workers) as pool:
+        pending = set()
+        done = 0
+        while chunks or pending:
+            while chunks and len(pending) < 2 * workers:
+                pending.add(pool.submit(parse_chunk, *chunks.pop(0)))
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                triples = pickle.loads(future.result())
+                graph.addN((terms.setdefault(s, s), terms.setdefault(p, p), terms.setdefault(o, o), graph)
+                           for s, p, o in triples)
+                done += 1
+                logger.debug('Merged chunk %s with %s triples.', done, len(triples))
+    return graph
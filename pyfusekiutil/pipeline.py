@@ -0,0 +1,225 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import logging
+import os
+import queue
+import tempfile
+
+from pyfusekiutil.core_fuseki_update import FusekiUpdate, record_error
+from pyfusekiutil.workspace import Workspaces
+
+"""Runs the vocabulary updates in concurrent stages instead of one vocabulary at a time.
+
+Downloads are waiting on the network and run on a thread pool. Skosify is bound by the CPU and runs on a process pool.
+Uploads run on a small thread pool to not overwhelm Fuseki. Each finished stage is reported to a queue from which
+the next stage of the vocabulary is started.
+
+With the memory handoff the upload runs in the skosify process right after skosify. The skosified graph is then sent
+to Fuseki straight from memory instead of being written to disk and read again by the upload stage.
+"""
+
+# The stages in the order they are run. Each is the name of a method of FusekiUpdate.
+DOWNLOAD = 'download'
+SKOSIFY = 'skosify'
+UPLOAD = 'upload'
+SKOSIFY_AND_UPLOAD = 'skosify_and_upload'
+NEXT_STAGE = {
+    DOWNLOAD: SKOSIFY,
+    SKOSIFY: UPLOAD,
+    UPLOAD: None
+}
+NEXT_STAGE_IN_MEMORY = {
+    DOWNLOAD: SKOSIFY_AND_UPLOAD,
+    SKOSIFY_AND_UPLOAD: None
+}
+
+
+def run_stage(fuseki: FusekiUpdate, stage: str):
+    """
+    Run a single stage of a vocabulary update. Errors are recorded in the sheet update of the vocabulary.
+
+    Is executed in a worker thread or process. Returns the changed update object, as the worker process only
+    works on a copy of it.
+
+    :param fuseki:  The vocabulary update.
+    :param stage:   The name of the stage to run.
+    :return:        The vocabulary update and whether the stage was successful.
+    """
+    try:
+        getattr(fuseki, stage)()
+    except Exception as error:
+        record_error(fuseki.sheet_updates, error)
+        return fuseki, False
+    finally:
+        # the upload either has already happened or reads the skosified file from disk. Do not send the whole graph
+        # back to the main process.
+        fuseki.release_graph()
+    return fuseki, True
+
+
+class VocabularyPipeline(object):
+    """Processes vocabulary updates with a download, skosify and upload stage connected by a queue."""
+
+    def __init__(self, download_workers=4, skosify_workers=2, upload_workers=1, queue_size=8, handoff='file',
+                 workspaces: Workspaces = None, logger=logging.getLogger('fuseki-pipeline')):
+        """
+        :param download_workers:    Number of threads downloading files.
+        :param skosify_workers:     Number of processes parsing and skosifying vocabularies.
+        :param upload_workers:      Number of threads uploading to Fuseki.
+        :param queue_size:          Maximum number of vocabularies which are downloaded or wait to be skosified.
+                                    Limits the space used by downloaded files.
+        :param handoff:             How the skosified graph gets to the upload: 'file' writes it to the temporary
+                                    folder for the upload workers, 'memory' uploads it from the skosify process.
+                                    The jobs have to be created with the matching in_memory setting.
+        :param workspaces:          Provides the temporary folder of each job. If None the folders are placed in
+                                    the temporary directory of the system.
+        :param logger:              The logger used.
+        """
+        self.download_workers = download_workers
+        self.skosify_workers = skosify_workers
+        self.upload_workers = upload_workers
+        self.queue_size = max(queue_size, download_workers)
+        self.next_stage = NEXT_STAGE_IN_MEMORY if handoff == 'memory' else NEXT_STAGE
+        self.workspaces = workspaces if workspaces is not None else \
+            Workspaces(os.path.join(tempfile.gettempdir(), 'pyfuseki', ''))
+        self.logger = logger
+
+        self.finished = queue.Queue()
+        self.pools = dict()
+
+    @classmethod
+    def from_config(cls, config):
+        """Create a pipeline with the worker counts from the [pipeline] section and the [workspace] of default.cfg."""
+        return cls(download_workers=config.getint('pipeline', 'download_workers', fallback=4),
+                   skosify_workers=config.getint('pipeline', 'skosify_workers', fallback=2),
+                   upload_workers=config.getint('pipeline', 'upload_workers', fallback=1),
+                   queue_size=config.getint('pipeline', 'queue_size', fallback=8),
+                   handoff=config.get('pipeline', 'handoff', fallback='file'),
+                   workspaces=Workspaces.from_config(config))
+
+    def run(self, jobs):
+        """
+        Run all the jobs through the pipeline.
+
+        Each job has its own temporary folder, which is removed once the job is finished.
+
+        If a skosify process is killed (for example when it runs out of memory) the skosify workers are restarted.
+        All the jobs in the workers at that time fail with it. Each of them is tried again on its own in a separate
+        process, so that only the job which was killed is recorded as failed.
+
+        :param jobs:    A list of tuples (row, FusekiUpdate). The row identifies the job.
+        :return:        Generates tuples (row, SheetUpdate) in the order the jobs finish.
+        """
+        waiting = list(reversed(jobs))
+        updates = dict((row, fuseki) for row, fuseki in jobs)
+        workspaces = dict()
+        # the pool each job was last submitted to.
+        self.pools = dict()
+        # the jobs which were in the skosify workers when they were killed and the pool of the one tried on its own.
+        suspects = list()
+        isolation = None
+        # the number of jobs which have been started but not yet reached the upload stage.
+        started = 0
+        # the number of jobs which have been started but are not yet finished.
+        running = 0
+        skosify = ProcessPoolExecutor(self.skosify_workers)
+        executors = {
+            SKOSIFY: skosify,
+            SKOSIFY_AND_UPLOAD: skosify
+        }
+        try:
+            with ThreadPoolExecutor(self.download_workers) as downloads, \
+                    ThreadPoolExecutor(self.upload_workers) as uploads:
+                executors[DOWNLOAD] = downloads
+                executors[UPLOAD] = uploads
+                while len(waiting) > 0 or running > 0:
+                    while len(waiting) > 0 and started < self.queue_size:
+                        row, fuseki = waiting.pop()
+                        try:
+                            workspaces[row] = self.workspaces.job(row, fuseki.size, fuseki.journal.resumed)
+                            fuseki.temp_path = workspaces[row].open()
+                        except OSError as error:
+                            record_error(fuseki.sheet_updates, error)
+                            yield row, fuseki.sheet_updates
+                            continue
+                        self._submit(executors, DOWNLOAD, row, fuseki)
+                        started += 1
+                        running += 1
+                    # all the jobs left could not be started.
+                    if running == 0:
+                        continue
+
+                    stage, row, future = self.finished.get()
+                    pool = self.pools.pop(row)
+                    try:
+                        fuseki, success = future.result()
+                        # a job returned by a worker process carries a copy of the journal which records nothing.
+                        fuseki.journal = updates[row].journal
+                        updates[row] = fuseki
+                    except BrokenProcessPool as error:
+                        if pool is isolation:
+                            fuseki, success = updates[row], False
+                            fuseki.sheet_updates.error_type = 'SKOSIFY KILLED'
+                            fuseki.sheet_updates.error_message = 'The skosify process was killed. The vocabulary ' \
+                                                                 'may need more memory than is available.'
+                            self.logger.error('The skosify process of %s (row %s) was killed.', fuseki.title, row)
+                        else:
+                            if pool is executors[SKOSIFY]:
+                                self._restart_skosify(executors)
+                            suspects.append((stage, row))
+                            fuseki = None
+                    except Exception as error:
+                        fuseki, success = updates[row], False
+                        record_error(fuseki.sheet_updates, error)
+
+                    if pool is isolation:
+                        isolation.shutdown(wait=False)
+                        isolation = None
+                    if isolation is None and len(suspects) > 0:
+                        suspect_stage, suspect = suspects.pop(0)
+                        isolation = ProcessPoolExecutor(1)
+                        self._submit(executors, suspect_stage, suspect, updates[suspect], isolation)
+                    # the job is tried again on its own.
+                    if fuseki is None:
+                        continue
+
+                    if stage in (SKOSIFY, SKOSIFY_AND_UPLOAD) or (stage == DOWNLOAD and not success):
+                        started -= 1
+
+                    if success and stage == SKOSIFY:
+                        # the skosified file is handed to the upload stage. Only the main process writes the journal.
+                        fuseki.record_skosified()
+
+                    next_stage = self.next_stage[stage]
+                    if success and next_stage is not None:
+                        self._submit(executors, next_stage, row, fuseki)
+                    else:
+                        running -= 1
+                        workspaces.pop(row).close()
+                        self.logger.info('Finished %s (row %s).', fuseki.title, row)
+                        yield row, fuseki.sheet_updates
+        finally:
+            executors[SKOSIFY].shutdown()
+            if isolation is not None:
+                isolation.shutdown()
+
+    def _restart_skosify(self, executors):
+        """Replace the skosify workers after one of them was killed."""
+        self.logger.warning('A skosify process was killed. Restart the skosify workers.')
+        executors[SKOSIFY].shutdown(wait=False)
+        executors[SKOSIFY] = executors[SKOSIFY_AND_UPLOAD] = ProcessPoolExecutor(self.skosify_workers)
+
+    def _submit(self, executors, stage, row, fuseki, executor=None):
+        """Submit a stage of a job to the workers of the stage or, if given, to executor."""
+        self.logger.debug('Begin %s of %s (row %s).', stage, fuseki.title, row)
+        if executor is None:
+            executor = executors[stage]
+        try:
+            future = executor.submit(run_stage, fuseki, stage)
+        except BrokenProcessPool:
+            # the skosify workers were killed and the jobs which were in them have not been reported yet.
+            self._restart_skosify(executors)
+            executor = executors[stage]
+            future = executor.submit(run_stage, fuseki, stage)
+        self.pools[row] = executor
+        future.add_done_callback(lambda f: self.finished.put((stage, row, f)))
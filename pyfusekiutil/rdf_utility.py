@@ -1,6 +1,8 @@
 from rdflib import Literal
 from rdflib.namespace import SKOS, RDF, RDFS, OWL, DCTERMS, DC, VOID, FOAF, XSD, XMLNS, DOAP
 
+import gc
+
 """Common utility functions to manipulate RDF Triple Graphs."""
 
 
@@ -75,3 +77,166 @@ def add_language_tags(graph, tag):
         graph.remove((subject, predicate, obj))
         graph.add((subject, predicate, Literal(obj.value, lang=tag)))
 
+
+
+# The predicates of the labels which are tagged by add_language_tags.
+LABEL_PREDICATES = (SKOS.prefLabel, SKOS.altLabel, SKOS.hiddenLabel, RDFS.label)
+
+# The kinds of rules of GraphRules.
+PREDICATE_VARIANT = 'predicate_variant'
+TYPE_MAPPING = 'type_mapping'
+LANGUAGE_TAG = 'language_tag'
+REPLACE_OBJECT = 'replace_object'
+INVERSE = 'inverse'
+
+
+def tag_literal(term, tag):
+    """The literal with its language replaced by tag. None if the term is not a literal."""
+    if isinstance(term, Literal):
+        return Literal(term.value, lang=tag)
+    return None
+
+
+class GraphRules(object):
+    """
+    A set of graph transformations which are applied together in a single pass.
+
+    The rules are applied in the order they were added. Triples created or changed by a rule are passed on to the
+    rules added after it, so the result is the same as calling the corresponding helper functions one after another.
+    Instead of one scan per helper, the triples matched by any of the rules are read once. The changes are collected
+    and applied at the end: all removals first, then all additions with addN.
+
+    Example:
+        rules = GraphRules().type(OWL.Class, SKOS.Concept).predicate_variant(RDFS.label, SKOS.prefLabel)
+        rules.language_tags('en').apply(graph)
+    """
+
+    def __init__(self, tag_literal=tag_literal):
+        """
+        :param tag_literal: Replaces the language of a literal. Returns None if the term is not a literal. Rules on
+                            terms other than rdflib terms provide their own.
+        """
+        self.tag_literal = tag_literal
+        self.rules = list()
+        # the triple patterns which select all triples any of the rules can change.
+        self.patterns = list()
+        # the indexes of the rules which match a predicate or an object. Type rules are found by rdf:type.
+        self.by_predicate = dict()
+        self.by_object = dict()
+
+    def _add_rule(self, rule, index, key):
+        index.setdefault(key, list()).append(len(self.rules))
+        self.rules.append(rule)
+
+    def predicate_variant(self, old, new):
+        """For each (s, old, o) add (s, new, o). Same as add_skos_predicate_variant."""
+        self._add_rule((PREDICATE_VARIANT, old, new), self.by_predicate, old)
+        self.patterns.append((None, old, None))
+        return self
+
+    def type(self, old, new):
+        """For each (s, rdf:type, old) add (s, rdf:type, new). Same as add_type."""
+        self._add_rule((TYPE_MAPPING, old, new), self.by_predicate, RDF.type)
+        self.patterns.append((None, RDF.type, old))
+        return self
+
+    def language_tags(self, tag, predicates=LABEL_PREDICATES):
+        """Replace the language of each literal of the label predicates with tag. Same as add_language_tags."""
+        for predicate in predicates:
+            self._add_rule((LANGUAGE_TAG, predicate, tag), self.by_predicate, predicate)
+            self.patterns.append((None, predicate, None))
+        return self
+
+    def replace_object(self, old, new):
+        """Replace each (s, p, old) with (s, p, new). Same as replace_triple_object."""
+        self._add_rule((REPLACE_OBJECT, old, new), self.by_object, old)
+        self.patterns.append((None, None, old))
+        return self
+
+    def inverse(self, first, second):
+        """For each (s, first, o) add (o, second, s). Same as expand_inverse_of_relations."""
+        self._add_rule((INVERSE, first, second), self.by_predicate, first)
+        self.patterns.append((None, first, None))
+        return self
+
+    def transform(self, triple, start=0):
+        """
+        Apply the rules to a single triple.
+
+        :param triple:  The triple (s, p, o).
+        :param start:   Index of the first rule applied. Rules added before it are skipped.
+        :return:        The triples it is transformed into. Contains the triple itself if it is kept.
+        """
+        s, p, o = triple
+        matches = self.by_predicate.get(p, [])
+        # comparing and hashing terms is expensive. Only look up objects if there are rules for them.
+        if len(self.by_object) > 0:
+            matches = sorted(matches + self.by_object.get(o, []))
+        for index in matches:
+            if index < start:
+                continue
+            kind, first, second = self.rules[index]
+            if kind == TYPE_MAPPING:
+                if o == first:
+                    return self.transform(triple, index + 1) + self.transform((s, p, second), index + 1)
+            elif kind == LANGUAGE_TAG:
+                tagged = self.tag_literal(o, second)
+                if tagged is not None:
+                    return self.transform((s, p, tagged), index + 1)
+            elif kind == REPLACE_OBJECT:
+                return self.transform((s, p, second), index + 1)
+            else:
+                if kind == PREDICATE_VARIANT:
+                    addition = (s, second, o)
+                else:
+                    addition = (o, second, s)
+                return self.transform(triple, index + 1) + self.transform(addition, index + 1)
+        return [triple]
+
+    def apply(self, graph):
+        """
+        Apply all rules to a graph.
+
+        :param graph:   The graph, which is changed in place.
+        :return:        The number of triples removed and added.
+        """
+        # the changes create millions of small objects. Without a pause the cyclic garbage collector would scan the
+        # whole graph over and over again.
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return self._apply(graph)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def _apply(self, graph):
+        removed = list()
+        added = list()
+        # patterns only overlap with object rules or with type rules and another rule for rdf:type. Triples matched
+        # by several patterns are transformed once.
+        seen = None
+        if len(self.by_object) > 0 or (None, RDF.type, None) in self.patterns:
+            seen = set()
+        # the graph is not changed during the scan.
+        for pattern in dict.fromkeys(self.patterns):
+            for triple in graph.triples(pattern):
+                if seen is not None:
+                    if triple in seen:
+                        continue
+                    seen.add(triple)
+                kept = False
+                for result in self.transform(triple):
+                    # transform returns the triple itself if it is kept.
+                    if result is triple:
+                        kept = True
+                    else:
+                        added.append(result)
+                if not kept:
+                    removed.append(triple)
+
+        # removals first: a triple removed by one rule may be added again by a later rule from another triple.
+        for triple in removed:
+            graph.remove(triple)
+        graph.addN((s, p, o, graph) for s, p, o in added)
+        return len(removed), len(added)
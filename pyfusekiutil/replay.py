@@ -0,0 +1,220 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import time
+
+from pyfusekiutil.fuseki_stub import FusekiStub
+
+"""Recording and replaying of update runs.
+
+A run started with --record stores every source it downloads and the values of the sheet it reads in a recording.
+The sources are stored once per content, named by their SHA-256 hash, in the objects folder. For each url a small
+JSON file in the urls folder points to the content last downloaded from it.
+
+A run started with --replay reads the sheet and all the sources from the recording instead of the network. Uploads
+go to a local stand-in for Fuseki (see fuseki_stub.py) and the results for the sheet are written to
+replay/sheet.json in the recording. Everything the run keeps between runs (manifest, sync copies) is kept in the
+replay folder as well and removed at the start of each replay, so that every replay does the same work and live runs
+are never affected by it.
+"""
+
+MODES = ('off', 'record', 'replay')
+
+
+class NotRecordedError(FileNotFoundError):
+    """A source or the sheet is missing from the recording."""
+
+
+def file_hash(path: str):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_json(path: str, value):
+    with open(path + '.part', 'w', encoding='utf-8') as file:
+        json.dump(value, file, ensure_ascii=False)
+    os.replace(path + '.part', path)
+
+
+def cell_index(cell: str):
+    """Translate a cell in A1 notation into a zero based (row, column)."""
+    letters, row = re.match(r'([A-Z]+)(\d+)$', cell).groups()
+    column = 0
+    for letter in letters:
+        column = column * 26 + ord(letter) - ord('A') + 1
+    return int(row) - 1, column - 1
+
+
+class SnapshotWorksheet(object):
+    """
+    Stands in for the pygsheets worksheet during a replay.
+
+    Provides the two calls used by BufferedSheet. The values come from the recorded snapshot. Changes are applied to
+    a copy, which is written to a JSON file after each change.
+    """
+
+    def __init__(self, rows: list, path: str):
+        """
+        :param rows:    The values of the recorded sheet.
+        :param path:    The JSON file the changed values are written to.
+        """
+        self.rows = [list(row) for row in rows]
+        self.path = path
+
+    def get_all_values(self):
+        return [list(row) for row in self.rows]
+
+    def update_cells(self, crange: str, values: list):
+        first, last = crange.split(':')
+        row, column = cell_index(first)
+        for offset, row_values in enumerate(values):
+            while len(self.rows) <= row + offset:
+                self.rows.append(list())
+            cells = self.rows[row + offset]
+            cells.extend([''] * (column + len(row_values) - len(cells)))
+            cells[column:column + len(row_values)] = row_values
+        write_json(self.path, self.rows)
+
+
+class Recording(object):
+    """A content addressed archive of the sources and the sheet of a run. Can be sent to worker processes."""
+
+    def __init__(self, path=None, mode='off', logger=logging.getLogger('replay')):
+        """
+        :param path:    Folder of the recording.
+        :param mode:    'record' stores the sources and the sheet of the run, 'replay' takes them from the recording
+                        instead of the network. 'off' does neither.
+        :param logger:  The logger used.
+
+        :raises ValueError  If the mode is unknown.
+        """
+        if mode not in MODES:
+            raise ValueError('Unknown replay mode ' + mode + '. Expected one of ' + ', '.join(MODES) + '.')
+        self.path = path
+        self.mode = mode
+        self.logger = logger
+        if self.mode == 'record':
+            os.makedirs(os.path.join(self.path, 'objects'), exist_ok=True)
+            os.makedirs(os.path.join(self.path, 'urls'), exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config):
+        """Create the recording in the data directory. The mode is set with mode in [replay] or --record/--replay."""
+        return cls(config['data']['base'] + config.get('data', 'recording', fallback='recording/'),
+                   mode=config.get('replay', 'mode', fallback='off'))
+
+    @property
+    def recording(self):
+        return self.mode == 'record'
+
+    @property
+    def replaying(self):
+        return self.mode == 'replay'
+
+    def isolate(self, config):
+        """
+        Prepare the configuration of a replay and start the stand-in for Fuseki.
+
+        The state a run keeps between runs is moved into the replay folder, which is emptied first. The download
+        cache is disabled and no vocabulary is skipped as unchanged. Replays keep their own journal of runs.
+
+        :param config:  The configuration. Changed in place.
+        :return:        The running FusekiStub. Has to be stopped at the end of the replay.
+        """
+        replay_path = os.path.join(self.path, 'replay')
+        shutil.rmtree(replay_path, ignore_errors=True)
+        os.makedirs(replay_path)
+        relative = config.get('data', 'recording', fallback='recording/') + 'replay/'
+        for section in ('fuseki', 'cache'):
+            if not config.has_section(section):
+                config.add_section(section)
+        config['data']['manifest'] = relative + 'manifest/'
+        config['data']['sync'] = relative + 'sync/'
+        # kept outside of the replay folder, so that an interrupted replay can be resumed.
+        config['data']['journal'] = config.get('data', 'recording', fallback='recording/') + 'journal.sqlite'
+        config['cache']['enabled'] = 'no'
+        config['cache']['skip_unchanged'] = 'no'
+
+        stub = FusekiStub().start()
+        config['fuseki']['url'] = stub.url
+        config['fuseki']['user'] = ''
+        self.logger.info('Replay from %s. Uploads go to %s.', self.path, stub.url)
+        return stub
+
+    def _url_path(self, url: str):
+        return os.path.join(self.path, 'urls', hashlib.sha256(url.encode('utf-8')).hexdigest() + '.json')
+
+    def record(self, url: str, path: str):
+        """Store the content downloaded from url. Does nothing unless recording."""
+        if not self.recording:
+            return
+        digest = file_hash(path)
+        target = os.path.join(self.path, 'objects', digest)
+        if not os.path.exists(target):
+            shutil.copyfile(path, target + '.part')
+            os.replace(target + '.part', target)
+        write_json(self._url_path(url), {
+            'url': url,
+            'object': digest,
+            'size': os.path.getsize(target),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')
+        })
+        self.logger.debug('Recorded %s as %s.', url, digest)
+
+    def _entry(self, url: str):
+        try:
+            with open(self._url_path(url), 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            raise NotRecordedError(url + ' has not been recorded in ' + self.path + '.')
+
+    def size(self, url: str):
+        """
+        The size of the recorded content of url.
+
+        :raises NotRecordedError    If the url was not recorded.
+        """
+        return self._entry(url)['size']
+
+    def replay(self, url: str, destination: str):
+        """
+        Provide the recorded content of url at destination. Hard linked to the recording if possible.
+
+        :return:    The destination.
+        :raises NotRecordedError    If the url was not recorded.
+        """
+        entry = self._entry(url)
+        source = os.path.join(self.path, 'objects', entry['object'])
+        if os.path.lexists(destination):
+            os.remove(destination)
+        try:
+            os.link(source, destination)
+        except OSError:
+            shutil.copyfile(source, destination)
+        self.logger.info('Replayed %s from the recording of %s.', url, entry['time'])
+        return destination
+
+    def record_sheet(self, rows: list):
+        """Store the values of the sheet. Does nothing unless recording."""
+        if self.recording:
+            write_json(os.path.join(self.path, 'sheet.json'), rows)
+            self.logger.info('Recorded %s rows of the sheet.', len(rows))
+
+    def worksheet(self):
+        """
+        The stand-in for the worksheet during a replay.
+
+        :raises NotRecordedError    If no sheet was recorded.
+        """
+        try:
+            with open(os.path.join(self.path, 'sheet.json'), 'r', encoding='utf-8') as file:
+                rows = json.load(file)
+        except FileNotFoundError:
+            raise NotRecordedError('No sheet has been recorded in ' + self.path + '.')
+        return SnapshotWorksheet(rows, os.path.join(self.path, 'replay', 'sheet.json'))
@@ -0,0 +1,157 @@
+import googleapiclient.errors
+
+import logging
+import random
+import time
+
+"""Access to the google sheet with a minimal number of API requests."""
+
+# Status codes which are returned when the API quota is exceeded or the service is unavailable for a moment.
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+def column_letter(column: int):
+    """Translate a zero based column index into the letters used in A1 notation."""
+    letters = ''
+    column += 1
+    while column > 0:
+        column, remainder = divmod(column - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def is_quota_error(error: googleapiclient.errors.HttpError):
+    """Whether the request was rejected because of rate limits or server errors and should be retried later."""
+    status = int(error.resp.status)
+    if status in RETRY_STATUS_CODES:
+        return True
+    # the sheets api sometimes reports exceeded quotas as 403.
+    return status == 403 and ('rateLimitExceeded' in str(error) or 'quota' in str(error).lower())
+
+
+class BufferedSheet(object):
+    """
+    Reads the whole worksheet with a single request and buffers all changes until they are flushed.
+
+    Changes are written back in batched range updates. Only the cells which were changed are written, so that edits
+    made to other columns of the sheet during the run are not lost.
+    """
+
+    def __init__(self, worksheet, flush_rows=25, flush_interval=30.0, max_retries=8, backoff=1.0,
+                 max_backoff=120.0, logger=logging.getLogger('fuseki-sheet')):
+        """
+        :param worksheet:       The pygsheets worksheet.
+        :param flush_rows:      Flush once this many rows have changes.
+        :param flush_interval:  Flush when the last flush was at least this many seconds ago.
+        :param max_retries:     Number of times a request is retried when the quota is exceeded.
+        :param backoff:         Seconds to wait before the first retry. Doubled for each retry.
+        :param max_backoff:     Maximum number of seconds to wait before a retry.
+        :param logger:          The logger used.
+        """
+        self.worksheet = worksheet
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.logger = logger
+
+        self.rows = list()
+        # row number -> {column index -> value}
+        self.pending = dict()
+        self.last_flush = time.monotonic()
+
+    @classmethod
+    def from_config(cls, worksheet, config):
+        """Create a buffered sheet with the batch and retry settings from the [sheet] section of default.cfg."""
+        return cls(worksheet,
+                   flush_rows=config.getint('sheet', 'flush_rows', fallback=25),
+                   flush_interval=config.getfloat('sheet', 'flush_interval', fallback=30.0),
+                   max_retries=config.getint('sheet', 'max_retries', fallback=8))
+
+    def load(self):
+        """Read the values of the entire worksheet in one request."""
+        self.rows = self.call(self.worksheet.get_all_values)
+        self.logger.info('Loaded %s rows from the sheet.', len(self.rows))
+
+    def row_count(self):
+        return len(self.rows)
+
+    def get_row(self, i: int):
+        """Return a copy of row i (starting at 1) as it was when the sheet was loaded."""
+        return list(self.rows[i - 1])
+
+    def set_values(self, i: int, column: int, values: list):
+        """
+        Change the values of row i starting at column. The change is buffered until the next flush.
+
+        :param i:       Row number (starting at 1).
+        :param column:  Index of the first column changed (starting at 0).
+        :param values:  The new values.
+        """
+        changes = self.pending.setdefault(i, dict())
+        for offset, value in enumerate(values):
+            changes[column + offset] = value
+
+        if len(self.pending) >= self.flush_rows or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Write all buffered changes to the sheet.
+
+        Consecutive rows which changed the same columns are written with a single range update.
+        """
+        runs = list()
+        for i in sorted(self.pending):
+            columns = sorted(self.pending[i])
+            values = [self.pending[i][c] for c in columns]
+            if len(runs) > 0 and runs[-1][1] == i - 1 and runs[-1][2] == columns:
+                runs[-1][1] = i
+                runs[-1][3].append(values)
+            else:
+                runs.append([i, i, columns, [values]])
+
+        requests = 0
+        for first, last, columns, values in runs:
+            # the changed columns of a row are not necessarily adjacent. Split them into adjacent blocks.
+            start = 0
+            for k in range(1, len(columns) + 1):
+                if k == len(columns) or columns[k] != columns[k - 1] + 1:
+                    crange = '{}{}:{}{}'.format(column_letter(columns[start]), first,
+                                                column_letter(columns[k - 1]), last)
+                    self.call(self.worksheet.update_cells, crange=crange,
+                              values=[row[start:k] for row in values])
+                    requests += 1
+                    start = k
+
+            for i in range(first, last + 1):
+                for column, value in zip(columns, values[i - first]):
+                    row = self.rows[i - 1]
+                    row.extend([''] * (column + 1 - len(row)))
+                    row[column] = value
+
+        if requests > 0:
+            self.logger.info('Wrote changes of %s rows to the sheet with %s requests.', len(self.pending), requests)
+        self.pending.clear()
+        self.last_flush = time.monotonic()
+
+    def call(self, function, *args, **kwargs):
+        """
+        Call a function of the sheets API. Retries with exponential backoff and jitter when the quota is exceeded.
+
+        :raises googleapiclient.errors.HttpError    If the request failed for another reason or the retries are
+                                                    exhausted.
+        """
+        attempt = 0
+        while True:
+            try:
+                return function(*args, **kwargs)
+            except googleapiclient.errors.HttpError as error:
+                if attempt >= self.max_retries or not is_quota_error(error):
+                    raise
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+                attempt += 1
+                self.logger.warning('Sheets API request failed with status %s. Retry %s of %s in %.1f seconds.',
+                                    error.resp.status, attempt, self.max_retries, delay)
+                time.sleep(delay)
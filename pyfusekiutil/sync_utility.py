@@ -0,0 +1,146 @@
+from rdflib import Graph, BNode
+from rdflib.util import guess_format
+
+import hashlib
+import logging
+import os
+
+from pyfusekiutil.fuseki_utility import FusekiClient, FusekiError, CHUNK_SIZE, put_graph
+
+"""Incremental updates of graphs with SPARQL Update.
+
+Instead of replacing a whole graph with PUT only the difference between the current content of the graph and the
+new content is sent as DELETE DATA and INSERT DATA operations.
+"""
+
+
+def triples_to_data(triples):
+    """Format the triples as block of a DELETE DATA or INSERT DATA operation."""
+    return '\n'.join('{} {} {} .'.format(s.n3(), p.n3(), o.n3()) for s, p, o in triples)
+
+
+def has_blank_nodes(triples):
+    for triple in triples:
+        for term in triple:
+            if isinstance(term, BNode):
+                return True
+    return False
+
+
+class GraphSync(object):
+    """
+    Keeps the graphs in Fuseki up to date by sending only the changes.
+
+    The previous content of a graph is either the local copy of the last upload or fetched from Fuseki. If the
+    change is larger than a fraction of the graph, the graph contains blank nodes (which cannot be matched between
+    two versions) or the previous content is unknown, the whole graph is replaced with PUT.
+    """
+
+    def __init__(self, client: FusekiClient, path, source='local', threshold=0.1, batch_size=10000,
+                 logger=logging.getLogger('graph-sync')):
+        """
+        :param client:      The client of the Fuseki dataset.
+        :param path:        Directory where the copies of the last upload of each graph are stored as N-Triples.
+        :param source:      Where the previous content of a graph is taken from: 'local' copy or 'fuseki'.
+        :param threshold:   If more than this fraction of the new graph changed, the whole graph is replaced.
+        :param batch_size:  Maximum number of triples sent with one update request.
+        :param logger:      The logger used.
+        """
+        self.client = client
+        self.path = path
+        self.source = source
+        self.threshold = threshold
+        self.batch_size = batch_size
+        self.logger = logger
+        os.makedirs(self.path, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config, client: FusekiClient):
+        """Create the sync configured in the [sync] section of default.cfg. None if it is not enabled."""
+        if not config.getboolean('sync', 'enabled', fallback=False):
+            return None
+        return cls(client, config['data']['base'] + config.get('data', 'sync', fallback='sync/'),
+                   source=config.get('sync', 'source', fallback='local'),
+                   threshold=config.getfloat('sync', 'threshold', fallback=0.1),
+                   batch_size=config.getint('sync', 'batch_size', fallback=10000))
+
+    def sync(self, graph_name: str, source, content_type: str):
+        """
+        Bring the graph in Fuseki up to date with the content of a file or an in-memory graph.
+
+        :param graph_name:      The name of the graph in Fuseki.
+        :param source:          The file with the new content of the graph or an rdflib Graph.
+        :param content_type:    The MIME type of the file. Used if the graph is replaced.
+        :return:                The number of triples in the graph.
+
+        :raises FusekiError     If the graph could not be replaced.
+        """
+        if isinstance(source, Graph):
+            graph = source
+        else:
+            graph = Graph()
+            graph.parse(source, format=guess_format(source))
+        previous = self.previous(graph_name)
+
+        if previous is None:
+            self.logger.info('Previous content of %s is unknown. Replace graph.', graph_name)
+            self.replace(graph_name, source, content_type)
+        elif has_blank_nodes(graph) or has_blank_nodes(previous):
+            self.logger.info('Graph %s has blank nodes. Replace graph.', graph_name)
+            self.replace(graph_name, source, content_type)
+        else:
+            removed = previous - graph
+            added = graph - previous
+            changes = len(removed) + len(added)
+            if changes > self.threshold * max(len(graph), 1):
+                self.logger.info('%s of %s triples of %s changed. Replace graph.', changes, len(graph), graph_name)
+                self.replace(graph_name, source, content_type)
+            else:
+                try:
+                    self.send_changes(graph_name, removed, added)
+                except FusekiError:
+                    # some batches may have been applied. Replace the graph to get a consistent state.
+                    self.logger.exception('Could not send changes of %s. Replace graph.', graph_name)
+                    self.replace(graph_name, source, content_type)
+
+        graph.serialize(destination=self._copy_path(graph_name), format='nt', encoding='utf-8')
+        return len(graph)
+
+    def send_changes(self, graph_name: str, removed: Graph, added: Graph):
+        """Send the removed and added triples as batched DELETE DATA and INSERT DATA operations."""
+        self.logger.info('Sync %s: %s triples removed, %s triples added.', graph_name, len(removed), len(added))
+        for operation, triples in (('DELETE', list(removed)), ('INSERT', list(added))):
+            for start in range(0, len(triples), self.batch_size):
+                batch = triples[start:start + self.batch_size]
+                self.client.update('{} DATA {{ GRAPH <{}> {{\n{}\n}} }}'.format(operation, graph_name,
+                                                                              triples_to_data(batch)))
+
+    def replace(self, graph_name: str, source, content_type: str):
+        put_graph(graph_name, source, content_type, self.client)
+
+    def previous(self, graph_name: str):
+        """
+        The content of the graph as of the last upload.
+
+        :return: The graph. None if the previous content is not known.
+        """
+        graph = Graph()
+        copy_path = self._copy_path(graph_name)
+        if self.source == 'fuseki':
+            response = self.client.request('GET', 'data', params={'graph': graph_name},
+                                           headers={'Accept': 'application/n-triples'}, stream=True)
+            if not response.ok:
+                return None
+            copy_path += '.fuseki'
+            with open(copy_path, 'wb') as file:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    file.write(chunk)
+        elif not os.path.exists(copy_path):
+            return None
+        graph.parse(copy_path, format='nt')
+        if self.source == 'fuseki':
+            os.remove(copy_path)
+        return graph
+
+    def _copy_path(self, graph_name):
+        return os.path.join(self.path, hashlib.sha256(graph_name.encode('utf-8')).hexdigest() + '.nt')
@@ -1,19 +1,35 @@
 import logging
+import multiprocessing.util
+import shutil
 import zipfile
-import io
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import requests
 import skosify
 from rdflib import Graph, Namespace, URIRef
 from rdflib.util import guess_format
 
-from pyfusekiutil.fuseki_utility import put_graph
+from pyfusekiutil.download_utility import DownloadCache, decompress, CHUNK_SIZE
+from pyfusekiutil.graph_cache import GraphCache
+from pyfusekiutil.disk_store import GraphStorage
+from pyfusekiutil.metrics import Metrics
+from pyfusekiutil.fuseki_utility import put_graph, replace_graph, FusekiClient, NT_MIME_TYPE
 from pyfusekiutil.rdf_utility import *
+from pyfusekiutil.ntriples_utility import NTriplesRules, read_triples, rewrite, write_triples, parse_parallel
 
 """Various update functions for Thesauri/Ontologies which are not in SKOS or proper SKOS."""
 
 
+def archive_graph(config, graph, file_name):
+    """Keep a copy of a transformed vocabulary if an archive folder is configured with archive in [data]."""
+    if config.get('data', 'archive', fallback='') != '':
+        path = config['data']['base'] + config['data']['archive']
+        os.makedirs(path, exist_ok=True)
+        graph.serialize(destination=path + file_name, format='ttl', encoding='utf-8')
+
+
 def update_yarn(config):
     """Download and transform Yet Another RussNet."""
 
@@ -22,6 +38,7 @@ def update_yarn(config):
         os.mkdir(path)
 
     file_name = 'yarn'
+    url = 'http://depot.nlpub.ru/rtlod/yarn.ttl'
 
     LEMON = Namespace('http://lemon-model.net/lemon#')
 
@@ -31,16 +48,23 @@ def update_yarn(config):
     g.bind('lemon', LEMON)
     g.bind('lexinfo', Namespace('http://www.lexinfo.net/ontology/2.0/lexinfo#'))
 
-    g.parse('http://depot.nlpub.ru/rtlod/yarn.ttl', format='ttl')
+    cache = DownloadCache.from_config(config)
+    graph_cache = GraphCache.from_config(config)
+    client = FusekiClient.from_config(config)
+    sources = cache.fetch_sources((url, path + file_name + '.source.ttl'))
+    if sources is None:
+        return
+    graph_cache.parse(g, sources[0], 'ttl')
 
     add_skos_predicate_variant(g, RDFS.label, SKOS.prefLabel)
 
     voc = skosify.skosify(g, mark_top_concepts=True,
                           eliminate_redundancy=True, break_cycles=True, keep_related=False,
                           cleanup_classes=True, cleanup_properties=True, cleanup_unreachable=True)
-    voc.serialize(path + file_name + '.ttl', format='ttl')
+    archive_graph(config, voc, file_name + '.ttl')
 
-    put_graph('http://depot.nlpub.ru/rtlod/yarn.ttl', open(path + file_name + '.ttl').read())
+    put_graph('http://depot.nlpub.ru/rtlod/yarn.ttl', voc, client=client)
+    cache.mark_complete(url)
 
 
 def update_unldc(config):
@@ -51,6 +75,7 @@ def update_unldc(config):
         os.mkdir(path)
 
     file_name = 'unldc'
+    url = 'http://depot.nlpub.ru/rtlod/unldc.ttl'
 
     LEMON = Namespace('http://lemon-model.net/lemon#')
 
@@ -60,16 +85,23 @@ def update_unldc(config):
     g.bind('lemon', LEMON)
     g.bind('lexinfo', Namespace('http://www.lexinfo.net/ontology/2.0/lexinfo#'))
 
-    g.parse('http://depot.nlpub.ru/rtlod/unldc.ttl', format='ttl')
+    cache = DownloadCache.from_config(config)
+    graph_cache = GraphCache.from_config(config)
+    client = FusekiClient.from_config(config)
+    sources = cache.fetch_sources((url, path + file_name + '.source.ttl'))
+    if sources is None:
+        return
+    graph_cache.parse(g, sources[0], 'ttl')
 
     add_skos_predicate_variant(g, RDFS.label, SKOS.prefLabel)
 
     voc = skosify.skosify(g, mark_top_concepts=True,
                           eliminate_redundancy=True, break_cycles=True, keep_related=False,
                           cleanup_classes=True, cleanup_properties=True, cleanup_unreachable=True)
-    voc.serialize(path + file_name + '.ttl', format='ttl')
+    archive_graph(config, voc, file_name + '.ttl')
 
-    put_graph('http://unl.ru/', open(path + file_name + '.ttl').read())
+    put_graph('http://unl.ru/', voc, client=client)
+    cache.mark_complete(url)
 
 
 def update_rusthes(config):
@@ -80,6 +112,7 @@ def update_rusthes(config):
         os.mkdir(path)
 
     file_name = 'ruthes'
+    url = 'http://depot.nlpub.ru/rtlod/ruthes-lite.ttl'
 
     LEMON = Namespace('http://lemon-model.net/lemon#')
 
@@ -89,61 +122,99 @@ def update_rusthes(config):
     g.bind('lemon', LEMON)
     g.bind('lexinfo', Namespace('http://www.lexinfo.net/ontology/2.0/lexinfo#'))
 
-    g.parse('http://depot.nlpub.ru/rtlod/ruthes-lite.ttl', format='ttl')
+    cache = DownloadCache.from_config(config)
+    graph_cache = GraphCache.from_config(config)
+    client = FusekiClient.from_config(config)
+    sources = cache.fetch_sources((url, path + file_name + '.source.ttl'))
+    if sources is None:
+        return
+    graph_cache.parse(g, sources[0], 'ttl')
 
     add_skos_predicate_variant(g, RDFS.label, SKOS.prefLabel)
 
     voc = skosify.skosify(g, mark_top_concepts=True,
                           eliminate_redundancy=True, break_cycles=True, keep_related=False,
                           cleanup_classes=True, cleanup_properties=True, cleanup_unreachable=True)
-    voc.serialize(path + file_name + '.ttl', format='ttl')
+    archive_graph(config, voc, file_name + '.ttl')
 
-    put_graph('http://labinform.ru/pub/ruthes/', open(path + file_name + '.ttl').read())
+    put_graph('http://labinform.ru/pub/ruthes/', voc, client=client)
+    cache.mark_complete(url)
 
 
 def construct_aat_getty(config):
-    """Download and transform the getty thesaurus AAT."""
+    """
+    Download and transform the getty thesaurus AAT.
+
+    The archive members are extracted in chunks. The N-Triples files are parsed in parallel by the number of worker
+    processes configured with workers in the [aat] section and merged into one graph, which is skosified in memory.
+    """
     aat_full = 'http://vocab.getty.edu/dataset/aat/full.zip'
+    ontology = 'http://vocab.getty.edu/ontology.rdf'
     path = config['data']['base'] + config['data']['vocabulary'] + 'aat/'
     if not os.path.exists(path):
         os.mkdir(path)
 
-    file_name = 'aat_full.ttl'
-
     logging.info('Downloading "The Art & Architecture Thesaurus".')
-    response = requests.get(aat_full)
-    if response.ok:
-        logging.info('Download was successful.')
-        buffer = io.BytesIO(response.content)
-        z = zipfile.ZipFile(buffer)
-        for n, i in zip(z.namelist(), z.infolist()):
-            logging.info('Extracting archives...', n)
-            tmp = z.read(i).decode('utf-8')
-            with open(path + str(n), 'w') as file:
-                file.write(tmp)
-                logging.info('Extracted %s to %s', n, path)
-    else:
-        logging.critical('Was unable to download the file. Exit program.')
-        import sys
-        sys.exit(1)
+    cache = DownloadCache.from_config(config)
+    graph_cache = GraphCache.from_config(config)
+    client = FusekiClient.from_config(config)
+    metrics = Metrics.from_config(config)
+    with metrics.stage('aat', 'download') as record:
+        try:
+            sources = cache.fetch_sources((aat_full, path + 'full.zip'),
+                                          (ontology, path + 'ontology.rdf', 'application/rdf+xml'))
+        except requests.exceptions.RequestException:
+            logging.critical('Was unable to download the file. Exit program.', exc_info=True)
+            import sys
+            sys.exit(1)
+        if sources is not None:
+            record['bytes'] = sum(os.path.getsize(source) for source in sources)
+    if sources is None:
+        return
+
+    logging.info('Download was successful.')
+    with metrics.stage('aat', 'extract') as record, zipfile.ZipFile(sources[0]) as archive:
+        record['bytes'] = 0
+        for member in archive.infolist():
+            if member.is_dir():
+                continue
+            file_name = path + os.path.basename(member.filename)
+            logging.info('Extracting %s.', member.filename)
+            with archive.open(member) as source, open(file_name, 'wb') as file:
+                shutil.copyfileobj(source, file, CHUNK_SIZE)
+            record['bytes'] += member.file_size
+            logging.info('Extracted %s to %s', member.filename, path)
 
     logging.info('Begin parsing of the ontology.')
-    aat = Graph()
-    aat.parse('http://vocab.getty.edu/ontology.rdf', format=guess_format('rdf'))
-    logging.info('Parsed base ontology.')
-    aat.parse(path + 'AATOut_Full.nt', format=guess_format('nt'))
-    logging.info('Parsed Full AAT file.')
-    aat.parse(path + 'AATOut_Sources.nt', format=guess_format('nt'))
-    logging.info('Parsed sources file.')
-    aat.parse(path + 'AATOut_Contribs.nt', format=guess_format('nt'))
-    logging.info('Parsed contributors.')
-
-    aat.serialize(path + file_name, format='nt')
-
-    aat = skosify.skosify(path + file_name)
-    aat.serialize(path + file_name, format='ttl')
-
-    put_graph('http://vocab.getty.edu/aat/', open(path + file_name).read())
+    storage = GraphStorage.from_config(config)
+    aat = storage.graph(path + 'AATOut_Full.nt', path)
+    with metrics.stage('aat', 'parse') as record:
+        graph_cache.parse(aat, sources[1], guess_format('rdf'))
+        logging.info('Parsed base ontology.')
+        parse_parallel(aat, [path + 'AATOut_Full.nt', path + 'AATOut_Sources.nt', path + 'AATOut_Contribs.nt'],
+                       workers=config.getint('aat', 'workers', fallback=2),
+                       chunk_size=config.getint('aat', 'chunk_size', fallback=64) * 1024 * 1024)
+        logging.info('Parsed the full AAT, the sources and the contributors.')
+        record['triples_out'] = len(aat)
+
+    with metrics.stage('aat', 'skosify') as record:
+        record['triples_in'] = len(aat)
+        parsed = aat
+        aat = skosify.skosify(parsed)
+        GraphStorage.release(parsed)
+        record['triples_out'] = len(aat)
+    with metrics.stage('aat', 'serialize') as record:
+        # written to disk only once, as it is loaded in chunks from there.
+        aat.serialize(path + 'aat_skosified.nt', format='nt', encoding='utf-8')
+        record['bytes'] = os.path.getsize(path + 'aat_skosified.nt')
+
+    with metrics.stage('aat', 'upload') as record:
+        # AAT is too large to be loaded with a single request.
+        record['bytes'] = os.path.getsize(path + 'aat_skosified.nt')
+        record['triples_out'] = replace_graph('http://vocab.getty.edu/aat/', path + 'aat_skosified.nt', NT_MIME_TYPE,
+                                              client=client, bulk=True)
+    cache.mark_complete(aat_full)
+    cache.mark_complete(ontology)
 
 
 def update_skos(config):
@@ -155,24 +226,34 @@ def update_skos(config):
     file_name = 'skos-core.ttl'
 
     logging.info('Load SKOS vocabulary to %s.', path + file_name)
+    cache = DownloadCache.from_config(config)
+    graph_cache = GraphCache.from_config(config)
+    client = FusekiClient.from_config(config)
+    # the namespace document is served as HTML unless RDF/XML is requested.
+    sources = cache.fetch_sources((uri, path + 'skos-core.rdf', 'application/rdf+xml'))
+    if sources is None:
+        return
     g = Graph()
-    g.parse(uri)
-    add_type(g, OWL.Ontology, SKOS.ConceptScheme)
-    add_type(g, OWL.Class, SKOS.Concept)
-    add_type(g, RDF.Property, SKOS.Concept)
+    graph_cache.parse(g, sources[0], 'xml')
+    rules = GraphRules()
+    rules.type(OWL.Ontology, SKOS.ConceptScheme)
+    rules.type(OWL.Class, SKOS.Concept)
+    rules.type(RDF.Property, SKOS.Concept)
 
-    add_skos_predicate_variant(g, RDFS.label, SKOS.prefLabel)
-    add_skos_predicate_variant(g, DC.title, SKOS.prefLabel)
-    add_skos_predicate_variant(g, DC.identifier, SKOS.notation)
-    add_language_tags(g, 'en')
+    rules.predicate_variant(RDFS.label, SKOS.prefLabel)
+    rules.predicate_variant(DC.title, SKOS.prefLabel)
+    rules.predicate_variant(DC.identifier, SKOS.notation)
+    rules.language_tags('en')
 
-    add_skos_predicate_variant(g, RDFS.subClassOf, SKOS.broader)
-    add_skos_predicate_variant(g, RDFS.subPropertyOf, SKOS.broader)
+    rules.predicate_variant(RDFS.subClassOf, SKOS.broader)
+    rules.predicate_variant(RDFS.subPropertyOf, SKOS.broader)
+    rules.apply(g)
 
     voc = skosify.skosify(g)
-    voc.serialize(path + file_name, format='ttl')
+    archive_graph(config, voc, file_name)
     logging.info('Upload skos to graph %s.', uri)
-    put_graph(uri, open(path + file_name).read())
+    put_graph(uri, voc, client=client)
+    cache.mark_complete(uri)
 
 
 def update_npg_ontology(config):
@@ -182,14 +263,21 @@ def update_npg_ontology(config):
     path = config['data']['base'] + config['data']['temporary']
     file_name = 'npg_relation_onology.ttl'
     logging.info('Load NPG Relation Ontology to %s.', path + file_name)
+    cache = DownloadCache.from_config(config)
+    graph_cache = GraphCache.from_config(config)
+    client = FusekiClient.from_config(config)
+    sources = cache.fetch_sources((url, path + 'npg-relations-ontology.source.ttl'))
+    if sources is None:
+        return
     g = Graph()
-    g.parse(url, format='ttl')
+    graph_cache.parse(g, sources[0], 'ttl')
     add_type(g, OWL.ObjectProperty, SKOS.Concept)
 
     voc = skosify.skosify(g)
-    voc.serialize(destination=path + file_name, format='ttl')
+    archive_graph(config, voc, file_name)
     logging.info('Upload NPG Relation Ontology to graph %s.', uri)
-    put_graph(uri, open(path + file_name).read())
+    put_graph(uri, voc, client=client)
+    cache.mark_complete(url)
 
 
 fast_urls_graph_names = [
@@ -212,100 +300,216 @@ fast_urls_graph_names = [
 ]
 
 
+# The download cache and client of a FAST worker process. The cache keeps its FTP session open for all the facets
+# the worker loads.
+_fast_cache = None
+_fast_client = None
+
+
+def _init_fast_worker(cache: DownloadCache, client: FusekiClient):
+    global _fast_cache, _fast_client
+    _fast_cache = cache
+    _fast_client = client
+    # close the FTP sessions when the worker process exits.
+    multiprocessing.util.Finalize(None, cache.close, exitpriority=10)
+
+
+SCHEMA = Namespace('http://schema.org/')
+PERIOD = Namespace('http://www.productontology.org/id/')
+
+# The labels of the FAST concept schemes. Added if a facet defines the concept scheme.
+fast_scheme_labels = {
+    URIRef('http://id.worldcat.org/fast/ontology/1.0/#fast'): Literal('Fast Concept Scheme (overall)'),
+    URIRef('http://id.worldcat.org/fast/ontology/1.0/#facet-Event'): Literal('Fast Concept Scheme (event term)'),
+    URIRef('http://id.worldcat.org/fast/ontology/1.0/#facet-Chronological'):
+        Literal('Fast Concept Scheme (chronological term)'),
+    URIRef('http://id.worldcat.org/fast/ontology/1.0/#facet-FormGenre'):
+        Literal('Fast Concept Scheme (form or genre term)'),
+    URIRef('http://id.worldcat.org/fast/ontology/1.0/#facet-Geographic'):
+        Literal('Fast Concept Scheme (greographic term)'),
+    URIRef('http://id.worldcat.org/fast/ontology/1.0/#facet-Title'): Literal('Fast Concept Scheme (title term)'),
+    URIRef('http://id.worldcat.org/fast/ontology/1.0/#facet-Topical'): Literal('Fast Concept Scheme (topical term)'),
+    URIRef('http://id.worldcat.org/fast/ontology/1.0/#facet-Corporate'):
+        Literal('Fast Concept Scheme (corporate term)'),
+    URIRef('http://id.worldcat.org/fast/ontology/1.0/#facet-Personal'):
+        Literal('Fast Concept Scheme (personal term)'),
+}
+
+
+def fast_rules():
+    """The transformations applied to each FAST facet."""
+    rules = GraphRules()
+    rules.type(SCHEMA.Event, SKOS.Concept)
+    rules.type(SCHEMA.CreativeWork, SKOS.Concept)
+    rules.type(SCHEMA.Intangible, SKOS.Concept)
+    rules.type(PERIOD.Periodization, SKOS.Concept)
+    rules.type(SCHEMA.Person, SKOS.Concept)
+    rules.type(SCHEMA.Place, SKOS.Concept)
+    rules.type(SCHEMA.Organization, SKOS.Concept)
+    rules.predicate_variant(RDFS.label, SKOS.prefLabel)
+
+    rules.language_tags('en')
+    return rules
+
+
+def add_fast_scheme_labels(triples):
+    """Add the label of each FAST concept scheme after the triple which declares it. Works on N-Triples terms."""
+    labels = dict((scheme.n3(), label.n3()) for scheme, label in fast_scheme_labels.items())
+    declaration = (RDF.type.n3(), SKOS.ConceptScheme.n3())
+    for s, p, o in triples:
+        yield s, p, o
+        if (p, o) == declaration and s in labels:
+            yield s, SKOS.prefLabel.n3(), labels.pop(s)
+
+
+def transform_fast_graph(source, destination, storage: GraphStorage = None):
+    """
+    Parse a FAST facet into a graph, transform and skosify it. Needs several GB of memory for the large facets.
+
+    :param source:      The N-Triples file of the facet.
+    :param destination: The file the skosified facet is written to.
+    :param storage:     Decides whether the facet is parsed into a graph on disk. If None it is parsed into memory.
+    """
+    storage = storage if storage is not None else GraphStorage()
+    g = storage.graph(source, os.path.dirname(destination))
+
+    g.bind('schema', SCHEMA)
+    g.bind('skos', SKOS)
+    g.bind('dct', DCTERMS)
+    g.bind('owl', OWL)
+    g.bind('period', PERIOD)
+
+    g.parse(source, format='nt')
+
+    for scheme, label in fast_scheme_labels.items():
+        if (scheme, RDF.type, SKOS.ConceptScheme) in g:
+            g.add((scheme, SKOS.prefLabel, label))
+
+    fast_rules().apply(g)
+
+    voc = skosify.skosify(g)
+    GraphStorage.release(g)
+    g = None
+    voc.serialize(destination=destination, format='nt', encoding='utf-8')
+
+
+def load_fast_facet(url, graph, temp_path, path, use_skosify=False, storage: GraphStorage = None,
+                    metrics: Metrics = None):
+    """
+    Download, transform and upload a single FAST facet. Runs in a worker process of update_fast.
+
+    By default the facet is transformed line by line with the N-Triples rewriter. This needs almost no memory. With
+    use_skosify the facet is loaded into a graph and skosified as well.
+
+    :param url:         The url of the zipped N-Triples file of the facet.
+    :param graph:       The graph the facet is loaded into.
+    :param temp_path:   Folder for the downloaded file.
+    :param path:        Folder for the decompressed and the transformed file.
+    :param use_skosify: Skosify the facet in memory instead of only applying the transformations to each triple.
+    :param storage:     Decides whether a facet is parsed into a graph on disk before it is skosified.
+    :param metrics:     Records each step under the name of the facet.
+    :return:            A summary of the facet: the graph, its status, the number of triples loaded and the seconds
+                        spent in each step.
+    """
+    logger = logging.getLogger(__name__)
+    metrics = metrics if metrics is not None else Metrics()
+    name = graph.split('/')[-1]
+    summary = {'graph': graph, 'status': 'loaded', 'triples': 0}
+    start = time.monotonic()
+    try:
+        logger.info('Loading %s into %s.', url, graph)
+        file_name = url.split('/')[-1]
+        with metrics.stage(name, 'download') as record:
+            sources = _fast_cache.fetch_sources((url, temp_path + file_name))
+            if sources is not None:
+                record['bytes'] = os.path.getsize(sources[0])
+                file_name = file_name.replace('.zip', '')
+                decompress(sources[0], path + file_name, url)
+                logger.info('Downloaded and saved file in %s%s.', path, file_name)
+        if sources is None:
+            summary['status'] = 'unchanged'
+            return summary
+        summary['download'] = record['wall']
+
+        step = 'skosify' if use_skosify else 'transform'
+        with metrics.stage(name, step) as record:
+            if use_skosify:
+                transformed = file_name.replace('.nt', '.skosified.nt')
+                logger.info('Parsing and skosifying graph from %s.', path + file_name)
+                transform_fast_graph(path + file_name, path + transformed, storage)
+            else:
+                transformed = file_name.replace('.nt', '.transformed.nt')
+                logger.info('Transforming %s.', path + file_name)
+                triples = add_fast_scheme_labels(read_triples(path + file_name))
+                record['triples_out'] = write_triples(rewrite(triples, NTriplesRules.from_rules(fast_rules())),
+                                                      path + transformed)
+            record['bytes'] = os.path.getsize(path + transformed)
+        summary[step] = record['wall']
+        logger.info('Saved changed graph to %s.', path + transformed)
+
+        with metrics.stage(name, 'upload') as record:
+            logger.info('Refactored graph %s and uploading it now.', graph)
+            record['bytes'] = os.path.getsize(path + transformed)
+            summary['triples'] = replace_graph(graph, path + transformed, NT_MIME_TYPE, client=_fast_client,
+                                               bulk=True)
+            record['triples_out'] = summary['triples']
+            _fast_cache.mark_complete(url)
+        summary['upload'] = record['wall']
+        logger.info('Uploaded graph to Fuseki.')
+    except Exception as error:
+        logger.exception('Could not load %s into %s.', url, graph)
+        summary['status'] = 'failed: ' + str(error)
+    finally:
+        summary['total'] = time.monotonic() - start
+    return summary
+
+
 def update_fast(config):
+    """
+    Download, transform and upload all FAST facets.
+
+    The facets are independent of each other and are loaded in parallel by a pool of worker processes. The number of
+    workers is configured with workers in the [fast] section. Each worker downloads with its own FTP session, which
+    is reused for all facets the worker loads. The facets are transformed line by line, unless skosify is enabled
+    in the [fast] section. Then each facet is skosified in memory, which needs several GB per facet.
+    Ends with a summary of the triples loaded and the time taken for each facet.
+    """
     logger = logging.getLogger(__name__)
     temp_path = config['data']['base'] + config['data']['temporary']
+    path = config['data']['base'] + config['data']['vocabulary'] + 'fast/'
+    os.makedirs(path, exist_ok=True)
+    cache = DownloadCache.from_config(config)
+    client = FusekiClient.from_config(config)
+    workers = config.getint('fast', 'workers', fallback=2)
+    use_skosify = config.getboolean('fast', 'skosify', fallback=False)
+    storage = GraphStorage.from_config(config)
+    metrics = Metrics.from_config(config)
+
+    start = time.monotonic()
+    summaries = list()
+    if workers > 1:
+        with ProcessPoolExecutor(workers, initializer=_init_fast_worker, initargs=(cache, client)) as pool:
+            futures = dict((pool.submit(load_fast_facet, url, graph, temp_path, path, use_skosify, storage,
+                                        metrics), graph)
+                           for url, graph in fast_urls_graph_names)
+            for future in as_completed(futures):
+                try:
+                    summaries.append(future.result())
+                except Exception as error:
+                    # happens when the worker process is killed. For example when it runs out of memory.
+                    logger.error('Worker loading %s failed.', futures[future], exc_info=error)
+                    summaries.append({'graph': futures[future], 'status': 'failed: ' + str(error), 'triples': 0})
+    else:
+        _init_fast_worker(cache, client)
+        for url, graph in fast_urls_graph_names:
+            summaries.append(load_fast_facet(url, graph, temp_path, path, use_skosify, storage, metrics))
+        cache.close()
 
-    for url, graph in fast_urls_graph_names:
-        logger.info('Loading %s into %s.', url, graph)
-        import urllib.parse
-        import ftplib
-        parts = urllib.parse.urlparse(url)
-        file_name = parts.path.split('/')[-1]
-        path = parts.path.replace(file_name, '')
-        ftp = ftplib.FTP(parts.netloc)
-        ftp.login()
-        ftp.cwd(path)
-        ftp.retrbinary('RETR ' + file_name, open(temp_path + file_name, 'wb').write)
-        ftp.quit()
-        with open(temp_path + file_name, 'rb') as file:
-            buffer = io.BytesIO(file.read())
-
-        z = zipfile.ZipFile(buffer)
-        text = z.read(z.infolist()[0]).decode('utf-8')
-
-        path = config['data']['base'] + config['data']['vocabulary'] + 'fast/'
-        if not os.path.exists(path):
-            os.makedirs(path)
-        file_name = file_name.replace('.zip', '')
-        with open(path + file_name, 'w', encoding='utf-8') as file:
-            file.write(text)
-
-        logger.info('Downloaded and saved file in %s%s.', path, file_name)
-
-        SCHEMA = Namespace('http://schema.org/')
-        PERIOD = Namespace('http://www.productontology.org/id/')
-
-        g = Graph()
-
-        g.bind('schema', SCHEMA)
-        g.bind('skos', SKOS)
-        g.bind('dct', DCTERMS)
-        g.bind('owl', OWL)
-        g.bind('period', PERIOD)
-
-        logger.info('Parsing graph from %s.', path + file_name)
-        g.parse(path + file_name, format='nt')
-
-        # Concept Scheme Names.
-        fast = URIRef('http://id.worldcat.org/fast/ontology/1.0/#fast')
-        fast_event = URIRef('http://id.worldcat.org/fast/ontology/1.0/#facet-Event')
-        fast_chronological = URIRef('http://id.worldcat.org/fast/ontology/1.0/#facet-Chronological')
-        fast_form_genre = URIRef('http://id.worldcat.org/fast/ontology/1.0/#facet-FormGenre')
-        fast_geographic = URIRef('http://id.worldcat.org/fast/ontology/1.0/#facet-Geographic')
-        fast_title = URIRef('http://id.worldcat.org/fast/ontology/1.0/#facet-Title')
-        fast_topical = URIRef('http://id.worldcat.org/fast/ontology/1.0/#facet-Topical')
-        fast_corporate = URIRef('http://id.worldcat.org/fast/ontology/1.0/#facet-Corporate')
-        fast_personal = URIRef('http://id.worldcat.org/fast/ontology/1.0/#facet-Personal')
-
-        if (fast, RDF.type, SKOS.ConceptScheme) in g:
-            g.add((fast, SKOS.prefLabel, Literal('Fast Concept Scheme (overall)')))
-        if (fast_event, RDF.type, SKOS.ConceptScheme) in g:
-            g.add((fast_event, SKOS.prefLabel, Literal('Fast Concept Scheme (event term)')))
-        if (fast_chronological, RDF.type, SKOS.ConceptScheme) in g:
-            g.add((fast_chronological, SKOS.prefLabel, Literal('Fast Concept Scheme (chronological term)')))
-        if (fast_form_genre, RDF.type, SKOS.ConceptScheme) in g:
-            g.add((fast_form_genre, SKOS.prefLabel, Literal('Fast Concept Scheme (form or genre term)')))
-        if (fast_geographic, RDF.type, SKOS.ConceptScheme) in g:
-            g.add((fast_geographic, SKOS.prefLabel, Literal('Fast Concept Scheme (greographic term)')))
-        if (fast_title, RDF.type, SKOS.ConceptScheme) in g:
-            g.add((fast_title, SKOS.prefLabel, Literal('Fast Concept Scheme (title term)')))
-        if (fast_topical, RDF.type, SKOS.ConceptScheme) in g:
-            g.add((fast_topical, SKOS.prefLabel, Literal('Fast Concept Scheme (topical term)')))
-        if (fast_corporate, RDF.type, SKOS.ConceptScheme) in g:
-            g.add((fast_corporate, SKOS.prefLabel, Literal('Fast Concept Scheme (corporate term)')))
-        if (fast_personal, RDF.type, SKOS.ConceptScheme) in g:
-            g.add((fast_personal, SKOS.prefLabel, Literal('Fast Concept Scheme (personal term)')))
-
-        add_type(g, SCHEMA.Event, SKOS.Concept)
-        add_type(g, SCHEMA.CreativeWork, SKOS.Concept)
-        add_type(g, SCHEMA.Intangible, SKOS.Concept)
-        add_type(g, PERIOD.Periodization, SKOS.Concept)
-        add_type(g, SCHEMA.Person, SKOS.Concept)
-        add_type(g, SCHEMA.Place, SKOS.Concept)
-        add_type(g, SCHEMA.Organization, SKOS.Concept)
-        add_skos_predicate_variant(g, RDFS.label, SKOS.prefLabel)
-
-        add_language_tags(g, 'en')
-
-        file_name = file_name.replace('.nt', '.ttl')
-        voc = skosify.skosify(g)
-        logger.info('Saving changed graph to %s.', path + file_name)
-        voc.serialize(destination=path + file_name, format='ttl')
-
-        logger.info('Refactored graph %s and uploading it now.', graph)
-        put_graph(graph, open(path + file_name).read())
-        logger.info('Uploaded graph to Fuseki.')
+    logger.info('Loaded FAST with %s workers in %.1f seconds:', workers, time.monotonic() - start)
+    for summary in sorted(summaries, key=lambda x: x['graph']):
+        logger.info('%s: %s, %s triples, %s.', summary['graph'].split('/')[-1], summary['status'], summary['triples'],
+                    ', '.join('{} {:.1f} s'.format(step, summary[step])
+                              for step in ('download', 'transform', 'skosify', 'upload', 'total') if step in summary))
 
 
 def update_getty_program_ontology(config):
@@ -329,7 +533,13 @@ def update_getty_program_ontology(config):
     # g.bind('aat', AAT)
 
     logging.info('Load base ontology for getty!')
-    g.parse(ontology, format='xml')
+    cache = DownloadCache.from_config(config)
+    graph_cache = GraphCache.from_config(config)
+    client = FusekiClient.from_config(config)
+    sources = cache.fetch_sources((ontology, path + file_name + '.rdf', 'application/rdf+xml'))
+    if sources is None:
+        return
+    graph_cache.parse(g, sources[0], 'xml')
     logging.info('Finished download and parsing of %s. Begin processing.', ontology)
 
     logging.info('Add skos:prefLabel for rdfs:label.')
@@ -347,36 +557,35 @@ def update_getty_program_ontology(config):
     # remove_subject(g, URIRef('http://vocab.getty.edu/ulan/'))
     # remove_subject(g, URIRef('http://vocab.getty.edu/tgn/'))
 
-    add_type(g, OWL.Ontology, SKOS.ConceptScheme)
-    add_type(g, OWL.Class, SKOS.Concept)
-    add_type(g, OWL.ObjectProperty, SKOS.Concept)
+    rules = GraphRules()
+    rules.type(OWL.Ontology, SKOS.ConceptScheme)
+    rules.type(OWL.Class, SKOS.Concept)
+    rules.type(OWL.ObjectProperty, SKOS.Concept)
 
    # set_in_scheme(g, URIRef('http://vocab.getty.edu/ontology'))
 
-    add_skos_predicate_variant(g, RDFS.isDefinedBy, SKOS.inScheme)
+    rules.predicate_variant(RDFS.isDefinedBy, SKOS.inScheme)
 
     # label transformations
-    # add_skos_predicate_variant(g, RDFS.label, SKOS.prefLabel)
-    # add_skos_predicate_variant(g, DC.title, SKOS.prefLabel)
-    add_skos_predicate_variant(g, DC.identifier, SKOS.notation)
-    add_language_tags(g, 'en')
+    # rules.predicate_variant(RDFS.label, SKOS.prefLabel)
+    # rules.predicate_variant(DC.title, SKOS.prefLabel)
+    rules.predicate_variant(DC.identifier, SKOS.notation)
+    rules.language_tags('en')
 
-    # add_skos_predicate_variant(g, RDFS.comment, SKOS.definition)
-    # add_skos_predicate_variant(g, DCTERMS.description, SKOS.scopeNote)
+    # rules.predicate_variant(RDFS.comment, SKOS.definition)
+    # rules.predicate_variant(DCTERMS.description, SKOS.scopeNote)
 
     # relations transformations
-    add_skos_predicate_variant(g, RDFS.subClassOf, SKOS.broader)
-    add_skos_predicate_variant(g, RDFS.subPropertyOf, SKOS.broader)
-    # add_skos_predicate_variant(g, RDFS.isDefinedBy, SKOS.topConceptOf)
-
-    # replace_triple_object(g, SKOS.ConceptScheme, SKOS.Concept)
+    rules.predicate_variant(RDFS.subClassOf, SKOS.broader)
+    rules.predicate_variant(RDFS.subPropertyOf, SKOS.broader)
+    # rules.predicate_variant(RDFS.isDefinedBy, SKOS.topConceptOf)
 
-    logging.info('Begin serialization.')
-    g.serialize(path + file_name + '.ttl', format='ttl')
-    logging.info('Serialized base ontology and saved in %s.', path + file_name + '.ttl')
+    # rules.replace_object(SKOS.ConceptScheme, SKOS.Concept)
+    rules.apply(g)
 
-    file_name_skosified = file_name + '-skosified'
-    voc = skosify.skosify(path + file_name + '.ttl')
-    voc.serialize(path + file_name_skosified + '.ttl', format='ttl')
+    # the graph is handed to skosify and the upload directly. It is not written to disk and parsed again.
+    voc = skosify.skosify(g)
+    archive_graph(config, voc, file_name + '-skosified.ttl')
 
-    put_graph('http://vocab.getty.edu/ontology', open(path + file_name_skosified + '.ttl').read())
\ No newline at end of file
+    put_graph('http://vocab.getty.edu/ontology', voc, client=client)
+    cache.mark_complete(ontology)
@@ -0,0 +1,132 @@
+import logging
+import os
+import shutil
+
+"""Scratch folders of the vocabulary jobs.
+
+Every job downloads, decompresses and skosifies its vocabulary in a folder of its own, so that jobs running at the
+same time never share a file. The folder is removed with everything in it once the job is finished, whether it
+succeeded or not.
+
+The folders can be placed on a RAM-backed filesystem (for example /dev/shm) with scratch in [workspace]. Before a job
+starts, the free space there is checked against the size of its source. If there is not enough room, the job falls
+back to the temporary folder on disk. If there is not enough room there either, the job is not started.
+
+A resumed job continues in the folder the interrupted job left behind, on whichever filesystem it is.
+"""
+
+# The folder of a job is named after the row of its vocabulary in the sheet.
+JOB_PREFIX = 'row-'
+
+
+class InsufficientSpaceError(OSError):
+    """There is not enough free space for the scratch folder of a job."""
+
+
+def free_space(path: str):
+    """The free space in bytes of the filesystem of path, which may not exist yet."""
+    while not os.path.exists(path):
+        path = os.path.dirname(os.path.normpath(path))
+    return shutil.disk_usage(path).free
+
+
+class Workspace(object):
+    """The scratch folder of a single job. Created when entered and removed with its content when left."""
+
+    def __init__(self, path: str):
+        """
+        :param path:    The folder. Ends with a slash.
+        """
+        self.path = path
+
+    def open(self):
+        """
+        Create the folder. Files already in it are kept, so that a resumed job finds what the interrupted job left.
+
+        :return:    The path of the folder.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        return self.path
+
+    def close(self):
+        """Remove the folder and everything in it."""
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class Workspaces(object):
+    """Places the scratch folders of the jobs on the scratch filesystem or on disk, depending on the free space."""
+
+    def __init__(self, path: str, scratch: str = None, min_free=512, size_factor=4,
+                 logger=logging.getLogger('workspace')):
+        """
+        :param path:        The temporary folder on disk.
+        :param scratch:     A folder on a faster filesystem, which is used instead of path if it has room for the job.
+                            If None all the folders are placed in path.
+        :param min_free:    Free space in MB which must be left on the filesystem when a job starts.
+        :param size_factor: A job needs this many times the size of its source: for the download, the decompressed
+                            source and the skosified graph.
+        :param logger:      The logger used.
+        """
+        self.path = path
+        self.scratch = scratch
+        self.min_free = min_free
+        self.size_factor = size_factor
+        self.logger = logger
+
+    @classmethod
+    def from_config(cls, config):
+        """The workspaces of the temporary folder in [data] and the options in [workspace]."""
+        scratch = config.get('workspace', 'scratch', fallback='')
+        return cls(config['data']['base'] + config['data']['temporary'],
+                   scratch=os.path.join(scratch, '') if scratch != '' else None,
+                   min_free=config.getint('workspace', 'min_free', fallback=512),
+                   size_factor=config.getfloat('workspace', 'size_factor', fallback=4))
+
+    def required(self, size: int = None):
+        """The free space in bytes a job with a source of size bytes needs. size is None if it is unknown."""
+        return self.min_free * 1024 * 1024 + int((size or 0) * self.size_factor)
+
+    def job(self, row: int, size: int = None, resume=False):
+        """
+        The workspace of a job. Not created until it is entered or opened.
+
+        :param row:     The row of the vocabulary in the sheet.
+        :param size:    The size of the source in bytes, if it is known.
+        :param resume:  Whether the run is resumed. The folder an earlier run left for the row is then used again,
+                        without checking the free space. Otherwise such a folder is removed.
+        :return:        The Workspace.
+
+        :raises InsufficientSpaceError  If neither the scratch filesystem nor the temporary folder has enough room.
+        """
+        name = JOB_PREFIX + str(row)
+        paths = (self.scratch, self.path) if self.scratch is not None else (self.path,)
+        for path in paths:
+            if os.path.isdir(path + name):
+                if resume:
+                    self.logger.info('Resume %s in %s.', name, path)
+                    return Workspace(path + name + '/')
+                shutil.rmtree(path + name, ignore_errors=True)
+
+        required = self.required(size)
+        for path in paths:
+            if free_space(path) >= required:
+                return Workspace(path + name + '/')
+            self.logger.info('Not enough space for %s in %s: %.1f MB needed.', name, path, required / 1024 / 1024)
+        raise InsufficientSpaceError('Not enough free space for ' + name + ' in ' +
+                                     ' or '.join(path for path in (self.scratch, self.path) if path is not None) +
+                                     ': ' + str(required // 1024 // 1024) + ' MB needed.')
+
+    def clean(self):
+        """Remove the folders left behind by the jobs of earlier runs."""
+        for path in (self.scratch, self.path):
+            if path is not None and os.path.isdir(path):
+                for name in os.listdir(path):
+                    if name.startswith(JOB_PREFIX) and os.path.isdir(path + name):
+                        shutil.rmtree(path + name, ignore_errors=True)
@@ -26,7 +26,10 @@ setup(
     ],
     keywords='fuseki triple-store skos skosmos skosify',
     packages=['pyfusekiutil'],
-    install_requires=['pygsheets', 'rdflib', 'SPARQLWrapper', 'requests', 'skosify'],
+    install_requires=['pygsheets', 'rdflib', 'requests', 'skosify'],
+    extras_require={
+        'test': ['pytest']
+    },
     entry_points={
         'console_scripts': ['pyfuseki = pyfusekiutil.cli:main']
     }
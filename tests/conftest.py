@@ -0,0 +1,25 @@
+import functools
+import http.server
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def sources(tmp_path):
+    """A folder whose files are served by server."""
+    path = tmp_path / 'sources'
+    path.mkdir()
+    return path
+
+
+@pytest.fixture
+def server(sources):
+    """Serves the files in sources over HTTP. The base url ending with a slash."""
+    handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=str(sources))
+    handler.func.log_message = lambda *args: None
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:' + str(httpd.server_address[1]) + '/'
+    httpd.shutdown()
+    httpd.server_close()
@@ -0,0 +1,123 @@
+import concurrent.futures
+import http.server
+import os
+import threading
+
+from pyfusekiutil.download_utility import DownloadCache
+
+CONTENT = b'<http://example.org/s> <http://example.org/p> "o" .\n' * 10000
+
+
+def fetch(cache, url, destination):
+    path, _ = cache.fetch(url, destination)
+    with open(path, 'rb') as file:
+        return path, file.read()
+
+
+def test_concurrent_fetches_of_one_url(tmp_path, sources, server):
+    (sources / 'facet.nt').write_bytes(CONTENT)
+    cache = DownloadCache(str(tmp_path / 'cache'))
+    with concurrent.futures.ProcessPoolExecutor(4) as executor:
+        futures = [executor.submit(fetch, cache, server + 'facet.nt', str(tmp_path / ('job-' + str(job))))
+                   for job in range(8)]
+        results = [future.result() for future in futures]
+
+    for job, (path, content) in enumerate(results):
+        assert path == str(tmp_path / ('job-' + str(job)))
+        assert content == CONTENT
+    names = os.listdir(str(tmp_path / 'cache'))
+    assert len([name for name in names if name.endswith('.data')]) == 1
+    assert not any(name.endswith('.part') for name in names)
+
+
+def test_unchanged_source_is_served_from_cache(tmp_path, sources, server):
+    (sources / 'a.nt').write_bytes(CONTENT)
+    cache = DownloadCache(str(tmp_path / 'cache'))
+    assert cache.fetch(server + 'a.nt', str(tmp_path / 'first'))[1]
+    path, changed = cache.fetch(server + 'a.nt', str(tmp_path / 'second'))
+    assert not changed
+    assert path == str(tmp_path / 'second')
+    with open(path, 'rb') as file:
+        assert file.read() == CONTENT
+
+
+def test_least_recently_used_files_are_evicted(tmp_path, sources, server):
+    for name in ('a.nt', 'b.nt', 'c.nt'):
+        (sources / name).write_bytes(CONTENT)
+    # room for two of the files.
+    cache = DownloadCache(str(tmp_path / 'cache'), max_size=2 * len(CONTENT) / 1024 / 1024)
+    for used, name in enumerate(('a.nt', 'b.nt', 'c.nt')):
+        cache.fetch(server + name, str(tmp_path / name))
+        os.utime(cache._data_path(server + name), (used, used))
+
+    assert not os.path.exists(cache._data_path(server + 'a.nt'))
+    assert os.path.exists(cache._data_path(server + 'b.nt'))
+    assert os.path.exists(cache._data_path(server + 'c.nt'))
+    # the copy of the job is kept.
+    assert os.path.getsize(str(tmp_path / 'a.nt')) == len(CONTENT)
+
+
+class Negotiation(http.server.BaseHTTPRequestHandler):
+    """Answers with RDF/XML if it is accepted and with HTML otherwise."""
+
+    def do_GET(self):
+        rdf = 'application/rdf+xml' in self.headers.get('Accept', '')
+        body = b'<rdf:RDF/>' if rdf else b'<html/>'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/rdf+xml' if rdf else 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_sources_are_requested_with_accept_header(tmp_path):
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Negotiation)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:' + str(httpd.server_address[1]) + '/core'
+    try:
+        cache = DownloadCache(None)
+        html, rdf = cache.fetch_sources((url, str(tmp_path / 'core.html')),
+                                        (url, str(tmp_path / 'core.rdf'), 'application/rdf+xml'))
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+    with open(html, 'rb') as file:
+        assert file.read() == b'<html/>'
+    with open(rdf, 'rb') as file:
+        assert file.read() == b'<rdf:RDF/>'
+
+
+class NoHead(http.server.BaseHTTPRequestHandler):
+    """Refuses HEAD requests and answers ranged GET requests."""
+
+    def do_HEAD(self):
+        self.send_response(403)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        self.send_response(206)
+        self.send_header('Content-Range', 'bytes 0-0/' + str(len(CONTENT)))
+        self.send_header('Content-Length', '1')
+        self.end_headers()
+        self.wfile.write(CONTENT[:1])
+
+    def log_message(self, *args):
+        pass
+
+
+def test_probe_falls_back_to_ranged_get(tmp_path, sources, server):
+    (sources / 'a.nt').write_bytes(CONTENT)
+    cache = DownloadCache(None)
+    assert cache.probe(server + 'a.nt') == len(CONTENT)
+
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), NoHead)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    try:
+        assert cache.probe('http://127.0.0.1:' + str(httpd.server_address[1]) + '/a.nt') == len(CONTENT)
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
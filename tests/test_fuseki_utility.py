@@ -0,0 +1,54 @@
+from pyfusekiutil.fuseki_utility import bulk_load, blank_nodes
+
+
+class Response(object):
+    ok = True
+
+
+class Client(object):
+    """Stands in for a FusekiClient. Keeps the triples of every chunk sent."""
+
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+        self.chunks = list()
+
+    def upload(self, method, uri, path, content_type):
+        with open(path, 'rb') as file:
+            self.chunks.append((method, file.read().splitlines()))
+        return Response()
+
+
+def test_blank_nodes_of_subject_and_object():
+    assert blank_nodes(b'_:a <http://example.org/p> _:b .\n') == [b'_:a', b'_:b']
+    assert blank_nodes(b'<http://example.org/s> <http://example.org/p> _:b.\n') == [b'_:b']
+    assert blank_nodes(b'<http://example.org/s> <http://example.org/p> "a _:b c" .\n') == []
+    assert blank_nodes(b'<http://example.org/s> <http://example.org/p> <http://example.org/_:b> .\n') == []
+
+
+def test_bulk_load_keeps_connected_blank_nodes_in_one_chunk(tmp_path):
+    lines = [
+        b'<http://example.org/s1> <http://example.org/p> "literal with _: in it" .',
+        b'<http://example.org/s1> <http://example.org/p> _:a .',
+        b'<http://example.org/s2> <http://example.org/p> _:c .',
+        b'_:a <http://example.org/p> _:b .',
+        b'<http://example.org/s2> <http://example.org/p> "o" .',
+        b'_:b <http://example.org/p> "o" .',
+        b'_:c <http://example.org/p> "o" .',
+        b'_:d <http://example.org/p> "o" .',
+    ]
+    path = str(tmp_path / 'graph.nt')
+    with open(path, 'wb') as file:
+        file.write(b'\n'.join(lines) + b'\n')
+    client = Client(chunk_size=2)
+
+    assert bulk_load('http://example.org/graph', path, client) == len(lines)
+
+    methods = [method for method, _ in client.chunks]
+    assert methods == ['PUT', 'POST', 'POST', 'POST']
+    # the literal containing '_:' is loaded with the other triples without blank nodes.
+    assert client.chunks[0][1] == [lines[0], lines[4]]
+    # _:a and _:b are connected and exceed the chunk size together. The group of _:c fills the next chunk.
+    assert client.chunks[1][1] == [lines[1], lines[3], lines[5]]
+    assert client.chunks[2][1] == [lines[2], lines[6]]
+    assert client.chunks[3][1] == [lines[7]]
+    assert sorted(tmp_path.iterdir()) == [tmp_path / 'graph.nt']
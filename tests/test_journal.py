@@ -0,0 +1,90 @@
+import sqlite3
+
+from pyfusekiutil.core_fuseki_update import TITLE, URL, FILE_TYPE, SHORT_NAME, SPARQL_GRAPH_NAME, READY, \
+    SheetUpdate, create_job
+from pyfusekiutil.download_utility import DownloadCache
+from pyfusekiutil.fuseki_stub import FusekiStub
+from pyfusekiutil.fuseki_utility import FusekiClient
+from pyfusekiutil.journal import RunJournal, UPLOADED, SKOSIFIED
+from pyfusekiutil.manifest import UploadManifest
+from pyfusekiutil.pipeline import VocabularyPipeline
+from pyfusekiutil.workspace import Workspaces
+
+VOCABULARY = '''@prefix skos: <http://www.w3.org/2004/02/skos/core#> .
+<http://example.org/{0}/scheme> a skos:ConceptScheme .
+<http://example.org/{0}/1> a skos:Concept ; skos:prefLabel "one"@en ; skos:inScheme <http://example.org/{0}/scheme> .
+<http://example.org/{0}/2> a skos:Concept ; skos:prefLabel "two"@en ; skos:broader <http://example.org/{0}/1> .
+'''
+
+
+def jobs(url, client, journal):
+    result = list()
+    for number in range(5):
+        row = [''] * 12
+        row[TITLE] = 'Vocabulary ' + str(number)
+        row[URL] = url + 'v' + str(number) + '.ttl'
+        row[FILE_TYPE] = 'ttl'
+        row[SHORT_NAME] = 'v' + str(number)
+        row[SPARQL_GRAPH_NAME] = 'http://example.org/graph/' + str(number)
+        row[READY] = 'y'
+        i = number + 2
+        fuseki = create_job(row, DownloadCache(None), UploadManifest(None), client, in_memory=False,
+                            journal=journal, i=i)
+        journal.add(i, fuseki)
+        result.append((i, fuseki))
+    return result
+
+
+def test_pipeline_writes_journal_from_main_process(tmp_path, sources, server):
+    for number in range(5):
+        (sources / ('v' + str(number) + '.ttl')).write_text(VOCABULARY.format('v' + str(number)))
+    journal = RunJournal(str(tmp_path / 'journal.sqlite'))
+    journal.start()
+    with FusekiStub() as stub:
+        pipeline = VocabularyPipeline(download_workers=3, skosify_workers=2,
+                                      workspaces=Workspaces(str(tmp_path / 'temporary') + '/', min_free=0))
+        updates = dict()
+        for i, update in pipeline.run(jobs(server, FusekiClient(stub.url), journal)):
+            journal.finished(i, update)
+            updates[i] = update
+    journal.finish()
+
+    assert sorted(updates) == [2, 3, 4, 5, 6]
+    for update in updates.values():
+        assert update.error_type == ''
+        assert update.triple_count != ''
+
+    database = sqlite3.connect(str(tmp_path / 'journal.sqlite'))
+    rows = database.execute('SELECT row, state, reached, skosified FROM jobs ORDER BY row').fetchall()
+    assert [row[0] for row in rows] == [2, 3, 4, 5, 6]
+    for _, state, reached, skosified in rows:
+        assert state == UPLOADED
+        assert reached == SKOSIFIED
+        assert skosified is not None
+    assert database.execute('SELECT finished FROM runs').fetchone()[0] is not None
+
+
+def test_resume_returns_results_of_finished_rows(tmp_path):
+    path = str(tmp_path / 'journal.sqlite')
+
+    class Row(object):
+        title, url, sparql_graph = 'Vocabulary', 'http://example.org/v.ttl', 'http://example.org/graph'
+
+    journal = RunJournal(path)
+    journal.start()
+    assert journal.add(2, Row()) is None
+    assert journal.add(3, Row()) is None
+    update = SheetUpdate()
+    update.triple_count = 10
+    journal.finished(2, update)
+
+    resumed = RunJournal(path, resume=True)
+    resumed.start()
+    assert resumed.resumed
+    assert resumed.add(2, Row())['triple_count'] == 10
+    assert resumed.add(3, Row()) is None
+
+    resumed.finish()
+    again = RunJournal(path, resume=True)
+    again.start()
+    assert not again.resumed
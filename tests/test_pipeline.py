@@ -0,0 +1,71 @@
+import os
+import signal
+
+from pyfusekiutil.core_fuseki_update import SheetUpdate
+from pyfusekiutil.journal import RunJournal
+from pyfusekiutil.pipeline import VocabularyPipeline
+from pyfusekiutil.workspace import Workspaces
+
+
+class Job(object):
+    """Stands in for a FusekiUpdate. The skosify process of a job with kill set is killed."""
+
+    def __init__(self, title, kill=False):
+        self.title = title
+        self.kill = kill
+        self.size = None
+        self.temp_path = None
+        self.sheet_updates = SheetUpdate()
+        self.journal = RunJournal(None)
+
+    def download(self):
+        pass
+
+    def skosify(self):
+        if self.kill:
+            os.kill(os.getpid(), signal.SIGKILL)
+        self.sheet_updates.namespace = 'http://example.org/' + self.title + '/'
+
+    def upload(self):
+        self.sheet_updates.triple_count = '1'
+
+    def skosify_and_upload(self):
+        self.skosify()
+        self.upload()
+
+    def record_skosified(self):
+        pass
+
+    def release_graph(self):
+        pass
+
+
+def run(tmp_path, jobs, **options):
+    pipeline = VocabularyPipeline(workspaces=Workspaces(str(tmp_path) + '/', min_free=0), **options)
+    return dict(pipeline.run(list(enumerate(jobs))))
+
+
+def test_pipeline_runs_all_stages(tmp_path):
+    updates = run(tmp_path, [Job('a'), Job('b'), Job('c')])
+    assert sorted(updates) == [0, 1, 2]
+    assert all(update.triple_count == '1' for update in updates.values())
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_killed_skosify_process_only_fails_its_row(tmp_path):
+    jobs = [Job('a'), Job('b'), Job('killed', kill=True), Job('c'), Job('d'), Job('e')]
+    updates = run(tmp_path, jobs, skosify_workers=2)
+    assert sorted(updates) == list(range(len(jobs)))
+    assert updates[2].error_type == 'SKOSIFY KILLED'
+    assert updates[2].triple_count == ''
+    for row in (0, 1, 3, 4, 5):
+        assert updates[row].error_type == ''
+        assert updates[row].triple_count == '1'
+
+
+def test_killed_skosify_process_with_memory_handoff(tmp_path):
+    jobs = [Job('killed', kill=True), Job('a'), Job('b')]
+    updates = run(tmp_path, jobs, skosify_workers=1, handoff='memory')
+    assert updates[0].error_type == 'SKOSIFY KILLED'
+    assert updates[1].triple_count == '1'
+    assert updates[2].triple_count == '1'
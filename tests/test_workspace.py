@@ -0,0 +1,29 @@
+import os
+
+from pyfusekiutil.workspace import Workspaces
+
+
+def workspaces(tmp_path):
+    scratch = tmp_path / 'scratch'
+    disk = tmp_path / 'disk'
+    scratch.mkdir(exist_ok=True)
+    disk.mkdir(exist_ok=True)
+    return Workspaces(str(disk) + '/', scratch=str(scratch) + '/', min_free=0)
+
+
+def test_resumed_job_reuses_its_folder_on_disk(tmp_path):
+    # the interrupted job had to fall back to the disk.
+    os.makedirs(str(tmp_path / 'disk' / 'row-2'))
+    (tmp_path / 'disk' / 'row-2' / 'download').write_text('partial')
+
+    workspace = workspaces(tmp_path).job(2, resume=True)
+    assert workspace.path == str(tmp_path / 'disk' / 'row-2') + '/'
+    assert os.listdir(workspace.open()) == ['download']
+
+
+def test_stale_folder_is_removed_unless_resumed(tmp_path):
+    os.makedirs(str(tmp_path / 'disk' / 'row-2'))
+
+    workspace = workspaces(tmp_path).job(2)
+    assert workspace.path == str(tmp_path / 'scratch' / 'row-2') + '/'
+    assert not os.path.exists(str(tmp_path / 'disk' / 'row-2'))